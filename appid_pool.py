@@ -0,0 +1,251 @@
+import time
+import sqlite3
+import datetime
+import threading
+
+
+# outcomes of a request reported to AppIdPool.report
+OK = "ok"
+THROTTLED = "throttled"
+ERROR = "error"
+INVALID = "invalid"
+
+# RESULT.STATUS of e-Stat API when the appId is not accepted
+INVALID_APP_ID_STATUS = 100
+
+
+def outcome(status_code, content=None):
+    """
+    Return the (outcome, error) of a response to report to AppIdPool.report.
+
+    Args:
+    =====
+    status_code: int
+        HTTP status
+    content: bytes
+        body whose RESULT.STATUS is checked (None: not checked)
+    """
+    # scheduler imports requests, which the async client does not need
+    from scheduler import RETRY_HTTP_STATUSES, THROTTLE_HTTP_STATUSES, api_status
+
+    if status_code in THROTTLE_HTTP_STATUSES:
+        return THROTTLED, f"HTTP {status_code}"
+    if status_code in RETRY_HTTP_STATUSES:
+        return ERROR, f"HTTP {status_code}"
+    if content is not None and status_code == 200:
+        status, message = api_status(content)
+        if status == INVALID_APP_ID_STATUS:
+            return INVALID, f"STATUS {status}: {message}"
+    return OK, None
+
+
+class AppIdPoolExhausted(Exception):
+    """
+    Every appId of the pool is disabled or over its daily quota.
+    """
+
+
+class AppIdPool:
+    """
+    Several application IDs used in turn by a client, with per-key
+    request counts and quota accounting shared by every process using the
+    same state file (SQLite).
+
+    Every request takes the usable key with the fewest requests today.
+    Keys which are throttled (429/503) or erroring (5xx) cool down for a while
+    (doubling with each consecutive failure), keys rejected by the API
+    (RESULT.STATUS 100) are disabled, and keys which reached `daily_quota`
+    are skipped until the next day.
+
+        pool = AppIdPool(["appid1", "appid2"], state_path="./downloads/appids.sqlite3")
+        client = EstatRestApiClient(app_id=pool)
+
+    Args:
+    =====
+    app_ids: list of str
+        application IDs
+    state_path: str
+        shared state file (default: in memory, this process only)
+    daily_quota: int
+        max requests per key and per day (None = no limit)
+    cooldown: float
+        seconds a key is avoided after a failure (doubled for each
+        consecutive failure)
+    max_cooldown: float
+        max seconds a key is avoided
+    """
+
+    def __init__(self, app_ids, state_path=None, daily_quota=None, cooldown=30.0, max_cooldown=900.0):
+        self.app_ids = list(dict.fromkeys(app_ids))
+        if not self.app_ids:
+            raise ValueError("AppIdPool needs at least one appId")
+        self.state_path = ":memory:" if state_path is None else state_path
+        self.daily_quota = daily_quota
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self._lock = threading.Lock()
+        # autocommit mode: transactions are opened explicitly (BEGIN IMMEDIATE)
+        self._conn = sqlite3.connect(self.state_path, check_same_thread=False, isolation_level=None, timeout=30)
+        if self.state_path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS app_ids ("
+            " app_id TEXT PRIMARY KEY,"
+            " day TEXT,"
+            " requests INTEGER DEFAULT 0,"
+            " total INTEGER DEFAULT 0,"
+            " throttles INTEGER DEFAULT 0,"
+            " errors INTEGER DEFAULT 0,"
+            " failures INTEGER DEFAULT 0,"
+            " cooldown_until REAL DEFAULT 0,"
+            " disabled INTEGER DEFAULT 0,"
+            " last_error TEXT)"
+        )
+        self._conn.executemany(
+            "INSERT OR IGNORE INTO app_ids (app_id, day) VALUES (?, ?)",
+            [(app_id, self._today()) for app_id in self.app_ids],
+        )
+
+    def __len__(self):
+        return len(self.app_ids)
+
+    def __repr__(self):
+        return f"<AppIdPool {len(self.app_ids)} keys>"
+
+    @staticmethod
+    def _today():
+        return datetime.date.today().isoformat()
+
+    def _transaction(self, func, *args):
+        # BEGIN IMMEDIATE: the other processes wait for this read-modify-write
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = func(*args)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            return result
+
+    def acquire(self):
+        """
+        Return the appId to send the next request with, and count the request.
+        """
+        return self._transaction(self._acquire)
+
+    def _acquire(self):
+        today = self._today()
+        now = time.time()
+        placeholders = ", ".join("?" for _ in self.app_ids)
+        self._conn.execute(
+            f"UPDATE app_ids SET day = ?, requests = 0 WHERE day != ? AND app_id IN ({placeholders})",
+            [today, today] + self.app_ids,
+        )
+        rows = self._conn.execute(
+            f"SELECT app_id, requests, cooldown_until FROM app_ids"
+            f" WHERE disabled = 0 AND app_id IN ({placeholders})",
+            self.app_ids,
+        ).fetchall()
+        if self.daily_quota is not None:
+            rows = [row for row in rows if row[1] < self.daily_quota]
+        if not rows:
+            raise AppIdPoolExhausted("every appId is disabled or over its daily quota")
+        ready = [row for row in rows if row[2] <= now]
+        if ready:
+            app_id = min(ready, key=lambda row: (row[1], self.app_ids.index(row[0])))[0]
+        else:
+            # every key is cooling down: the one which recovers first
+            app_id = min(rows, key=lambda row: row[2])[0]
+        self._conn.execute(
+            "UPDATE app_ids SET requests = requests + 1, total = total + 1 WHERE app_id = ?", (app_id,)
+        )
+        return app_id
+
+    def report(self, app_id, outcome, error=None):
+        """
+        Record the outcome of a request sent with `app_id`:
+        OK, THROTTLED (429/503), ERROR (500/502/504) or INVALID
+        (the API rejected the appId).
+        """
+        if app_id not in self.app_ids:
+            return
+        if outcome == OK:
+            # most requests succeed: skip the write when there is nothing to reset
+            with self._lock:
+                self._conn.execute(
+                    "UPDATE app_ids SET failures = 0 WHERE app_id = ? AND failures != 0", (app_id,)
+                )
+            return
+        self._transaction(self._report_failure, app_id, outcome, error)
+
+    def _report_failure(self, app_id, outcome, error):
+        if outcome == INVALID:
+            self._conn.execute(
+                "UPDATE app_ids SET disabled = 1, errors = errors + 1, last_error = ? WHERE app_id = ?",
+                (error, app_id),
+            )
+            return
+        failures = self._conn.execute(
+            "SELECT failures FROM app_ids WHERE app_id = ?", (app_id,)
+        ).fetchone()[0] + 1
+        cooldown_until = time.time() + min(self.max_cooldown, self.cooldown * 2 ** (failures - 1))
+        column = "throttles" if outcome == THROTTLED else "errors"
+        self._conn.execute(
+            f"UPDATE app_ids SET {column} = {column} + 1, failures = ?, cooldown_until = ?, last_error = ?"
+            " WHERE app_id = ?",
+            (failures, cooldown_until, error, app_id),
+        )
+
+    def send(self, func, url, params=None, check_status=True, **kwargs):
+        """
+        Send one request `func(url, params=..., **kwargs)` (e.g. session.get)
+        with an appId of the pool and report its outcome. A key rejected by
+        the API is disabled and the request sent again with the next one.
+
+        Passed as the request function of RequestScheduler.call, every
+        retry takes a key again, so throttled keys are left alone.
+
+        Args:
+        =====
+        check_status: bool
+            check RESULT.STATUS in the head of the body
+            (reads the whole body of streamed responses)
+        """
+        params = {} if params is None else params
+        for attempt in range(len(self.app_ids)):
+            app_id = self.acquire()
+            # connection errors say nothing about the key: only responses are reported
+            res = func(url, params=dict(params, appId=app_id), **kwargs)
+            content = res.content if check_status and res.status_code == 200 else None
+            result, error = outcome(res.status_code, content)
+            self.report(app_id, result, error)
+            if result == INVALID and attempt < len(self.app_ids) - 1:
+                res.close()
+                continue
+            return res
+
+    def enable(self, app_id):
+        """
+        Use a disabled key again.
+        """
+        with self._lock:
+            self._conn.execute(
+                "UPDATE app_ids SET disabled = 0, failures = 0, cooldown_until = 0 WHERE app_id = ?", (app_id,)
+            )
+
+    def stats(self):
+        """
+        Return one dict per key: requests (today), total, throttles, errors,
+        cooldown_until, disabled, last_error.
+        """
+        placeholders = ", ".join("?" for _ in self.app_ids)
+        with self._lock:
+            cursor = self._conn.execute(
+                f"SELECT * FROM app_ids WHERE app_id IN ({placeholders})", self.app_ids
+            )
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def close(self):
+        self._conn.close()
@@ -0,0 +1,291 @@
+"""
+Benchmarks of EstatRestApiClient and io_utils against a local mock e-Stat
+server (benchmarks/mock_server.py), without spending API quota.
+
+    python benchmarks/bench.py
+    python benchmarks/bench.py --scenarios stats_data_pages,download_all_csv --workers 20 --latency 0.01
+    python benchmarks/bench.py --json results.json
+
+Every scenario runs in its own process so that its peak RSS is measured
+separately. Reported metrics: operations/sec, latency percentiles of each
+operation, peak RSS and bytes/sec served by the mock server.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mock_server import MockEstatServer  # noqa: E402
+
+
+def _timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    func(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def _client(config):
+    from estat_api import EstatRestApiClient
+    from session import EstatSession
+    from scheduler import RequestScheduler
+
+    return EstatRestApiClient(
+        base_url=config["base_url"],
+        session=EstatSession(pool_maxsize=config["workers"]),
+        scheduler=RequestScheduler(max_concurrency=config["workers"], backoff=0.05),
+    )
+
+
+def _pages(iterator):
+    # latency of each page as seen by the caller
+    latencies = []
+    start = time.perf_counter()
+    for _ in iterator:
+        now = time.perf_counter()
+        latencies.append(now - start)
+        start = now
+    return latencies
+
+
+def bench_meta_info(config):
+    client = _client(config)
+    with ThreadPoolExecutor(max_workers=config["workers"]) as executor:
+        return list(executor.map(
+            lambda table_id: _timed(client.getMetaInfo, format="json", statsDataId=table_id, logging=False),
+            config["table_ids"],
+        ))
+
+
+def bench_stats_list_pages(config):
+    client = _client(config)
+    return _pages(client.iterStatsList(format="json", limit=config["list_limit"], logging=False))
+
+
+def bench_stats_data_pages(config):
+    client = _client(config)
+    return _pages(client.iterStatsData(
+        format="json", statsDataId=config["table_ids"][0], limit=config["limit"], prefetch=True, logging=False,
+    ))
+
+
+def bench_stats_data_compact(config):
+    client = _client(config)
+    return _pages(client.iterStatsData(
+        format="compact", statsDataId=config["table_ids"][0], limit=config["limit"], prefetch=True, logging=False,
+    ))
+
+
+def bench_stats_data_rows(config):
+    client = _client(config)
+    latencies = []
+    for table_id in config["table_ids"][:config["tables"]]:
+        start = time.perf_counter()
+        for _ in client.iterStatsDataRows(format="csv", statsDataId=table_id, limit=config["limit"], logging=False):
+            pass
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def bench_stats_data_frame(config):
+    client = _client(config)
+    return [
+        _timed(client.getStatsDataFrame, statsDataId=table_id, limit=config["limit"], logging=False)
+        for table_id in config["table_ids"][:config["tables"]]
+    ]
+
+
+def bench_stats_data_sharded(config):
+    client = _client(config)
+    return [
+        _timed(
+            client.getStatsDataFrameSharded, table_id, n_shards=config["workers"],
+            max_workers=config["workers"], limit=config["limit"], logging=False,
+        )
+        for table_id in config["table_ids"][:config["tables"]]
+    ]
+
+
+def _bench_download_all(config, func_name, ext, **kwargs):
+    import io_utils
+
+    client = _client(config)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        urls = [f"{config['files_url']}/{i}.{ext}" for i in range(config["files"])]
+        filepathes = [os.path.join(tmp_dir, f"{i}.{ext}") for i in range(config["files"])]
+        func = getattr(io_utils, func_name)
+        start = time.perf_counter()
+        func(
+            urls, filepathes, max_workers=config["workers"],
+            session=client.session, scheduler=client.scheduler, **kwargs
+        )
+        # download_all_* do not report per-file timings
+        return [(time.perf_counter() - start) / len(urls)] * len(urls)
+
+
+def bench_download_all_csv(config):
+    return _bench_download_all(config, "download_all_csv", "csv", chunk_size=config["chunk_size"], dec="latin-1", enc="latin-1")
+
+
+def bench_download_all_zip(config):
+    return _bench_download_all(config, "download_all_zip", "zip", chunk_size=config["chunk_size"])
+
+
+def bench_download_all_blobs(config):
+    # every file is downloaded under two names: the second pass is answered
+    # 304 and linked to the blob of the first one
+    import io_utils
+    from blobs import BlobStore
+
+    client = _client(config)
+    latencies = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        store = BlobStore(os.path.join(tmp_dir, "blobs"))
+        urls = [f"{config['files_url']}/{i}.zip" for i in range(config["files"])]
+        for copy in range(2):
+            filepathes = [os.path.join(tmp_dir, f"{copy}-{i}.zip") for i in range(config["files"])]
+            start = time.perf_counter()
+            io_utils.download_all_zip(
+                urls, filepathes, max_workers=config["workers"], session=client.session,
+                scheduler=client.scheduler, chunk_size=config["chunk_size"], blob_store=store,
+            )
+            latencies.extend([(time.perf_counter() - start) / len(urls)] * len(urls))
+        store.close()
+    return latencies
+
+
+SCENARIOS = {
+    "meta_info": bench_meta_info,
+    "stats_list_pages": bench_stats_list_pages,
+    "stats_data_pages": bench_stats_data_pages,
+    "stats_data_compact": bench_stats_data_compact,
+    "stats_data_rows": bench_stats_data_rows,
+    "stats_data_frame": bench_stats_data_frame,
+    "stats_data_sharded": bench_stats_data_sharded,
+    "download_all_csv": bench_download_all_csv,
+    "download_all_zip": bench_download_all_zip,
+    "download_all_blobs": bench_download_all_blobs,
+}
+
+
+def _run_scenario(name, config, queue):
+    import resource
+    # imports are not part of the timings
+    import estat_api  # noqa: F401
+    import io_utils  # noqa: F401
+
+    start = time.perf_counter()
+    try:
+        latencies = SCENARIOS[name](config)
+        error = None
+    except Exception as e:
+        latencies, error = [], repr(e)
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        peak_rss //= 1024
+    queue.put({
+        "latencies": latencies,
+        "elapsed": time.perf_counter() - start,
+        "peak_rss_kib": peak_rss,
+        "error": error,
+    })
+
+
+def percentile(values, q):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(q / 100 * (len(values) - 1)))))
+    return values[index]
+
+
+def run(name, config, server):
+    """
+    Run one scenario in a child process and return its metrics.
+    """
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    requests_before, bytes_before = server.requests, server.bytes_sent
+    process = ctx.Process(target=_run_scenario, args=(name, config, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    # wall time of the scenario itself, without process start-up and imports
+    elapsed = result["elapsed"]
+    latencies = result["latencies"]
+    return {
+        "scenario": name,
+        "ops": len(latencies),
+        "elapsed_s": elapsed,
+        "ops_per_s": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p90_ms": percentile(latencies, 90) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "requests": server.requests - requests_before,
+        "mb_per_s": (server.bytes_sent - bytes_before) / elapsed / 1e6 if elapsed else 0.0,
+        "peak_rss_mb": result["peak_rss_kib"] / 1024,
+        "error": result["error"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default="all", help="comma separated: " + ",".join(SCENARIOS))
+    parser.add_argument("--workers", type=int, default=10)
+    parser.add_argument("--tables", type=int, default=20, help="number of tables of the mock server")
+    parser.add_argument("--areas", type=int, default=200, help="area codes per table")
+    parser.add_argument("--times", type=int, default=20, help="time codes per table")
+    parser.add_argument("--cats", type=int, default=5, help="cat01 codes per table")
+    parser.add_argument("--limit", type=int, default=5000, help="rows per getStatsData page")
+    parser.add_argument("--files", type=int, default=50, help="files of the download_all_* scenarios")
+    parser.add_argument("--file-size", type=int, default=1024 * 1024)
+    parser.add_argument("--chunk-size", type=int, default=1024 * 1024)
+    parser.add_argument("--latency", type=float, default=0.0, help="server latency in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of 503 responses")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    names = list(SCENARIOS) if args.scenarios == "all" else args.scenarios.split(",")
+    server = MockEstatServer(
+        n_tables=args.tables, n_cats=args.cats, n_areas=args.areas, n_times=args.times,
+        latency=args.latency, error_rate=args.error_rate, file_size=args.file_size,
+    ).start()
+    config = {
+        "base_url": server.base_url,
+        "files_url": server.files_url,
+        "table_ids": [table.table_id for table in server.tables],
+        "tables": min(args.tables, 5),
+        "workers": args.workers,
+        "limit": args.limit,
+        "list_limit": max(1, args.tables // 5),
+        "files": args.files,
+        "chunk_size": args.chunk_size,
+    }
+    results = []
+    print(f"{'scenario':<20} {'ops':>6} {'ops/s':>9} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'reqs':>6} {'MB/s':>8} {'RSS MB':>8}")
+    try:
+        for name in names:
+            result = run(name, config, server)
+            results.append(result)
+            print(
+                f"{name:<20} {result['ops']:>6} {result['ops_per_s']:>9.1f} {result['p50_ms']:>9.1f}"
+                f" {result['p90_ms']:>9.1f} {result['p99_ms']:>9.1f} {result['requests']:>6}"
+                f" {result['mb_per_s']:>8.2f} {result['peak_rss_mb']:>8.1f}"
+                + (f"  ERROR {result['error']}" if result["error"] else "")
+            )
+    finally:
+        server.stop()
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Import-time benchmark and guard: every module is imported in a fresh
+interpreter, and the run fails (exit status 1) when an import takes longer
+than its budget or loads a heavy dependency which only some features need.
+
+    python benchmarks/bench_import.py
+    python benchmarks/bench_import.py --repeat 10 --budget estat_api=150
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# module -> budget in milliseconds (median time of the import statement
+# itself, without the interpreter start-up)
+BUDGETS = {
+    "estat_api": 200,
+    "io_utils": 200,
+    "estat_api_async": 150,
+    "catalog": 50,
+    "store": 50,
+    "harvester": 50,
+}
+
+# loaded on first use only
+HEAVY_MODULES = ("pandas", "numpy", "xlrd", "tqdm", "pyarrow", "aiohttp", "orjson")
+
+SNIPPET = """
+import sys, time, json
+sys.path.insert(0, {root!r})
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"ms": elapsed * 1000, "heavy": [name for name in {heavy!r} if name in sys.modules]}}))
+"""
+
+
+def measure(module, repeat=5):
+    """
+    Import `module` in `repeat` fresh interpreters and return
+    (median milliseconds, heavy modules loaded by the import).
+    """
+    timings = []
+    heavy = set()
+    for _ in range(repeat):
+        out = subprocess.run(
+            [sys.executable, "-c", SNIPPET.format(root=ROOT, module=module, heavy=HEAVY_MODULES)],
+            capture_output=True, text=True, check=True,
+        ).stdout
+        result = json.loads(out.strip().splitlines()[-1])
+        timings.append(result["ms"])
+        heavy.update(result["heavy"])
+    return statistics.median(timings), sorted(heavy)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--budget", action="append", default=[], help="module=milliseconds (repeatable)")
+    args = parser.parse_args()
+
+    budgets = dict(BUDGETS)
+    for item in args.budget:
+        module, _, ms = item.partition("=")
+        budgets[module] = float(ms)
+
+    failed = False
+    print(f"{'module':<18} {'median ms':>10} {'budget ms':>10}  heavy modules")
+    for module, budget in budgets.items():
+        ms, heavy = measure(module, args.repeat)
+        ok = ms <= budget and not heavy
+        failed |= not ok
+        print(f"{module:<18} {ms:>10.1f} {budget:>10.0f}  {', '.join(heavy) or '-'}{'' if ok else '  FAIL'}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
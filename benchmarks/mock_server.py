@@ -0,0 +1,405 @@
+"""
+Local stand-in for api.e-stat.go.jp serving generated payloads in the
+shapes of the real API (see example1.json), with adjustable table size,
+latency and error rate.
+
+    server = MockEstatServer(n_tables=100, n_areas=50, latency=0.01)
+    server.start()
+    client = EstatRestApiClient(base_url=server.base_url)
+    ...
+    server.stop()
+"""
+import io
+import csv
+import json
+import time
+import hashlib
+import random
+import zipfile
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MockTable:
+    """
+    A generated table: every combination of tab x cat01 x area x time
+    is one VALUE record.
+    """
+
+    def __init__(self, table_id, n_cats=3, n_areas=48, n_times=10):
+        self.table_id = table_id
+        self.classes = [
+            ("tab", "表章項目", [("020", "人口", None, "1")]),
+            ("cat01", "男女", [("000", "総数", None, "1")] + [
+                (f"{i:03d}", f"分類{i}", "000", "2") for i in range(1, n_cats)
+            ]),
+            ("area", "地域", [("00000", "全国", None, "1")] + [
+                (f"{i:02d}000", f"地域{i}", "00000", "2") for i in range(1, n_areas)
+            ]),
+            ("time", "時間軸", [
+                (f"{2000 + i}000000", f"{2000 + i}年", None, "1") for i in range(n_times)
+            ]),
+        ]
+        self._positions = [
+            (class_id, {code: j for j, (code, _, _, _) in enumerate(items)}) for class_id, _, items in self.classes
+        ]
+
+    def class_inf(self):
+        return {"CLASS_OBJ": [
+            {"@id": class_id, "@name": name, "CLASS": [
+                dict({"@code": code, "@name": label, "@level": level},
+                     **({"@parentCode": parent} if parent else {}))
+                for code, label, parent, level in items
+            ]}
+            for class_id, name, items in self.classes
+        ]}
+
+    def table_inf(self):
+        return {
+            "@id": self.table_id,
+            "STAT_NAME": {"@code": "00200521", "$": "国勢調査"},
+            "GOV_ORG": {"@code": "00200", "$": "総務省"},
+            "STATISTICS_NAME": "平成27年国勢調査 人口等基本集計",
+            "TITLE": {"@no": self.table_id[-5:], "$": f"人口，世帯数 {self.table_id}"},
+            "CYCLE": "-",
+            "SURVEY_DATE": 201510,
+            "OPEN_DATE": "2016-12-16",
+            "SMALL_AREA": 0,
+            "MAIN_CATEGORY": {"@code": "02", "$": "人口・世帯"},
+            "SUB_CATEGORY": {"@code": "01", "$": "人口"},
+            "OVERALL_TOTAL_NUMBER": self.size({}),
+            "UPDATED_DATE": "2017-01-01",
+            "STATISTICS_NAME_SPEC": {"TABULATION_CATEGORY": "平成27年国勢調査"},
+            "TITLE_SPEC": {"TABLE_NAME": "人口，世帯数", "TABLE_SUB_CATEGORY1": "全国"},
+        }
+
+    def _codes(self, params):
+        # codes of each class after the cdXxx / cdXxxFrom / cdXxxTo filters
+        result = []
+        for class_id, _, items in self.classes:
+            name = class_id[0].upper() + class_id[1:]
+            codes = [code for code, _, _, _ in items]
+            if f"cd{name}" in params:
+                wanted = set(code.strip() for code in params[f"cd{name}"].split(","))
+                codes = [code for code in codes if code in wanted]
+            if f"cd{name}From" in params:
+                codes = [code for code in codes if code >= params[f"cd{name}From"]]
+            if f"cd{name}To" in params:
+                codes = [code for code in codes if code <= params[f"cd{name}To"]]
+            result.append((class_id, codes))
+        return result
+
+    def size(self, params):
+        total = 1
+        for _, codes in self._codes(params):
+            total *= len(codes)
+        return total
+
+    def cell(self, record):
+        """
+        Value of a cell, derived from its codes (its position in the whole
+        table), so that filtered and paged fetches agree with the full table.
+        """
+        i = 0
+        for class_id, positions in self._positions:
+            i = i * len(positions) + positions[record["@" + class_id]]
+        # e-Stat special symbols show up now and then
+        return "-" if i % 97 == 0 else str(i * 7 % 100000)
+
+    def values(self, params, start, limit):
+        classes = self._codes(params)
+        total = self.size(params)
+        for i in range(start - 1, min(total, start - 1 + limit)):
+            record = {}
+            rest = i
+            for class_id, codes in reversed(classes):
+                rest, j = divmod(rest, len(codes))
+                record["@" + class_id] = codes[j]
+            record["@unit"] = "人"
+            record["$"] = self.cell(record)
+            yield {key: record[key] for key in ("@tab", "@cat01", "@area", "@time", "@unit", "$")}
+
+
+class MockEstatServer:
+    """
+    Threaded HTTP server implementing getStatsList, getMetaInfo and
+    getStatsData (json, and csv for their getSimple* endpoints) with
+    startPosition/limit/NEXT_KEY paging,
+    plus static zip/csv files under /files/ (with an ETag, answering 304 to
+    If-None-Match) for the io_utils benchmarks.
+
+    Args:
+    =====
+    n_tables: int
+        number of tables listed by getStatsList
+    n_cats, n_areas, n_times: int
+        number of codes per class of every table
+    latency: float
+        seconds to wait before each response
+    error_rate: float
+        fraction of the requests answered with 503
+    file_size: int
+        size in bytes of the files under /files/
+    host: str
+    port: int
+        0 for any free port
+    """
+
+    def __init__(
+            self,
+            n_tables=100,
+            n_cats=3,
+            n_areas=48,
+            n_times=10,
+            latency=0.0,
+            error_rate=0.0,
+            file_size=1024 * 1024,
+            host="127.0.0.1",
+            port=0):
+        self.tables = [MockTable(f"{i:010d}", n_cats, n_areas, n_times) for i in range(1, n_tables + 1)]
+        self.tables_by_id = {table.table_id: table for table in self.tables}
+        self.latency = latency
+        self.error_rate = error_rate
+        self.file_size = file_size
+        self.requests = 0
+        self.bytes_sent = 0
+        self._random = random.Random(0)
+        self._lock = threading.Lock()
+        self._files = {}
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/rest"
+
+    @property
+    def files_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/files"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    # payloads
+
+    @staticmethod
+    def _result(status=0, message="正常に終了しました。"):
+        return {"STATUS": status, "ERROR_MSG": message, "DATE": "2020-09-02T14:15:09.957+09:00"}
+
+    @staticmethod
+    def _result_inf(total, start, limit):
+        to_number = min(total, start + limit - 1)
+        result_inf = {"TOTAL_NUMBER": total, "FROM_NUMBER": start, "TO_NUMBER": to_number}
+        if to_number < total:
+            result_inf["NEXT_KEY"] = to_number + 1
+        return result_inf
+
+    def stats_list(self, params):
+        start = int(params.get("startPosition", 1))
+        limit = int(params.get("limit", 100000))
+        tables = self.tables[start - 1:start - 1 + limit]
+        result_inf = self._result_inf(len(self.tables), start, limit)
+        del result_inf["TOTAL_NUMBER"]
+        return {"GET_STATS_LIST": {
+            "RESULT": self._result(),
+            "PARAMETER": {"LANG": "J", "DATA_FORMAT": "J", "LIMIT": limit},
+            "DATALIST_INF": {
+                "NUMBER": len(self.tables),
+                "RESULT_INF": result_inf,
+                "TABLE_INF": [table.table_inf() for table in tables],
+            },
+        }}
+
+    def _section(self, writer, name, items):
+        # a sectionHeaderFlg=1 section: its name, then one "KEY","value" row per item
+        writer.writerow([name])
+        for key, value in items.items():
+            writer.writerow([key, value])
+
+    def simple_stats_list(self, params):
+        start = int(params.get("startPosition", 1))
+        limit = int(params.get("limit", 100000))
+        out = io.StringIO()
+        writer = csv.writer(out, quoting=csv.QUOTE_ALL, lineterminator="\r\n")
+        if params.get("sectionHeaderFlg", "1") == "1":
+            self._section(writer, "RESULT", self._result())
+            self._section(writer, "PARAMETER", {"LANG": "J", "DATA_FORMAT": "C", "LIMIT": limit})
+            result_inf = self._result_inf(len(self.tables), start, limit)
+            del result_inf["TOTAL_NUMBER"]
+            self._section(writer, "RESULT_INF", dict({"NUMBER": len(self.tables)}, **result_inf))
+            writer.writerow(["TABLE_INF"])
+        writer.writerow([
+            "TABLE_INF", "STAT_CODE", "STAT_NAME", "GOV_ORG_CODE", "GOV_ORG_NAME", "TABULATION_CATEGORY",
+            "NO", "TITLE", "CYCLE", "SURVEY_DATE", "OPEN_DATE", "SMALL_AREA", "MAIN_CATEGORY_CODE",
+            "MAIN_CATEGORY", "SUB_CATEGORY_CODE", "SUB_CATEGORY", "OVERALL_TOTAL_NUMBER", "UPDATED_DATE",
+        ])
+        for table in self.tables[start - 1:start - 1 + limit]:
+            inf = table.table_inf()
+            writer.writerow([
+                inf["@id"], inf["STAT_NAME"]["@code"], inf["STAT_NAME"]["$"], inf["GOV_ORG"]["@code"],
+                inf["GOV_ORG"]["$"], inf["STATISTICS_NAME_SPEC"]["TABULATION_CATEGORY"], inf["TITLE"]["@no"],
+                inf["TITLE"]["$"], inf["CYCLE"], inf["SURVEY_DATE"], inf["OPEN_DATE"], inf["SMALL_AREA"],
+                inf["MAIN_CATEGORY"]["@code"], inf["MAIN_CATEGORY"]["$"], inf["SUB_CATEGORY"]["@code"],
+                inf["SUB_CATEGORY"]["$"], inf["OVERALL_TOTAL_NUMBER"], inf["UPDATED_DATE"],
+            ])
+        return out.getvalue()
+
+    def simple_meta_info(self, table, params):
+        out = io.StringIO()
+        writer = csv.writer(out, quoting=csv.QUOTE_ALL, lineterminator="\r\n")
+        if params.get("sectionHeaderFlg", "1") == "1":
+            self._section(writer, "RESULT", self._result())
+            self._section(writer, "PARAMETER", {"LANG": "J", "STATS_DATA_ID": table.table_id, "DATA_FORMAT": "C"})
+            writer.writerow(["METADATA_INF"])
+        writer.writerow(["CLASS_OBJ_ID", "CLASS_OBJ_NAME", "CODE", "NAME", "LEVEL", "UNIT", "PARENT_CODE"])
+        for class_id, name, items in table.classes:
+            for code, label, parent, level in items:
+                writer.writerow([class_id, name, code, label, level, "", parent or ""])
+        return out.getvalue()
+
+    def meta_info(self, table):
+        return {"GET_META_INFO": {
+            "RESULT": self._result(),
+            "PARAMETER": {"LANG": "J", "STATS_DATA_ID": table.table_id, "DATA_FORMAT": "J"},
+            "METADATA_INF": {"TABLE_INF": table.table_inf(), "CLASS_INF": table.class_inf()},
+        }}
+
+    def stats_data(self, table, params):
+        start = int(params.get("startPosition", 1))
+        limit = int(params.get("limit", 100000))
+        statistical_data = {
+            "RESULT_INF": self._result_inf(table.size(params), start, limit),
+            "TABLE_INF": table.table_inf(),
+        }
+        if params.get("metaGetFlg", "Y") == "Y":
+            statistical_data["CLASS_INF"] = table.class_inf()
+        statistical_data["DATA_INF"] = {"VALUE": list(table.values(params, start, limit))}
+        return {"GET_STATS_DATA": {
+            "RESULT": self._result(),
+            "PARAMETER": {"LANG": "J", "STATS_DATA_ID": table.table_id, "DATA_FORMAT": "J"},
+            "STATISTICAL_DATA": statistical_data,
+        }}
+
+    def simple_stats_data(self, table, params):
+        start = int(params.get("startPosition", 1))
+        limit = int(params.get("limit", 100000))
+        out = io.StringIO()
+        writer = csv.writer(out, quoting=csv.QUOTE_ALL, lineterminator="\r\n")
+        if params.get("sectionHeaderFlg", "1") == "1":
+            self._section(writer, "RESULT", self._result())
+            self._section(writer, "RESULT_INF", self._result_inf(table.size(params), start, limit))
+            writer.writerow(["VALUE"])
+        writer.writerow(["tab_code", "cat01_code", "area_code", "time_code", "unit", "value"])
+        for value in table.values(params, start, limit):
+            writer.writerow(list(value.values()))
+        return out.getvalue()
+
+    def file(self, name):
+        with self._lock:
+            if name not in self._files:
+                body = bytes(self._random.getrandbits(8) for _ in range(256)) * (self.file_size // 256)
+                if name.endswith(".zip"):
+                    buf = io.BytesIO()
+                    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as f_zip:
+                        f_zip.writestr(name[:-4] + ".txt", body)
+                    body = buf.getvalue()
+                self._files[name] = body
+            return self._files[name]
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body, content_type, headers=None):
+                if isinstance(body, str):
+                    body = body.encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                with server._lock:
+                    server.bytes_sent += len(body)
+
+            def do_GET(self):
+                with server._lock:
+                    server.requests += 1
+                    fail = server._random.random() < server.error_rate
+                if server.latency:
+                    time.sleep(server.latency)
+                if fail:
+                    return self._send(503, "Service Unavailable", "text/plain")
+                url = urllib.parse.urlparse(self.path)
+                params = dict(urllib.parse.parse_qsl(url.query))
+                name = url.path.rstrip("/").rsplit("/", 1)[-1]
+                if url.path.startswith("/files/"):
+                    body = server.file(name)
+                    etag = f'"{hashlib.md5(body).hexdigest()}"'
+                    if self.headers.get("If-None-Match") == etag:
+                        return self._send(304, b"", "application/octet-stream", {"ETag": etag})
+                    return self._send(200, body, "application/octet-stream", {"ETag": etag})
+                if name == "getStatsList":
+                    return self._send(200, json.dumps(server.stats_list(params), ensure_ascii=False), "application/json;charset=utf-8")
+                if name == "getSimpleStatsList":
+                    return self._send(200, server.simple_stats_list(params), "text/csv;charset=utf-8")
+                table = server.tables_by_id.get(params.get("statsDataId"))
+                if table is None and name.startswith("getSimple"):
+                    out = io.StringIO()
+                    server._section(csv.writer(out, quoting=csv.QUOTE_ALL, lineterminator="\r\n"), "RESULT",
+                                    server._result(100, "統計表IDが不正です。"))
+                    return self._send(200, out.getvalue(), "text/csv;charset=utf-8")
+                if table is None:
+                    body = {"RESULT": server._result(100, "統計表IDが不正です。")}
+                    return self._send(200, json.dumps(body, ensure_ascii=False), "application/json;charset=utf-8")
+                if name == "getMetaInfo":
+                    return self._send(200, json.dumps(server.meta_info(table), ensure_ascii=False), "application/json;charset=utf-8")
+                if name == "getSimpleMetaInfo":
+                    return self._send(200, server.simple_meta_info(table, params), "text/csv;charset=utf-8")
+                if name == "getStatsData":
+                    return self._send(200, json.dumps(server.stats_data(table, params), ensure_ascii=False), "application/json;charset=utf-8")
+                if name == "getSimpleStatsData":
+                    return self._send(200, server.simple_stats_data(table, params), "text/csv;charset=utf-8")
+                return self._send(404, "Not Found", "text/plain")
+
+        return Handler
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Serve a mock e-Stat API.")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--tables", type=int, default=100)
+    parser.add_argument("--areas", type=int, default=48)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    server = MockEstatServer(
+        n_tables=args.tables, n_areas=args.areas, latency=args.latency,
+        error_rate=args.error_rate, port=args.port,
+    )
+    print("serving", server.base_url)
+    server._server.serve_forever()
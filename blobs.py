@@ -0,0 +1,263 @@
+import os
+import time
+import codecs
+import shutil
+import sqlite3
+import threading
+
+
+# results of BlobStore.add / the "blob" field of the io_utils "download" event
+NEW = "new"
+DUPLICATE = "duplicate"
+SKIPPED = "skipped"
+
+
+def variant(enc=None, dec=None, compress=False):
+    """
+    Name of the transformation applied by io_utils.write_stream to a
+    payload ("" when written as it is), so that the blob of a url is only
+    reused for the same transformation.
+    """
+    transcode = enc is not None and dec is not None and codecs.lookup(enc) != codecs.lookup(dec)
+    name = f"{dec}>{enc}" if transcode else ""
+    return f"{name}.gz" if compress else name
+
+
+def blob_key(sha256, compress=False):
+    """
+    Key of a blob: sha256 of the bytes before compression, with ".gz" for
+    gzipped files (whose bytes also depend on the gzip header).
+    """
+    return f"{sha256}.gz" if compress else sha256
+
+
+def _strong_etag(etag):
+    # weak validators (W/"...") do not guarantee identical bytes
+    return etag if etag and not etag.startswith("W/") else None
+
+
+def _link(source, filepath):
+    # hard link (or copy) `source` to a temporary name, then rename it over `filepath`
+    tmp_filepath = f"{filepath}.{os.getpid()}.{threading.get_ident()}.link"
+    try:
+        os.link(source, tmp_filepath)
+    except FileNotFoundError:
+        raise
+    except OSError:
+        # no hard links on this file system
+        shutil.copyfile(source, tmp_filepath)
+    os.replace(tmp_filepath, filepath)
+
+
+class BlobStore:
+    """
+    Content-addressed store of downloaded files: every payload is written
+    once under `{directory}/{sha256[:2]}/{sha256}` and the destination
+    files are hard links to it (copies where hard links are not supported),
+    so identical files downloaded under different names take the disk
+    space of one.
+
+    The index (SQLite) records the blob of every url with its ETag,
+    Last-Modified and Content-Length. A known url is requested with
+    If-None-Match / If-Modified-Since, and the transfer is skipped when the
+    server answers 304, or the same strong ETag or Last-Modified, with the
+    same Content-Length, as the last download of the url. Validators only
+    identify versions of one resource (servers often derive ETags from the
+    mtime and size), so a payload of another url is only shared once its
+    hash is known, after the download.
+
+    The least recently used blobs are removed when their total size
+    exceeds `max_size`, those which are no longer linked to any file
+    first. Removing a blob never removes the files linked to it; it only
+    ends their deduplication.
+
+    The destination files share their bytes with the blob: replace them
+    (e.g. write a new file and rename it) rather than modify them in place.
+
+        store = BlobStore("./downloads/blobs")
+        io_utils.download_all_zip(urls, filepathes, blob_store=store)
+
+    Args:
+    =====
+    directory: str
+        directory of the blobs and of the index
+    max_size: int
+        max total size of the blobs in bytes
+    """
+
+    def __init__(self, directory="./downloads/blobs", max_size=10 << 30):
+        self.directory = directory
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(
+            os.path.join(directory, "index.sqlite3"), check_same_thread=False, isolation_level=None
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS blobs ("
+            " key TEXT PRIMARY KEY,"
+            " size INTEGER,"
+            " stored_at REAL,"
+            " accessed_at REAL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS urls ("
+            " url TEXT,"
+            " variant TEXT,"
+            " key TEXT,"
+            " etag TEXT,"
+            " last_modified TEXT,"
+            " content_length INTEGER,"
+            " PRIMARY KEY (url, variant))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS blobs_accessed_at ON blobs (accessed_at)")
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def _exists(self, key):
+        return key is not None and os.path.exists(self.path(key))
+
+    def validators(self, url, variant=""):
+        """
+        Conditional request headers for a url whose blob is still stored.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT key, etag, last_modified FROM urls WHERE url = ? AND variant = ?", (url, variant)
+            ).fetchone()
+        if row is None or not self._exists(row[0]):
+            return {}
+        headers = {}
+        if row[1]:
+            headers["If-None-Match"] = row[1]
+        if row[2]:
+            headers["If-Modified-Since"] = row[2]
+        return headers
+
+    def match(self, url, res, variant=""):
+        """
+        Return the key of the stored blob that the response `res` (whose
+        body is not read yet) would write, or None when it has to be
+        downloaded.
+        """
+        etag = _strong_etag(res.headers.get("ETag"))
+        last_modified = res.headers.get("Last-Modified")
+        length = res.headers.get("Content-Length")
+        length = int(length) if length and length.isdigit() else None
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT key, etag, last_modified, content_length FROM urls WHERE url = ? AND variant = ?",
+                (url, variant),
+            ).fetchone()
+        if row is None or not self._exists(row[0]):
+            return None
+        if (res.status_code == 304
+                or (etag is not None and etag == row[1] and length == row[3])
+                or (last_modified is not None and length is not None
+                    and last_modified == row[2] and length == row[3])):
+            return row[0]
+        return None
+
+    def record(self, url, res, key, variant=""):
+        """
+        Remember the blob of a url and the validators of its response.
+        """
+        length = res.headers.get("Content-Length")
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO urls VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    url, variant, key, _strong_etag(res.headers.get("ETag")),
+                    res.headers.get("Last-Modified"),
+                    int(length) if length and length.isdigit() else None,
+                ),
+            )
+
+    def add(self, tmp_filepath, key, filepath):
+        """
+        Move a downloaded file into the store (or drop it when the blob
+        already exists) and link `filepath` to the blob.
+        Return NEW or DUPLICATE.
+
+        `filepath` is linked before a new blob is published, so that a
+        concurrent gc() never takes it for an unlinked blob.
+        """
+        blob_path = self.path(key)
+        try:
+            # FileNotFoundError: a new blob, or one that gc() just removed
+            _link(blob_path, filepath)
+            os.remove(tmp_filepath)
+            result = DUPLICATE
+        except FileNotFoundError:
+            _link(tmp_filepath, filepath)
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            try:
+                os.replace(tmp_filepath, blob_path)
+            except OSError:
+                # another file system: copy then rename into place
+                shutil.copyfile(tmp_filepath, f"{blob_path}.part")
+                os.replace(f"{blob_path}.part", blob_path)
+                os.remove(tmp_filepath)
+            result = NEW
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO blobs VALUES (?, ?, ?, ?)"
+                " ON CONFLICT (key) DO UPDATE SET accessed_at = excluded.accessed_at",
+                (key, os.path.getsize(filepath), now, now),
+            )
+        if result == NEW:
+            self.gc()
+        return result
+
+    def link(self, key, filepath):
+        """
+        Make `filepath` a hard link to a blob (a copy where hard links are
+        not supported), replacing it atomically.
+        """
+        _link(self.path(key), filepath)
+        with self._lock:
+            self._conn.execute("UPDATE blobs SET accessed_at = ? WHERE key = ?", (time.time(), key))
+
+    def size(self):
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+
+    def gc(self, max_size=None):
+        """
+        Remove the least recently used blobs until their total size is at
+        most `max_size` (default: self.max_size), unlinked blobs first, and
+        forget the urls of the removed blobs.
+        Return (number of blobs removed, bytes freed).
+        """
+        max_size = self.max_size if max_size is None else max_size
+        with self._lock:
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+            if total <= max_size:
+                return 0, 0
+            unlinked, linked = [], []
+            for key, size in self._conn.execute("SELECT key, size FROM blobs ORDER BY accessed_at").fetchall():
+                try:
+                    nlink = os.stat(self.path(key)).st_nlink
+                except FileNotFoundError:
+                    nlink = 0
+                (unlinked if nlink <= 1 else linked).append((key, size))
+            victims = []
+            freed = 0
+            for key, size in unlinked + linked:
+                if total <= max_size:
+                    break
+                if os.path.exists(self.path(key)):
+                    os.remove(self.path(key))
+                    freed += size
+                victims.append((key,))
+                total -= size
+            self._conn.executemany("DELETE FROM blobs WHERE key = ?", victims)
+            self._conn.executemany("DELETE FROM urls WHERE key = ?", victims)
+        return len(victims), freed
+
+    def close(self):
+        self._conn.close()
+
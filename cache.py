@@ -0,0 +1,244 @@
+import os
+import re
+import json
+import time
+import zlib
+import sqlite3
+import threading
+import urllib.parse
+import requests
+
+
+DAY = 24 * 60 * 60
+
+# TTLs (seconds) per API, None = never expires
+DEFAULT_TTLS = {
+    "getStatsList": 1 * DAY,
+    "getMetaInfo": 7 * DAY,
+    # published tables rarely change and stale entries are revalidated
+    # against UPDATED_DATE before being downloaded again
+    "getStatsData": 30 * DAY,
+}
+
+UPDATED_DATE_PATTERN = re.compile(
+    r'"UPDATED_DATE":\s*"([^"]*)"|<UPDATED_DATE>([^<]*)</UPDATED_DATE>|"UPDATED_DATE","([^"]*)"'
+)
+UPDATED_DATE_SCAN_SIZE = 65536
+
+# query parameters which do not change the response
+IGNORED_PARAMS = ("appId",)
+
+
+def api_name(endpoint):
+    """
+    Return the API name of an endpoint url, e.g.
+    ".../app/json/getStatsData" and ".../app/getSimpleStatsData" -> "getStatsData"
+    """
+    name = urllib.parse.urlparse(endpoint).path.rstrip("/").rsplit("/", 1)[-1]
+    return name.replace("getSimple", "get", 1)
+
+
+def cache_key(endpoint, params):
+    """
+    Normalized cache key of a request (appId excluded).
+    """
+    items = sorted(
+        (str(key), str(value)) for key, value in params.items()
+        if key not in IGNORED_PARAMS and value is not None
+    )
+    return endpoint + "?" + urllib.parse.urlencode(items)
+
+
+def updated_date(content):
+    """
+    Extract UPDATED_DATE from a response body, or None.
+    """
+    text = content[:UPDATED_DATE_SCAN_SIZE].decode("utf-8", errors="ignore")
+    match = UPDATED_DATE_PATTERN.search(text)
+    if match is None:
+        return None
+    return next(group for group in match.groups() if group is not None)
+
+
+class CacheEntry:
+    def __init__(self, key, url, content, headers, stored_at, etag, last_modified, updated_date, ttl):
+        self.key = key
+        self.url = url
+        self.content = content
+        self.headers = headers
+        self.stored_at = stored_at
+        self.etag = etag
+        self.last_modified = last_modified
+        self.updated_date = updated_date
+        self.ttl = ttl
+
+    @property
+    def fresh(self):
+        return self.ttl is None or time.time() - self.stored_at < self.ttl
+
+    def validators(self):
+        """
+        HTTP conditional request headers for revalidation.
+        """
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+    def to_response(self):
+        """
+        Rebuild a requests.Response from the cached body.
+        """
+        res = requests.Response()
+        res._content = self.content
+        res._content_consumed = True
+        res.status_code = 200
+        res.reason = "OK"
+        res.url = self.url
+        res.headers.update(self.headers)
+        res.encoding = "utf-8"
+        return res
+
+
+class ResponseCache:
+    """
+    Persistent on-disk cache of e-Stat API responses.
+
+    Bodies are stored zlib-compressed in a SQLite file, keyed on the
+    normalized endpoint and parameters (appId excluded). Entries expire
+    after a per-API TTL; expired entries are revalidated (HTTP validators
+    or UPDATED_DATE) instead of being downloaded again when possible.
+    The least recently used entries are evicted when the compressed size
+    exceeds `max_size`.
+
+    Args:
+    =====
+    path: str
+        path to the SQLite cache file
+    max_size: int
+        max total size of the compressed bodies in bytes
+    ttls: dict
+        API name (e.g. "getMetaInfo") -> TTL in seconds (None = no expiry),
+        merged into DEFAULT_TTLS
+    default_ttl: int
+        TTL in seconds of the APIs which are not in `ttls`
+    compresslevel: int
+        zlib compression level
+    """
+
+    def __init__(
+            self,
+            path="./downloads/estat_cache.sqlite3",
+            max_size=1 << 30,
+            ttls=None,
+            default_ttl=1 * DAY,
+            compresslevel=6):
+        self.path = path
+        self.max_size = max_size
+        self.ttls = dict(DEFAULT_TTLS)
+        if ttls is not None:
+            self.ttls.update(ttls)
+        self.default_ttl = default_ttl
+        self.compresslevel = compresslevel
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " url TEXT,"
+            " body BLOB,"
+            " size INTEGER,"
+            " headers TEXT,"
+            " stored_at REAL,"
+            " accessed_at REAL,"
+            " etag TEXT,"
+            " last_modified TEXT,"
+            " updated_date TEXT)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+
+    def ttl(self, endpoint):
+        return self.ttls.get(api_name(endpoint), self.default_ttl)
+
+    def get(self, endpoint, params):
+        """
+        Return the CacheEntry of a request (fresh or stale), or None.
+        """
+        key = cache_key(endpoint, params)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT url, body, headers, stored_at, etag, last_modified, updated_date"
+                " FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (time.time(), key))
+        url, body, headers, stored_at, etag, last_modified, date = row
+        return CacheEntry(
+            key, url, zlib.decompress(body), json.loads(headers), stored_at,
+            etag, last_modified, date, self.ttl(endpoint),
+        )
+
+    def put(self, endpoint, params, res):
+        """
+        Store a successful requests.Response.
+        """
+        content = res.content
+        body = zlib.compress(content, self.compresslevel)
+        headers = {
+            name: res.headers[name] for name in ("Content-Type", "ETag", "Last-Modified")
+            if name in res.headers
+        }
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    cache_key(endpoint, params), res.url, body, len(body), json.dumps(headers),
+                    now, now, res.headers.get("ETag"), res.headers.get("Last-Modified"),
+                    updated_date(content),
+                ),
+            )
+            self._evict()
+
+    def refresh(self, entry):
+        """
+        Mark a revalidated entry as fresh again.
+        """
+        with self._lock:
+            self._conn.execute(
+                "UPDATE responses SET stored_at = ? WHERE key = ?", (time.time(), entry.key)
+            )
+
+    def delete(self, entry):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (entry.key,))
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+
+    def size(self):
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_size:
+            return
+        rows = self._conn.execute("SELECT key, size FROM responses ORDER BY accessed_at")
+        victims = []
+        for key, size in rows:
+            if total <= self.max_size:
+                break
+            victims.append((key,))
+            total -= size
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", victims)
+
+    def close(self):
+        self._conn.close()
@@ -0,0 +1,390 @@
+import os
+import re
+import json
+import sqlite3
+import datetime
+import argparse
+import threading
+import unicodedata
+
+
+# kanji, kana and the prolonged sound mark: indexed as overlapping bigrams
+CJK_PATTERN = re.compile(r"[ぁ-ヿ㐀-䶿一-鿿豈-﫿ー]+")
+WORD_PATTERN = re.compile(r"\w+")
+
+COLUMNS = (
+    "statsDataId",
+    "stats_code",
+    "stat_name",
+    "gov_org_code",
+    "gov_org",
+    "statistics_name",
+    "title",
+    "cycle",
+    "survey_date",
+    "open_date",
+    "small_area",
+    "main_category_code",
+    "main_category",
+    "sub_category_code",
+    "sub_category",
+    "overall_total_number",
+    "updated_date",
+    "title_spec",
+)
+
+
+def _as_list(obj):
+    if obj is None:
+        return []
+    return obj if isinstance(obj, list) else [obj]
+
+
+def _text(value):
+    # TABLE_INF fields are either plain values or {"@code": ..., "$": ...}
+    if isinstance(value, dict):
+        return value.get("$")
+    return None if value is None else str(value)
+
+
+def _code(value):
+    return value.get("@code") if isinstance(value, dict) else None
+
+
+def _spec(value):
+    # STATISTICS_NAME_SPEC / TITLE_SPEC: {"TABLE_NAME": ..., "TABLE_SUB_CATEGORY1": ...}
+    if isinstance(value, dict):
+        return " ".join(str(item) for item in value.values() if item)
+    return _text(value) or ""
+
+
+def ngrams(text):
+    """
+    Space separated search tokens of a text: runs of kanji/kana become
+    overlapping bigrams plus their last character ("人口総数" ->
+    "人口 口総 総数 数"), other words are kept whole (lowercased).
+    Every substring of a Japanese run is then a phrase of bigrams, and
+    every single character the prefix of a token.
+    """
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    tokens = []
+    for word in WORD_PATTERN.findall(text):
+        pos = 0
+        for match in CJK_PATTERN.finditer(word):
+            if match.start() > pos:
+                tokens.append(word[pos:match.start()])
+            run = match.group()
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+            tokens.append(run[-1])
+            pos = match.end()
+        if pos < len(word):
+            tokens.append(word[pos:])
+    return " ".join(tokens)
+
+
+def match_query(text):
+    """
+    FTS5 query of a search text: every space separated term must match
+    (as a substring for Japanese, as a word prefix otherwise).
+    """
+    terms = []
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    for word in WORD_PATTERN.findall(text):
+        pos = 0
+        for match in CJK_PATTERN.finditer(word):
+            if match.start() > pos:
+                terms.append(f'"{word[pos:match.start()]}"*')
+            run = match.group()
+            if len(run) == 1:
+                terms.append(f'"{run}"*')
+            else:
+                terms.append('"' + " ".join(run[i:i + 2] for i in range(len(run) - 1)) + '"')
+            pos = match.end()
+        if pos < len(word):
+            terms.append(f'"{word[pos:]}"*')
+    return " AND ".join(terms)
+
+
+def table_row(table):
+    """
+    Catalog row (dict of COLUMNS) of a getStatsList TABLE_INF.
+    """
+    title = table.get("TITLE")
+    return {
+        "statsDataId": table["@id"],
+        "stats_code": _code(table.get("STAT_NAME")),
+        "stat_name": _text(table.get("STAT_NAME")),
+        "gov_org_code": _code(table.get("GOV_ORG")),
+        "gov_org": _text(table.get("GOV_ORG")),
+        "statistics_name": _text(table.get("STATISTICS_NAME")) or _spec(table.get("STATISTICS_NAME_SPEC")),
+        "title": _text(title),
+        "cycle": _text(table.get("CYCLE")),
+        "survey_date": _text(table.get("SURVEY_DATE")),
+        "open_date": _text(table.get("OPEN_DATE")),
+        "small_area": table.get("SMALL_AREA"),
+        "main_category_code": _code(table.get("MAIN_CATEGORY")),
+        "main_category": _text(table.get("MAIN_CATEGORY")),
+        "sub_category_code": _code(table.get("SUB_CATEGORY")),
+        "sub_category": _text(table.get("SUB_CATEGORY")),
+        "overall_total_number": table.get("OVERALL_TOTAL_NUMBER"),
+        "updated_date": _text(table.get("UPDATED_DATE")),
+        "title_spec": _spec(table.get("TITLE_SPEC")),
+    }
+
+
+class CatalogIndex:
+    """
+    Local searchable catalog of e-Stat tables (SQLite), built from
+    getStatsList pages, so that finding a statsDataId does not cost a
+    request.
+
+    TITLE, STATISTICS_NAME and TITLE_SPEC are indexed for full-text search
+    (FTS5 over bigrams of the Japanese text, see `ngrams`), statsCode,
+    SURVEY_DATE, OPEN_DATE, MAIN_CATEGORY and UPDATED_DATE have secondary
+    indexes. `update` fetches only the tables updated since the last update
+    of the same query.
+
+        catalog = CatalogIndex()
+        catalog.update(client, statsCode="00200521")
+        catalog.search("人口 世帯", surveyYears="2015", limit=10)
+
+    Args:
+    =====
+    path: str
+        path to the catalog file
+    """
+
+    def __init__(self, path="./downloads/catalog.sqlite3"):
+        self.path = path
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS tables ("
+            " statsDataId TEXT PRIMARY KEY,"
+            " stats_code TEXT,"
+            " stat_name TEXT,"
+            " gov_org_code TEXT,"
+            " gov_org TEXT,"
+            " statistics_name TEXT,"
+            " title TEXT,"
+            " cycle TEXT,"
+            " survey_date TEXT,"
+            " open_date TEXT,"
+            " small_area INTEGER,"
+            " main_category_code TEXT,"
+            " main_category TEXT,"
+            " sub_category_code TEXT,"
+            " sub_category TEXT,"
+            " overall_total_number INTEGER,"
+            " updated_date TEXT,"
+            " title_spec TEXT,"
+            " table_inf TEXT)"
+        )
+        for column in ("stats_code", "gov_org_code", "survey_date", "open_date", "main_category_code", "updated_date"):
+            self._conn.execute(f"CREATE INDEX IF NOT EXISTS tables_{column} ON tables ({column})")
+        # rowid = rowid of tables
+        self._conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS tables_fts"
+            " USING fts5(title, statistics_name, title_spec, tokenize='unicode61 remove_diacritics 0')"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT)")
+
+    def close(self):
+        self._conn.close()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM tables").fetchone()[0]
+
+    def __contains__(self, statsDataId):
+        return self.get(statsDataId) is not None
+
+    def get_state(self, key, default=None):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+        return default if row is None else row[0]
+
+    def set_state(self, key, value):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO state VALUES (?, ?)", (key, value))
+
+    def add(self, tables):
+        """
+        Insert or update tables given as getStatsList TABLE_INF dicts.
+        Return the number of tables.
+        """
+        placeholders = ", ".join("?" for _ in COLUMNS)
+        updates = ", ".join(f"{column} = excluded.{column}" for column in COLUMNS[1:])
+        count = 0
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                for table in tables:
+                    row = table_row(table)
+                    values = [row[column] for column in COLUMNS]
+                    # an upsert keeps the rowid the full-text index refers to
+                    self._conn.execute(
+                        f"INSERT INTO tables ({', '.join(COLUMNS)}, table_inf) VALUES ({placeholders}, ?)"
+                        f" ON CONFLICT (statsDataId) DO UPDATE SET {updates}, table_inf = excluded.table_inf",
+                        values + [json.dumps(table, ensure_ascii=False)],
+                    )
+                    rowid = self._conn.execute(
+                        "SELECT rowid FROM tables WHERE statsDataId = ?", (row["statsDataId"],)
+                    ).fetchone()[0]
+                    self._conn.execute("DELETE FROM tables_fts WHERE rowid = ?", (rowid,))
+                    self._conn.execute(
+                        "INSERT INTO tables_fts (rowid, title, statistics_name, title_spec) VALUES (?, ?, ?, ?)",
+                        (rowid, ngrams(row["title"]), ngrams(row["statistics_name"]), ngrams(row["title_spec"])),
+                    )
+                    count += 1
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return count
+
+    def add_page(self, json_dict):
+        """
+        Add the tables of a getStatsList json page (e.g. a saved dump).
+        """
+        datalist_inf = json_dict["GET_STATS_LIST"].get("DATALIST_INF", {})
+        return self.add(_as_list(datalist_inf.get("TABLE_INF")))
+
+    def update(self, client, **query):
+        """
+        Add the tables matching a getStatsList query (statsCode,
+        surveyYears, searchWord, ...), page by page. After the first
+        update of a query, only the tables updated since then are fetched
+        (getStatsList updatedDate="{watermark}-{today}").
+        Return the number of tables added or updated.
+        """
+        key = "watermark:" + json.dumps(sorted(
+            (name, str(value)) for name, value in query.items() if name not in ("appId", "logging")
+        ), ensure_ascii=False)
+        watermark = self.get_state(key)
+        today = datetime.date.today().strftime("%Y%m%d")
+        params = dict(query)
+        if watermark is not None:
+            params["updatedDate"] = f"{watermark}-{today}"
+        count = 0
+        for page, _ in client.iterStatsList(format="json", **params):
+            count += self.add_page(page)
+        # the range is inclusive, so tables updated later today are seen next time
+        self.set_state(key, today)
+        return count
+
+    def get(self, statsDataId):
+        """
+        Return the TABLE_INF of a table, or None.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT table_inf FROM tables WHERE statsDataId = ?", (statsDataId,)
+            ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def search(
+            self,
+            text=None,
+            statsCode=None,
+            surveyYears=None,
+            openDateFrom=None,
+            openDateTo=None,
+            mainCategory=None,
+            subCategory=None,
+            limit=100,
+            offset=0):
+        """
+        Find tables, best full-text matches first.
+
+        Args:
+        =====
+        text: str
+            words searched in TITLE, STATISTICS_NAME and TITLE_SPEC
+            (all of them must match, Japanese words as substrings)
+        statsCode: str
+            数値5桁：作成機関 or 数値8桁：政府統計コード
+        surveyYears: str
+            YYYY or YYYYMM or YYYYMM-YYYYMM (SURVEY_DATE)
+        openDateFrom, openDateTo: str
+            range of OPEN_DATE ("YYYY-MM-DD", inclusive)
+        mainCategory, subCategory: str
+            統計大分類 / 統計小分類 code
+        limit: int
+        offset: int
+
+        Returns:
+        ========
+        list of dicts of COLUMNS
+        """
+        conditions = []
+        params = []
+        query = match_query(text) if text else ""
+        if query:
+            conditions.append("tables_fts MATCH ?")
+            params.append(query)
+        if statsCode is not None:
+            conditions.append("gov_org_code = ?" if len(str(statsCode)) == 5 else "stats_code = ?")
+            params.append(str(statsCode))
+        if surveyYears is not None:
+            low, _, high = str(surveyYears).partition("-")
+            high = high or low
+            # SURVEY_DATE is YYYYMM or YYYYMM-YYYYMM
+            conditions.append("substr(survey_date, 1, ?) >= ? AND substr(survey_date, 1, ?) <= ?")
+            params.extend([len(low), low, len(high), high])
+        if openDateFrom is not None:
+            conditions.append("open_date >= ?")
+            params.append(openDateFrom)
+        if openDateTo is not None:
+            conditions.append("open_date <= ?")
+            params.append(openDateTo)
+        if mainCategory is not None:
+            conditions.append("main_category_code = ?")
+            params.append(str(mainCategory))
+        if subCategory is not None:
+            conditions.append("sub_category_code = ?")
+            params.append(str(subCategory))
+        where = " WHERE " + " AND ".join(conditions) if conditions else ""
+        if query:
+            sql = (
+                f"SELECT {', '.join('tables.' + column for column in COLUMNS)} FROM tables_fts"
+                f" JOIN tables ON tables.rowid = tables_fts.rowid{where}"
+                " ORDER BY bm25(tables_fts), statsDataId LIMIT ? OFFSET ?"
+            )
+        else:
+            sql = f"SELECT {', '.join(COLUMNS)} FROM tables{where} ORDER BY statsDataId LIMIT ? OFFSET ?"
+        with self._lock:
+            rows = self._conn.execute(sql, params + [limit, offset]).fetchall()
+        return [dict(zip(COLUMNS, row)) for row in rows]
+
+
+def main():
+    from estat_api import EstatRestApiClient
+
+    parser = argparse.ArgumentParser(description="Build and search a local catalog of e-Stat tables.")
+    parser.add_argument("search", nargs="?", help="words to search (no request is sent)")
+    parser.add_argument("--path", default="./downloads/catalog.sqlite3")
+    parser.add_argument("--update", action="store_true", help="add the tables matching the query first")
+    parser.add_argument("--app-id", default=None)
+    parser.add_argument("--statsCode")
+    parser.add_argument("--surveyYears")
+    parser.add_argument("--searchWord")
+    parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    catalog = CatalogIndex(args.path)
+    if args.update:
+        query = {
+            key: value for key, value in vars(args).items()
+            if key in ("statsCode", "surveyYears", "searchWord") and value is not None
+        }
+        print(catalog.update(EstatRestApiClient(app_id=args.app_id), **query), "tables updated")
+    for row in catalog.search(args.search, statsCode=args.statsCode, surveyYears=args.surveyYears, limit=args.limit):
+        print(row["statsDataId"], row["stat_name"], row["title"], row["title_spec"], sep="\t")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,31 +1,188 @@
-import sys
-import urllib
+import json
+import itertools
+import functools
 import requests
-import common
+from urllib.parse import parse_qs, quote_plus, urlsplit
+from session import EstatSession
+from scheduler import EstatApiError, RequestScheduler, api_status
+from singleflight import SingleFlight
+from appid_pool import INVALID, INVALID_APP_ID_STATUS, AppIdPool
+from instrumentation import endpoint_label, get_default_instrumentation, stage
+from cache import api_name
+from metadata import LRUCache, MetaIndex
+from frames import StatsDataFrameBuilder, concat_frames, decode_stats_data
+from planner import plan_shards
+from streaming import DEFAULT_CHUNK_SIZE, find_next_key, iter_csv_rows, iter_json_values
+from concurrent.futures import ThreadPoolExecutor
+
+# getStatsDatas accepts at most 100 tables per request
+STATS_DATAS_MAX_SPECS = 100
+# max length of statsDatasSpec in the URL, once url-encoded
+STATS_DATAS_MAX_SPEC_LENGTH = 6000
+
+
+def flight_key(name, args, kwargs):
+    """
+    Key of identical requests for single-flight coalescing
+    (appId and logging do not change the result).
+    """
+    return (name, repr(args), tuple(sorted(
+        (key, str(value)) for key, value in kwargs.items() if key not in ("appId", "logging")
+    )))
+
+
+def _coalesce(method):
+    # concurrent identical calls share one request and its parsed result
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.single_flight is None:
+            return method(self, *args, **kwargs)
+        key = flight_key(method.__name__, args, kwargs)
+        return self.single_flight.do(key, method, self, *args, **kwargs)
+    return wrapper
 
 
 class EstatRestApiClient:
     """
     This is a simple python module class for e-Stat API (ver.3.0).
     See more details at https://www.e-stat.go.jp/api/api-info/e-stat-manual3-0
+
+    Args:
+    =====
+    api_version: str
+        e-Stat API version (default: "3.0")
+    app_id: str or list of str or appid_pool.AppIdPool
+        Application ID, or several ones used in turn (a list is wrapped in
+        an in-memory AppIdPool; pass an AppIdPool with a state_path to share
+        the quota accounting between processes)
+    session: requests.Session
+        HTTP session shared by every call of this client
+        (default: a new keep-alive session.EstatSession)
+    cache: cache.ResponseCache
+        on-disk response cache (default: no cache)
+    meta_index_size: int
+        max number of tables whose metadata.MetaIndex is kept in memory
+    scheduler: scheduler.RequestScheduler
+        rate limiter and retry scheduler of every call of this client
+        (pass it to io_utils.download_all_* to share the same limits)
+    single_flight: bool
+        let concurrent identical calls (across threads) share one request
+        and its parsed result, which must then be treated as read-only
+    base_url: str
+        root url of the API (default: "https://api.e-stat.go.jp/rest")
+    instrumentation: instrumentation.Instrumentation
+        receives the cache and parse events of this client, and the request
+        events when the client creates its own scheduler
+        (default: that of the scheduler, or the process default)
+
+    Raises:
+    =======
+    requests.exceptions.RequestException
+        when a request still fails after the retries
+    scheduler.EstatApiError
+        when the API returns an error RESULT.STATUS
     """
 
-    def __init__(self, api_version=None, app_id=None):
-        self.base_url = "https://api.e-stat.go.jp/rest"
+    def __init__(
+            self,
+            api_version=None,
+            app_id=None,
+            session=None,
+            cache=None,
+            meta_index_size=128,
+            scheduler=None,
+            single_flight=True,
+            base_url=None,
+            instrumentation=None):
+        self.base_url = "https://api.e-stat.go.jp/rest" if base_url is None else base_url
         self.api_version = "3.0" if api_version is None else api_version
         self.app_id = "65a9e884e72959615c2c7c293ebfaeaebffb6030" if app_id is None else app_id
+        if isinstance(self.app_id, (list, tuple)):
+            self.app_id = AppIdPool(self.app_id)
+        self.session = EstatSession() if session is None else session
+        self.cache = cache
+        self.meta_indexes = LRUCache(meta_index_size)
+        self.scheduler = RequestScheduler(instrumentation=instrumentation) if scheduler is None else scheduler
+        self.single_flight = SingleFlight() if single_flight else None
+        self.instrumentation = instrumentation
 
-    def _request_get(self, endpoint, logging=True, stream=True, **params):
+    def _instrumentation(self):
+        return self.instrumentation or self.scheduler.instrumentation or get_default_instrumentation()
+
+    def _json(self, res):
+        with stage(self._instrumentation(), "parse", api=endpoint_label(res.url)):
+            return res.json()
+
+    def _get(self, url, params=None, check_status=True, **kwargs):
+        # the appId of a pool is chosen for each attempt of the scheduler
+        app_id = None if params is None else params.get("appId")
+        if isinstance(app_id, AppIdPool):
+            return app_id.send(self.session.get, url, params=params, check_status=check_status, **kwargs)
+        return self.session.get(url, params=params, **kwargs)
+
+    def _request_get(self, endpoint, logging=True, stream=True, read_body=True, **params):
+        instrumentation = self._instrumentation()
+        cached = None
+        if self.cache is not None:
+            cached = self.cache.get(endpoint, params)
+            if cached is not None and (cached.fresh or self._is_unchanged(endpoint, cached, params)):
+                result = "hit" if cached.fresh else "revalidated"
+                if not cached.fresh:
+                    self.cache.refresh(cached)
+                if instrumentation is not None:
+                    instrumentation.emit("cache", api=endpoint_label(endpoint), url=endpoint, result=result)
+                res = cached.to_response()
+                if logging:
+                    print(res, "CACHE HIT:", res.url)
+                return res
+        headers = {} if cached is None else cached.validators()
         try:
-            res = requests.get(endpoint, params=params, stream=stream)
-            res.encoding = res.apparent_encoding
+            res = self.scheduler.call(
+                functools.partial(self._get, check_status=read_body), endpoint,
+                params=params, stream=stream, headers=headers, check_status=read_body,
+                # a body read by the caller keeps its concurrency slot until closed
+                hold_slot=not read_body,
+            )
+            not_modified = cached is not None and res.status_code == 304
+            if not_modified:
+                res.close()
+                self.cache.refresh(cached)
+                res = cached.to_response()
+            elif read_body:
+                res.encoding = res.apparent_encoding
+                if self.cache is not None and res.status_code == 200:
+                    self.cache.put(endpoint, params, res)
+            if instrumentation is not None and self.cache is not None:
+                result = "not_modified" if not_modified else "miss"
+                instrumentation.emit("cache", api=endpoint_label(endpoint), url=endpoint, result=result)
             if logging:
                 print(res, "HTTP GET:", res.url)
         except requests.exceptions.RequestException as error:
             print(error)
-            sys.exit(1)
+            raise
         return res
 
+    def _is_unchanged(self, endpoint, cached, params):
+        """
+        Revalidate a stale cached table against the UPDATED_DATE of its
+        meta info, which is much smaller than the data itself.
+        """
+        if cached.updated_date is None or "statsDataId" not in params:
+            return False
+        if api_name(endpoint) != "getStatsData":
+            return False
+        meta_endpoint = f"{self.base_url}/{self.api_version}/app/json/getMetaInfo"
+        try:
+            res = self.scheduler.call(self._get, meta_endpoint, params={
+                "appId": params.get("appId", self.app_id),
+                "statsDataId": params["statsDataId"],
+            })
+            table_inf = res.json()["GET_META_INFO"]["METADATA_INF"]["TABLE_INF"]
+        except (requests.exceptions.RequestException, EstatApiError, ValueError, KeyError):
+            return False
+        return str(table_inf.get("UPDATED_DATE")) == cached.updated_date
+
+    @_coalesce
     def getStatsList(self, format="csv", **kwargs):
         """
         2.1 統計表情報取得 (HTTP GET)
@@ -75,7 +232,7 @@ class EstatRestApiClient:
         elif format == "json":
             endpoint = f"{self.base_url}/{self.api_version}/app/json/getStatsList"
             res = self._request_get(endpoint, **params)
-            return res.json()
+            return self._json(res)
         elif format == "jsonp":
             endpoint = f"{self.base_url}/{self.api_version}/app/jsonp/getStatsList"
             res = self._request_get(endpoint, **params)
@@ -86,9 +243,31 @@ class EstatRestApiClient:
             res = self._request_get(endpoint, **params)
             return res.content.decode("utf-8")
 
-    def getMetaInfoURL(self, params_dict, format="csv", **kwargs):
+    def getMetaInfoURL(self, params_dict=None, format="csv", **kwargs):
         """
         2.2 メタ情報取得 (HTTP GET)
+        (kept for backward compatibility, use getMetaInfo)
+        """
+        return self.getMetaInfo(format=format, **kwargs)
+
+    @_coalesce
+    def getMetaInfo(self, format="csv", **kwargs):
+        """
+        2.2 メタ情報取得 (HTTP GET)
+
+        Keyword Args:
+        =============
+        appId: str
+            Application ID. *REQUIRED
+        lang: str
+            language ("J" or "E").
+        statsDataId: str
+            統計表ID *REQUIRED
+        explanationGetFlg: str
+            解説情報有無 ("Y" or "N")
+        callback:
+            コールバック関数
+            only needed for `jsonp` format requests
         """
         params = kwargs
         params["appId"] = self.app_id if not "appId" in params else kwargs["appId"]
@@ -101,7 +280,7 @@ class EstatRestApiClient:
         elif format == "json":
             endpoint = f"{self.base_url}/{self.api_version}/app/json/getMetaInfo"
             res = self._request_get(endpoint, **params)
-            return res.json()
+            return self._json(res)
         elif format == "jsonp":
             endpoint = f"{self.base_url}/{self.api_version}/app/jsonp/getMetaInfo"
             res = self._request_get(endpoint, **params)
@@ -112,7 +291,33 @@ class EstatRestApiClient:
             res = self._request_get(endpoint, **params)
             return res.content.decode("utf-8")
 
-    def getStatsData(self, params_dict, format="csv", **kwargs):
+    def getMetaIndex(self, statsDataId, **kwargs):
+        """
+        Return the metadata.MetaIndex (code -> label / level / parent code
+        lookups) of a table. CLASS_INF is fetched and parsed only once per
+        statsDataId; the indexes of the `meta_index_size` most recently
+        used tables are kept in memory.
+
+        Args:
+        =====
+        statsDataId: str
+            統計表ID
+        **kwargs:
+            other parameters of getMetaInfo (e.g. lang)
+        """
+        key = (statsDataId, tuple(sorted(
+            (name, value) for name, value in kwargs.items() if name != "logging"
+        )))
+        index = self.meta_indexes.get(key)
+        if index is None:
+            json_dict = self.getMetaInfo(format="json", statsDataId=statsDataId, **kwargs)
+            index = MetaIndex.from_json(json_dict)
+            index.statsDataId = statsDataId
+            self.meta_indexes.put(key, index)
+        return index
+
+    @_coalesce
+    def getStatsData(self, params_dict=None, format="csv", **kwargs):
         """
         2.3 統計データ取得 (HTTP GET)
 
@@ -186,6 +391,10 @@ class EstatRestApiClient:
 
         =============
 
+        format="compact" requests json and returns a frames.CompactStatsData:
+        the VALUE records decoded straight into dictionary-encoded code
+        arrays and a float array (no dict per record), with RESULT_INF,
+        TABLE_INF, CLASS_INF and next_key as attributes.
         """
         params = kwargs
         params["appId"] = self.app_id if not "appId" in params else kwargs["appId"]
@@ -198,7 +407,7 @@ class EstatRestApiClient:
         elif format == "json":
             endpoint = f"{self.base_url}/{self.api_version}/app/json/getStatsData"
             res = self._request_get(endpoint, **params)
-            return res.json()
+            return self._json(res)
         elif format == "jsonp":
             endpoint = f"{self.base_url}/{self.api_version}/app/jsonp/getStatsData"
             res = self._request_get(endpoint, **params)
@@ -208,6 +417,324 @@ class EstatRestApiClient:
             endpoint = f"{self.base_url}/{self.api_version}/app/getSimpleStatsData"
             res = self._request_get(endpoint, **params)
             return res.content.decode("utf-8")
+        elif format == "compact":
+            endpoint = f"{self.base_url}/{self.api_version}/app/json/getStatsData"
+            res = self._request_get(endpoint, **params)
+            with stage(self._instrumentation(), "parse", api="getStatsData"):
+                return decode_stats_data(res.content)
+
+    def nextKey(self, page, format="csv"):
+        """
+        Return the <NEXT_KEY> value of a page returned by getStatsList or
+        getStatsData, or None if the page is the last one.
+
+        Args:
+        =====
+        page: dict or str
+            response returned by getStatsList/getStatsData
+        format: str
+            format which the page was requested with
+        """
+        if format == "compact":
+            return page.next_key
+        if format == "json":
+            root = next(iter(page.values()))
+            inf = root.get("DATALIST_INF") or root.get("STATISTICAL_DATA") or {}
+            next_key = inf.get("RESULT_INF", {}).get("NEXT_KEY")
+            return None if next_key is None else int(next_key)
+        return find_next_key(page)
+
+    def _iter_pages(self, method, format, prefetch, **kwargs):
+        start_position = kwargs.pop("startPosition", None)
+
+        def fetch(position):
+            params = dict(kwargs)
+            if position is not None:
+                params["startPosition"] = position
+            return method(format=format, **params)
+
+        if not prefetch:
+            while True:
+                page = fetch(start_position)
+                start_position = self.nextKey(page, format)
+                yield page, start_position
+                if start_position is None:
+                    return
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            future = executor.submit(fetch, start_position)
+            try:
+                while future is not None:
+                    page = future.result()
+                    next_key = self.nextKey(page, format)
+                    # Request the next page before handing over the current
+                    # one so that the network overlaps the caller's work.
+                    future = None if next_key is None else executor.submit(fetch, next_key)
+                    yield page, next_key
+            finally:
+                if future is not None:
+                    future.cancel()
+
+    def iterStatsList(self, format="csv", prefetch=False, **kwargs):
+        """
+        2.1 統計表情報取得 (HTTP GET) following <NEXT_KEY> until the last page.
+
+        Yield (page, next_key) tuples, where page is the response of
+        getStatsList and next_key is the startPosition of the following
+        page (None for the last page). Save next_key after processing a
+        page and pass it back as `startPosition` to resume after a crash.
+
+        Args:
+        =====
+        format: str
+            same as getStatsList
+        prefetch: bool
+            fetch the next page in a background thread while the caller
+            processes the current one
+        **kwargs:
+            same as getStatsList (startPosition is the first page to fetch)
+        """
+        return self._iter_pages(self.getStatsList, format, prefetch, **kwargs)
+
+    def iterStatsData(self, format="csv", prefetch=False, **kwargs):
+        """
+        2.3 統計データ取得 (HTTP GET) following <NEXT_KEY> until the last page.
+
+        Yield (page, next_key) tuples, where page is the response of
+        getStatsData and next_key is the startPosition of the following
+        page (None for the last page). Save next_key after processing a
+        page and pass it back as `startPosition` to resume after a crash.
+
+        Args:
+        =====
+        format: str
+            same as getStatsData
+        prefetch: bool
+            fetch the next page in a background thread while the caller
+            processes the current one
+        **kwargs:
+            same as getStatsData (startPosition is the first page to fetch)
+        """
+        return self._iter_pages(self.getStatsData, format, prefetch, **kwargs)
+
+    def iterStatsDataRows(self, format="csv", follow_next_key=True, chunk_size=DEFAULT_CHUNK_SIZE, **kwargs):
+        """
+        2.3 統計データ取得 (HTTP GET) parsed incrementally from the socket.
+
+        Yield the records of getStatsData one by one instead of holding the
+        whole body in memory:
+            - format="csv": dict per row keyed on the csv column header
+              (section headers of sectionHeaderFlg=1 are skipped)
+            - format="json": VALUE dict per record (e.g. {"@area": ..., "$": ...})
+
+        Args:
+        =====
+        format: str
+            "csv" or "json"
+        follow_next_key: bool
+            go on with the next pages until the last one
+        chunk_size: int
+            size of the chunks read from the socket
+        **kwargs:
+            same as getStatsData (startPosition is the first row to fetch)
+        """
+        for header, rows in self._iter_stats_data_rows(format, follow_next_key, chunk_size, **kwargs):
+            if header is None:
+                for row in rows:
+                    yield row
+            else:
+                for row in rows:
+                    yield dict(zip(header, row))
+
+    def getStatsDataFrame(self, labels=False, as_arrow=False, follow_next_key=True, chunk_size=DEFAULT_CHUNK_SIZE, **kwargs):
+        """
+        2.3 統計データ取得 (HTTP GET) as a columnar table.
+
+        The VALUE records are streamed page by page into columnar buffers
+        (frames.StatsDataFrameBuilder): "tab", "cat01", ..., "area", "time",
+        "unit" become categorical columns and "$" the float column "value",
+        with e-Stat special symbols ("-", "…", "x", "***", ...) as NaN.
+
+        Args:
+        =====
+        labels: bool
+            add "<class>_name" label columns using getMetaIndex
+        as_arrow: bool
+            return a pyarrow.Table instead of a pandas.DataFrame
+        follow_next_key: bool
+            go on with the next pages until the last one
+        chunk_size: int
+            size of the chunks read from the socket
+        **kwargs:
+            same as getStatsData
+        """
+        builder = StatsDataFrameBuilder()
+        for _, records in self._iter_stats_data_rows("json", follow_next_key, chunk_size, **dict(kwargs)):
+            builder.extend(records)
+        meta_index = None
+        if labels:
+            meta_index = self.getMetaIndex(kwargs["statsDataId"], logging=kwargs.get("logging", True))
+        with stage(self._instrumentation(), "frame", api="getStatsData"):
+            return builder.to_arrow(meta_index) if as_arrow else builder.to_pandas(meta_index)
+
+    def getRemoteTable(self, statsDataId, block_by=None, block_cache_size=256, labels=False, **kwargs):
+        """
+        Return a lazy remote.RemoteTable of a table: only its class
+        information is fetched now, and each `loc` access fetches only the
+        selected codes (cached in blocks), e.g.
+
+            table = client.getRemoteTable("0003148500")
+            table.loc(area="東京都", time="2015..")
+
+        Args:
+        =====
+        statsDataId: str
+            統計表ID
+        block_by: str
+            class id the data is fetched and cached by (default: "area")
+        block_cache_size: int
+            max number of blocks kept in memory
+        labels: bool
+            add "<class>_name" label columns
+        **kwargs:
+            other parameters of every getStatsData request (e.g. lang)
+        """
+        from remote import RemoteTable
+
+        return RemoteTable(
+            self, statsDataId, block_by=block_by, block_cache_size=block_cache_size, labels=labels, **kwargs
+        )
+
+    def planStatsData(self, statsDataId, shard_by="auto", n_shards=8, **kwargs):
+        """
+        Split a getStatsData query into independent shards over code
+        ranges of one class, using the class information of getMetaIndex.
+        See planner.plan_shards.
+        """
+        meta_index = self.getMetaIndex(statsDataId, logging=kwargs.get("logging", True))
+        return plan_shards(meta_index, shard_by, n_shards, statsDataId=statsDataId, **kwargs)
+
+    def _fetch_shard(self, params, meta_index=None):
+        builder = StatsDataFrameBuilder()
+        for _, records in self._iter_stats_data_rows("json", True, DEFAULT_CHUNK_SIZE, **dict(params)):
+            builder.extend(records)
+        return builder.to_pandas(meta_index)
+
+    def getStatsDataFrameSharded(
+            self,
+            statsDataId,
+            shard_by="auto",
+            n_shards=8,
+            max_workers=8,
+            labels=False,
+            **kwargs):
+        """
+        2.3 統計データ取得 (HTTP GET) of a large table as independent
+        filtered shards fetched in parallel.
+
+        The query is split by planStatsData into shards over cdArea,
+        cdTime, cdCat01, ... code ranges; each shard walks its own NEXT_KEY
+        pages, so the pages of the shards are fetched in parallel instead of
+        as one serial chain. The shards are concatenated in order into the
+        same frame as getStatsDataFrame.
+
+        Args:
+        =====
+        statsDataId: str
+            統計表ID
+        shard_by: str
+            class id to shard on ("area", "time", "cat01", ...) or "auto"
+        n_shards: int
+            max number of shards
+        max_workers: int
+            max number of shards fetched at once
+        labels: bool
+            add "<class>_name" label columns
+        **kwargs:
+            same as getStatsData
+        """
+        shards = self.planStatsData(statsDataId, shard_by, n_shards, **kwargs)
+        meta_index = None
+        if labels:
+            meta_index = self.getMetaIndex(statsDataId, logging=kwargs.get("logging", True))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            frames = list(executor.map(functools.partial(self._fetch_shard, meta_index=meta_index), shards))
+        return concat_frames(frames)
+
+    def _iter_stats_data_rows(self, format, follow_next_key, chunk_size, **kwargs):
+        """
+        Yield (header, rows) per page, where rows is a lazy iterator of csv
+        rows (lists) or json VALUE records (header is None for json).
+        The rows of a page must be consumed before asking for the next page.
+        """
+        if format == "csv":
+            endpoint = f"{self.base_url}/{self.api_version}/app/getSimpleStatsData"
+        elif format == "json":
+            endpoint = f"{self.base_url}/{self.api_version}/app/json/getStatsData"
+        else:
+            raise ValueError(f"streaming is not supported for format={format!r}")
+        params = kwargs
+        params["appId"] = self.app_id if not "appId" in params else kwargs["appId"]
+        pool = params["appId"] if isinstance(params["appId"], AppIdPool) else None
+        resent = 0
+        while True:
+            res = self._request_get(endpoint, read_body=False, **params)
+            chunks = res.iter_content(chunk_size=chunk_size)
+            # the body is not read by the scheduler: RESULT.STATUS is in the first chunk
+            try:
+                first = next(chunks, b"")
+            except BaseException:
+                res.close()
+                raise
+            status, message = api_status(first)
+            if status is not None and status >= 100:
+                res.close()
+                if pool is not None and status == INVALID_APP_ID_STATUS:
+                    app_id = parse_qs(urlsplit(res.url).query).get("appId", [None])[0]
+                    pool.report(app_id, INVALID, f"STATUS {status}: {message}")
+                    if resent < len(pool) - 1:
+                        resent += 1
+                        continue
+                raise EstatApiError(status, message, res.url)
+            chunks = itertools.chain([first], chunks)
+            info = {}
+            try:
+                if format == "csv":
+                    rows = iter_csv_rows(chunks, info=info)
+                    header = next(rows, None)
+                    if header is not None:
+                        yield header, rows
+                else:
+                    yield None, iter_json_values(chunks, info=info)
+            finally:
+                # releases the concurrency slot held while the body is read
+                res.close()
+            if not follow_next_key or "NEXT_KEY" not in info:
+                return
+            params["startPosition"] = int(info["NEXT_KEY"])
+
+    def syncTables(self, directory="./downloads", format="csv", max_workers=5, **query):
+        """
+        Incremental sync of the tables matching a getStatsList query into
+        a local directory: only the tables updated (updatedDate) since the
+        watermark of the last sync are downloaded again.
+        See harvester.TableHarvester.sync.
+
+        Args:
+        =====
+        directory: str
+            local store (pages and manifest) of the harvested tables
+        format: str
+            "csv" or "json"
+        max_workers: int
+            max number of tables downloaded at once
+        **query:
+            parameters of getStatsList (statsCode, surveyYears, searchWord, ...)
+        """
+        from harvester import TableHarvester
+
+        harvester = TableHarvester(self, directory, format=format, max_workers=max_workers)
+        return harvester.sync(**query)
 
     def postDataset(self):
         """
@@ -250,19 +777,154 @@ class EstatRestApiClient:
             endpoint = f"{self.base_url}/{self.api_version}/app/jsonp/getDataCatalog"
             pass
 
+    @_coalesce
     def getStatsDatas(self, format="xml", **kwargs):
         """
         2.7 統計データ一括取得 (HTTP GET)
+
+        Keyword Args:
+        =============
+        appId: str
+            Application ID. *REQUIRED
+        lang: str
+            language ("J" or "E").
+        statsDatasSpec: str
+            統計データ取得条件 *REQUIRED
+            JSON array of getStatsData parameters, one object per table
+            (at most STATS_DATAS_MAX_SPECS), e.g.
+            '[{"statsDataId": "0003148500", "cdArea": "13000"}, ...]'
+            See getStatsDatasBatched to build and split it automatically.
+        metaGetFlg: True or False
+            メタ情報有無
+        cntGetFlg: True or False
+            件数取得フラグ
+        sectionHeaderFlg : 1 or 2
+            セクションヘッダフラグ (only for `csv` format requests)
         """
         params = kwargs
         params["appId"] = self.app_id if not "appId" in params else kwargs["appId"]
 
         if format == "xml":
             endpoint = f"{self.base_url}/{self.api_version}/app/getStatsDatas"
-            pass
+            res = self._request_get(endpoint, **params)
+            # TODO: Refine & Test followings
+            return res.text
         elif format == "json":
             endpoint = f"{self.base_url}/{self.api_version}/app/json/getStatsDatas"
-            pass
+            res = self._request_get(endpoint, **params)
+            return self._json(res)
         elif format == "csv":
             endpoint = f"{self.base_url}/{self.api_version}/app/getSimpleStatsDatas"
-            pass
+            res = self._request_get(endpoint, **params)
+            return res.content.decode("utf-8")
+
+    def getStatsDatasBatched(
+            self,
+            specs,
+            max_specs=STATS_DATAS_MAX_SPECS,
+            max_spec_length=STATS_DATAS_MAX_SPEC_LENGTH,
+            **kwargs):
+        """
+        Fetch many tables with as few getStatsDatas calls as possible and
+        yield (spec, STATISTICAL_DATA) tuples in the order of `specs`.
+
+        The specs are packed into batches of at most `max_specs` tables whose
+        statsDatasSpec is at most `max_spec_length` characters once
+        url-encoded, and each response (json) is split back into one
+        STATISTICAL_DATA per spec (None if the table is missing from the
+        response). A table cut by <NEXT_KEY> is completed with getStatsData,
+        so its VALUE holds every record.
+
+        Args:
+        =====
+        specs: iterable of str or dict
+            statsDataId, or getStatsData parameters of a table
+            (e.g. {"statsDataId": "0003148500", "cdArea": "13000"})
+        max_specs: int
+            max number of tables per request
+        max_spec_length: int
+            max url-encoded length of statsDatasSpec per request
+            (keeps the URL short)
+        **kwargs:
+            parameters shared by all the requests (e.g. lang, metaGetFlg)
+        """
+        for batch in _batch_specs(specs, max_specs, max_spec_length):
+            json_dict = self.getStatsDatas(
+                format="json",
+                statsDatasSpec=json.dumps(batch, ensure_ascii=False, separators=(",", ":")),
+                **dict(kwargs)
+            )
+            for spec, statistical_data in zip(batch, split_stats_datas(json_dict, batch)):
+                if statistical_data is not None:
+                    self._complete_stats_data(spec, statistical_data, **kwargs)
+                yield spec, statistical_data
+
+    def _complete_stats_data(self, spec, statistical_data, **kwargs):
+        # append the pages after <NEXT_KEY> of a table of getStatsDatas
+        result_inf = statistical_data.get("RESULT_INF") or {}
+        if result_inf.get("NEXT_KEY") is None:
+            return
+        data_inf = statistical_data.setdefault("DATA_INF", {})
+        values = data_inf.get("VALUE") or []
+        values = values if isinstance(values, list) else [values]
+        params = dict(kwargs, **spec)
+        params["startPosition"] = int(result_inf["NEXT_KEY"])
+        params["metaGetFlg"] = "N"
+        for page, _ in self.iterStatsData(format="json", **params):
+            page_data = page["GET_STATS_DATA"].get("STATISTICAL_DATA", {})
+            value = page_data.get("DATA_INF", {}).get("VALUE") or []
+            values.extend(value if isinstance(value, list) else [value])
+            result_inf["TO_NUMBER"] = page_data.get("RESULT_INF", {}).get("TO_NUMBER", result_inf.get("TO_NUMBER"))
+        data_inf["VALUE"] = values
+        del result_inf["NEXT_KEY"]
+
+
+def _batch_specs(specs, max_specs, max_spec_length):
+    batch = []
+    # "[" and "]": "%5B%5D"
+    length = 6
+    for spec in specs:
+        if not isinstance(spec, dict):
+            spec = {"statsDataId": spec}
+        # the spec and its "," as sent in the query string
+        spec_length = len(quote_plus(json.dumps(spec, ensure_ascii=False, separators=(",", ":")))) + 3
+        if batch and (len(batch) >= max_specs or length + spec_length > max_spec_length):
+            yield batch
+            batch = []
+            length = 6
+        batch.append(spec)
+        length += spec_length
+    if batch:
+        yield batch
+
+
+def _find_statistical_data(obj, found):
+    # every table of a getStatsDatas response is an object with TABLE_INF
+    if isinstance(obj, dict):
+        if "TABLE_INF" in obj:
+            found.append(obj)
+            return found
+        for value in obj.values():
+            _find_statistical_data(value, found)
+    elif isinstance(obj, list):
+        for value in obj:
+            _find_statistical_data(value, found)
+    return found
+
+
+def split_stats_datas(json_dict, specs):
+    """
+    Split a getStatsDatas json response into one STATISTICAL_DATA per spec
+    (in the order of `specs`, None for the tables not in the response).
+    The tables are matched on TABLE_INF @id, in response order for specs
+    that share the same statsDataId.
+    """
+    by_id = {}
+    for statistical_data in _find_statistical_data(json_dict, []):
+        table_id = statistical_data["TABLE_INF"].get("@id")
+        by_id.setdefault(table_id, []).append(statistical_data)
+    results = []
+    for spec in specs:
+        candidates = by_id.get(spec.get("statsDataId"))
+        results.append(candidates.pop(0) if candidates else None)
+    return results
@@ -0,0 +1,311 @@
+import random
+import asyncio
+from singleflight import AsyncSingleFlight
+from frames import decode_stats_data
+from appid_pool import INVALID, AppIdPool, outcome
+
+
+# API name -> format -> path under {base_url}/{api_version}/app/
+ENDPOINTS = {
+    "getStatsList": {
+        "xml": "getStatsList",
+        "json": "json/getStatsList",
+        "jsonp": "jsonp/getStatsList",
+        "csv": "getSimpleStatsList",
+    },
+    "getMetaInfo": {
+        "xml": "getMetaInfo",
+        "json": "json/getMetaInfo",
+        "jsonp": "jsonp/getMetaInfo",
+        "csv": "getSimpleMetaInfo",
+    },
+    "getStatsData": {
+        "xml": "getStatsData",
+        "json": "json/getStatsData",
+        "jsonp": "jsonp/getStatsData",
+        "csv": "getSimpleStatsData",
+        "compact": "json/getStatsData",
+    },
+    "getStatsDatas": {
+        "xml": "getStatsDatas",
+        "json": "json/getStatsDatas",
+        "csv": "getSimpleStatsDatas",
+    },
+}
+
+
+class AsyncEstatRestApiClient:
+    """
+    asyncio counterpart of estat_api.EstatRestApiClient (requires aiohttp).
+    Every method is a coroutine returning the same objects as the blocking
+    client: dict for `json`, str for the other formats.
+
+    Use it as an async context manager (or call `close()`) so that the
+    underlying connection pool is released:
+
+        async with AsyncEstatRestApiClient(app_id=...) as client:
+            json_dict = await client.getStatsList(statsCode="00200521", format="json")
+
+    Args:
+    =====
+    api_version: str
+        e-Stat API version (default: "3.0")
+    app_id: str or list of str or appid_pool.AppIdPool
+        Application ID, or several ones used in turn
+        (see EstatRestApiClient)
+    limit: int
+        max number of simultaneous connections
+    limit_per_host: int
+        max number of simultaneous connections to api.e-stat.go.jp
+    timeout: float
+        total timeout in seconds for each request
+    session: aiohttp.ClientSession
+        session to use instead of creating a new one
+    single_flight: bool
+        let concurrent identical calls share one request and its parsed
+        result, which must then be treated as read-only
+    base_url: str
+        root url of the API (default: "https://api.e-stat.go.jp/rest")
+    max_retries: int
+        max number of retries of a request failing with a connection
+        error, a timeout or scheduler.RETRY_HTTP_STATUSES
+    backoff: float
+        base backoff in seconds (doubled at each retry)
+    max_backoff: float
+        max backoff in seconds
+
+    Raises:
+    =======
+    aiohttp.ClientError
+        when a request still fails after the retries
+    scheduler.EstatApiError
+        when the API returns an error RESULT.STATUS
+    """
+
+    def __init__(
+            self,
+            api_version=None,
+            app_id=None,
+            limit=100,
+            limit_per_host=0,
+            timeout=300,
+            session=None,
+            single_flight=True,
+            base_url=None,
+            max_retries=5,
+            backoff=0.5,
+            max_backoff=60.0):
+        self.base_url = "https://api.e-stat.go.jp/rest" if base_url is None else base_url
+        self.api_version = "3.0" if api_version is None else api_version
+        self.app_id = "65a9e884e72959615c2c7c293ebfaeaebffb6030" if app_id is None else app_id
+        if isinstance(self.app_id, (list, tuple)):
+            self.app_id = AppIdPool(self.app_id)
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.timeout = timeout
+        self.session = session
+        self.single_flight = AsyncSingleFlight() if single_flight else None
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    async def __aenter__(self):
+        self._get_session()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def _get_session(self):
+        if self.session is None:
+            try:
+                import aiohttp
+            except ImportError:
+                raise ImportError("AsyncEstatRestApiClient requires aiohttp (pip install aiohttp)")
+            connector = aiohttp.TCPConnector(limit=self.limit, limit_per_host=self.limit_per_host)
+            self.session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self.session
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def _request_get(self, name, format, logging=True, **params):
+        if self.single_flight is None:
+            return await self._fetch(name, format, logging, **params)
+        key = (name, format, tuple(sorted(
+            (key, str(value)) for key, value in params.items() if key != "appId"
+        )))
+        return await self.single_flight.do(key, self._fetch, name, format, logging, **params)
+
+    async def _sleep(self, attempt, retry_after=None):
+        # same backoff as scheduler.RequestScheduler: exponential, full jitter
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * (2 ** attempt)))
+        if retry_after is not None:
+            try:
+                delay = max(delay, float(retry_after))
+            except ValueError:
+                pass
+        await asyncio.sleep(delay)
+
+    async def _fetch(self, name, format, logging=True, **params):
+        # scheduler imports requests: only when a request is sent
+        from scheduler import RETRY_HTTP_STATUSES, EstatApiError, api_status
+
+        if format not in ENDPOINTS[name]:
+            raise ValueError(f"{name} does not support format={format!r}")
+        endpoint = f"{self.base_url}/{self.api_version}/app/{ENDPOINTS[name][format]}"
+        params["appId"] = self.app_id if not "appId" in params else params["appId"]
+        pool = params["appId"] if isinstance(params["appId"], AppIdPool) else None
+        # aiohttp only accepts str/int/float query values
+        params = {key: str(value) for key, value in params.items() if key != "appId" or pool is None}
+        session = self._get_session()
+        import aiohttp
+        loop = asyncio.get_running_loop()
+        attempt = 0
+        resent = 0
+        while True:
+            if pool is not None:
+                # the pool waits on its SQLite state (BEGIN IMMEDIATE): not on the event loop
+                params["appId"] = await loop.run_in_executor(None, pool.acquire)
+            try:
+                async with session.get(endpoint, params=params) as res:
+                    if logging:
+                        print(f"<Response [{res.status}]>", "HTTP GET:", res.url)
+                    content = await res.read() if res.status == 200 else None
+                    if pool is not None:
+                        result, error = outcome(res.status, content)
+                        await loop.run_in_executor(None, pool.report, params["appId"], result, error)
+                        # like AppIdPool.send: a key rejected by the API is
+                        # disabled and the request sent again with the next one
+                        if result == INVALID and resent < len(pool) - 1:
+                            resent += 1
+                            continue
+                    if res.status in RETRY_HTTP_STATUSES and attempt < self.max_retries:
+                        retry_after = res.headers.get("Retry-After")
+                    else:
+                        res.raise_for_status()
+                        status, message = api_status(content)
+                        if status is not None and status >= 100:
+                            raise EstatApiError(status, message, str(res.url))
+                        if format == "json":
+                            return await res.json(content_type=None)
+                        if format == "compact":
+                            return decode_stats_data(content)
+                        return content.decode("utf-8")
+            except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError):
+                if attempt >= self.max_retries:
+                    raise
+                retry_after = None
+            await self._sleep(attempt, retry_after)
+            attempt += 1
+
+    async def getStatsList(self, format="csv", **kwargs):
+        """
+        2.1 統計表情報取得 (HTTP GET)
+        See EstatRestApiClient.getStatsList for the keyword arguments.
+        """
+        return await self._request_get("getStatsList", format, **kwargs)
+
+    async def getMetaInfo(self, format="csv", **kwargs):
+        """
+        2.2 メタ情報取得 (HTTP GET)
+        """
+        return await self._request_get("getMetaInfo", format, **kwargs)
+
+    async def getStatsData(self, format="csv", **kwargs):
+        """
+        2.3 統計データ取得 (HTTP GET)
+        See EstatRestApiClient.getStatsData for the keyword arguments.
+        """
+        return await self._request_get("getStatsData", format, **kwargs)
+
+    async def getStatsDatas(self, format="xml", **kwargs):
+        """
+        2.7 統計データ一括取得 (HTTP GET)
+        """
+        return await self._request_get("getStatsDatas", format, **kwargs)
+
+    async def fanOut(self, method, key, values, max_concurrency=10, **kwargs):
+        """
+        Call `method` once per value of the parameter `key` with at most
+        `max_concurrency` calls in flight, and yield (value, result) tuples
+        in order of completion. `values` may be any (lazy) iterable; only
+        `max_concurrency` tasks exist at any time.
+
+        A failed call (request error, scheduler.EstatApiError, cancelled
+        call) yields (value, exception) instead of stopping the other calls.
+
+        Args:
+        =====
+        method: str
+            "getStatsList", "getMetaInfo", "getStatsData" or "getStatsDatas"
+        key: str
+            name of the parameter which takes each value (e.g. "statsDataId")
+        values: iterable
+            parameter values, one request each
+        max_concurrency: int
+            max number of requests in flight
+        **kwargs:
+            parameters shared by all the requests (e.g. format, lang)
+        """
+        func = getattr(self, method)
+        values = iter(values)
+        pending = {}
+
+        def submit():
+            for value in values:
+                params = dict(kwargs)
+                params[key] = value
+                pending[asyncio.ensure_future(func(**params))] = value
+                return True
+            return False
+
+        for _ in range(max_concurrency):
+            if not submit():
+                break
+        try:
+            while pending:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    value = pending.pop(future)
+                    submit()
+                    if future.cancelled():
+                        yield value, asyncio.CancelledError()
+                    elif future.exception() is not None:
+                        yield value, future.exception()
+                    else:
+                        yield value, future.result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def gatherStatsData(self, statsDataIds, max_concurrency=10, **kwargs):
+        """
+        Fetch getStatsData for every statsDataId with bounded concurrency and
+        yield (statsDataId, result) tuples as they complete.
+
+            async for stats_data_id, json_dict in client.gatherStatsData(ids, format="json"):
+                ...
+
+        Args:
+        =====
+        statsDataIds: iterable of str
+            統計表ID
+        max_concurrency: int
+            max number of requests in flight
+        **kwargs:
+            same as getStatsData
+        """
+        return self.fanOut("getStatsData", "statsDataId", statsDataIds, max_concurrency, **kwargs)
+
+    def gatherMetaInfo(self, statsDataIds, max_concurrency=10, **kwargs):
+        """
+        Fetch getMetaInfo for every statsDataId with bounded concurrency and
+        yield (statsDataId, result) tuples as they complete.
+        """
+        return self.fanOut("getMetaInfo", "statsDataId", statsDataIds, max_concurrency, **kwargs)
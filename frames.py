@@ -0,0 +1,319 @@
+import re
+import json
+import math
+import functools
+from array import array
+
+
+NAN = math.nan
+
+# e-Stat special symbols in VALUE "$" (秘匿, 該当なし, 不詳, etc.) which become NaN
+SPECIAL_SYMBOLS = frozenset(["-", "…", "...", "x", "X", "***", "*", ""])
+
+
+def to_float(item):
+    """
+    Convert a VALUE "$" string into float, e-Stat special symbols into NaN.
+    """
+    if item is None or item in SPECIAL_SYMBOLS:
+        return NAN
+    try:
+        return float(item)
+    except ValueError:
+        return NAN
+
+
+def _floats(items):
+    # float() takes bytes and str; anything else than a number is NaN
+    try:
+        return array("d", map(float, items))
+    except ValueError:
+        return array("d", [to_float(item) for item in items])
+
+
+_json_loads = None
+
+
+def _loads(content):
+    # orjson when installed (imported on first use), json otherwise
+    global _json_loads
+    if _json_loads is None:
+        try:
+            import orjson
+            _json_loads = orjson.loads
+        except ImportError:
+            _json_loads = json.loads
+    return _json_loads(content)
+
+
+class StatsDataFrameBuilder:
+    """
+    Accumulate getStatsData VALUE records into columnar buffers.
+
+    Every "@xxx" key becomes a dictionary-encoded column (code -> small int
+    id in an array of C ints) and "$" becomes a float64 array, so nothing
+    per record is kept once `append` returns. Build the result with
+    `to_pandas` or `to_arrow` after the last page.
+    """
+
+    def __init__(self):
+        # key -> ({code: id}, array of ids, -1 = missing)
+        self.columns = {}
+        self.values = array("d")
+        self.nrows = 0
+
+    def append(self, record):
+        n = self.nrows
+        seen = 0
+        for key, item in record.items():
+            if key == "$":
+                self.values.append(to_float(item))
+                continue
+            column = self.columns.get(key)
+            if column is None:
+                column = self.columns[key] = ({}, array("i", [-1]) * n)
+            ids, codes = column
+            code_id = ids.get(item)
+            if code_id is None:
+                code_id = ids[item] = len(ids)
+            codes.append(code_id)
+            seen += 1
+        if len(self.values) == n:
+            self.values.append(NAN)
+        if seen != len(self.columns):
+            for ids, codes in self.columns.values():
+                if len(codes) == n:
+                    codes.append(-1)
+        self.nrows = n + 1
+
+    def extend(self, records):
+        for record in records:
+            self.append(record)
+        return self
+
+    def to_pandas(self, meta_index=None):
+        """
+        Return a pandas.DataFrame with one categorical column per code
+        ("tab", "cat01", ..., "area", "time", "unit") and a float "value"
+        column. If a metadata.MetaIndex is given, "<class>_name" categorical
+        columns with the labels of the codes are added as well.
+        """
+        import numpy as np
+        import pandas as pd
+
+        data = {}
+        for key, (ids, codes) in self.columns.items():
+            name = key.lstrip("@")
+            categories = list(ids)
+            codes = np.frombuffer(codes, dtype=np.intc)
+            data[name] = pd.Categorical.from_codes(codes, categories=categories)
+            if meta_index is not None and name in meta_index.labels:
+                # labels are not unique across codes: remap the code ids to label ids
+                labels = [meta_index.labels[name].get(code, code) for code in categories]
+                label_ids = {label: i for i, label in enumerate(dict.fromkeys(labels))}
+                # the trailing -1 keeps missing codes (-1) missing
+                remap = np.array([label_ids[label] for label in labels] + [-1], dtype=np.intc)
+                data[name + "_name"] = pd.Categorical.from_codes(remap[codes], categories=list(label_ids))
+        data["value"] = np.frombuffer(self.values, dtype=np.float64)
+        return pd.DataFrame(data)
+
+    def to_arrow(self, meta_index=None):
+        """
+        Return a pyarrow.Table (code columns dictionary-encoded).
+        """
+        try:
+            import pyarrow as pa
+        except ImportError:
+            raise ImportError("to_arrow requires pyarrow (pip install pyarrow)")
+        return pa.Table.from_pandas(self.to_pandas(meta_index), preserve_index=False)
+
+
+VALUE_ARRAY_PATTERN = re.compile(rb'"VALUE"\s*:\s*\[')
+FIRST_RECORD_PATTERN = re.compile(rb'\{[^{}]*\}')
+
+
+@functools.lru_cache(maxsize=64)
+def _record_pattern(keys):
+    # one VALUE record with these keys in this order, e.g.
+    # {"@tab":"020","@area":"13000","@time":"2015000000","@unit":"人","$":"123"}
+    fields = rb"\s*,\s*".join(
+        b'"' + re.escape(key.encode("utf-8")) + rb'"\s*:\s*"([^"\\]*)"' for key in keys
+    )
+    return re.compile(rb"\{\s*" + fields + rb"\s*\}")
+
+
+class CompactStatsData(StatsDataFrameBuilder):
+    """
+    A getStatsData (json) page decoded straight into columnar buffers
+    (see StatsDataFrameBuilder) without a dict per VALUE record.
+    Returned by EstatRestApiClient.getStatsData(format="compact").
+
+    Attributes:
+    ===========
+    columns: dict
+        "@xxx" -> ({code: id}, array of ids)
+    values: array.array
+        "$" as float64 (e-Stat special symbols as NaN)
+    result_inf, table_inf, class_inf: dict
+        RESULT_INF, TABLE_INF and CLASS_INF of the page
+    next_key: int
+        <NEXT_KEY> of the page, None for the last page
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.result = {}
+        self.result_inf = {}
+        self.table_inf = {}
+        self.class_inf = {}
+        self.next_key = None
+
+    def __len__(self):
+        return self.nrows
+
+    def _set_head(self, json_dict):
+        root = next(iter(json_dict.values()))
+        statistical_data = root.get("STATISTICAL_DATA") or {}
+        self.result = root.get("RESULT") or {}
+        self.result_inf = statistical_data.get("RESULT_INF") or {}
+        self.table_inf = statistical_data.get("TABLE_INF") or {}
+        self.class_inf = statistical_data.get("CLASS_INF") or {}
+        next_key = self.result_inf.get("NEXT_KEY")
+        self.next_key = None if next_key is None else int(next_key)
+
+    def _add_rows(self, keys, rows, raw_ids):
+        # raw_ids: key -> {code (bytes): id}, decoded once at the end
+        if not rows:
+            return
+        # findall yields tuples of groups, but the bare group for a single key
+        columns = zip(*rows) if len(keys) > 1 else [rows]
+        for key, codes in zip(keys, columns):
+            if key == "$":
+                self.values.extend(_floats(codes))
+                continue
+            ids = raw_ids.setdefault(key, {})
+            column = self.columns.get(key)
+            if column is None:
+                column = self.columns[key] = (None, array("i"))
+            column[1].extend(array("i", [ids.setdefault(code, len(ids)) for code in codes]))
+        if "$" not in keys:
+            self.values.extend(array("d", [NAN]) * len(rows))
+        self.nrows += len(rows)
+
+    def _decode_ids(self, raw_ids):
+        # only the distinct codes are decoded
+        for key, ids in raw_ids.items():
+            self.columns[key] = ({code.decode("utf-8"): i for code, i in ids.items()}, self.columns[key][1])
+
+
+# bytes of the VALUE array matched at once (bounds the temporary tuples)
+DECODE_SLICE_SIZE = 1024 * 1024
+
+
+def _value_array_end(content, start):
+    # VALUE records are flat objects, so the array is closed by the first "]"
+    # outside a string, i.e. after an even number of quotes (a quote after an
+    # escaped backslash is miscounted: the head then fails to parse)
+    quotes = 0
+    pos = start
+    while True:
+        end = content.index(b"]", pos)
+        quotes += content.count(b'"', pos, end) - content.count(b'\\"', pos, end)
+        if quotes % 2 == 0:
+            return end
+        pos = end + 1
+
+
+def decode_stats_data(content):
+    """
+    Decode a getStatsData json body (bytes) into a CompactStatsData.
+
+    The VALUE array is matched with one regular expression built from the
+    keys of its first record, so no dict or str is created per record and
+    only the distinct codes are decoded. Bodies whose records do not all
+    share the same keys (e.g. some with "@annotation") or hold escaped
+    strings go through the json parser instead. Everything but VALUE is parsed with orjson
+    when it is installed, json otherwise.
+    """
+    match = VALUE_ARRAY_PATTERN.search(content)
+    if match is None:
+        # no VALUE (error, empty result) or a single record as an object
+        return _decode_json(content)
+    start = match.end()
+    try:
+        end = _value_array_end(content, start)
+        head = _loads(content[:start] + content[end:])
+    except ValueError:
+        # the end of the array was missed because of escaped quotes
+        return _decode_json(content)
+    data = CompactStatsData()
+    data._set_head(head)
+    first = FIRST_RECORD_PATTERN.search(content, start, end)
+    if first is None:
+        return data
+    keys = tuple(json.loads(first.group()))
+    pattern = _record_pattern(keys)
+    raw_ids = {}
+    pos = start
+    while pos < end:
+        stop = content.find(b"}", pos + DECODE_SLICE_SIZE, end)
+        stop = end if stop < 0 else stop + 1
+        data._add_rows(keys, pattern.findall(content, pos, stop), raw_ids)
+        pos = stop
+    if data.nrows != content.count(b"{", start, end):
+        return _decode_json(content)
+    data._decode_ids(raw_ids)
+    return data
+
+
+def _decode_json(content):
+    # the whole body through the json parser
+    data = CompactStatsData()
+    json_dict = _loads(content)
+    data._set_head(json_dict)
+    root = next(iter(json_dict.values()))
+    value = root.get("STATISTICAL_DATA", {}).get("DATA_INF", {}).get("VALUE")
+    if value:
+        data.extend(value if isinstance(value, list) else [value])
+    return data
+
+
+def concat_frames(frames):
+    """
+    Concatenate DataFrames built by StatsDataFrameBuilder in order, keeping
+    the code columns categorical (their categories are unified). The
+    columns are those of all the frames (e.g. "annotation" only present in
+    some pages): a column missing from a frame is NaN in its rows.
+    """
+    import numpy as np
+    import pandas as pd
+    from pandas.api.types import union_categoricals
+
+    frames = [frame for frame in frames if len(frame.columns)]
+    if not frames:
+        return pd.DataFrame()
+    # a builder without rows only has "value"
+    nonempty = [frame for frame in frames if len(frame)]
+    if not nonempty:
+        return max(frames, key=lambda frame: len(frame.columns)).iloc[0:0]
+    columns = list(dict.fromkeys(column for frame in nonempty for column in frame.columns))
+    if "value" in columns:
+        columns.append(columns.pop(columns.index("value")))
+    data = {}
+    for column in columns:
+        template = next(frame[column] for frame in nonempty if column in frame.columns)
+        categorical = isinstance(template.dtype, pd.CategoricalDtype)
+        parts = []
+        for frame in nonempty:
+            if column in frame.columns:
+                parts.append(frame[column])
+            elif categorical:
+                dtype = pd.CategoricalDtype(template.cat.categories[:0])
+                parts.append(pd.Series(pd.Categorical.from_codes(np.full(len(frame), -1), dtype=dtype)))
+            else:
+                parts.append(pd.Series(np.nan, index=range(len(frame))))
+        if all(isinstance(part.dtype, pd.CategoricalDtype) for part in parts):
+            data[column] = union_categoricals(parts)
+        else:
+            data[column] = pd.concat(parts, ignore_index=True)
+    return pd.DataFrame(data)
@@ -0,0 +1,415 @@
+import os
+import json
+import time
+import shutil
+import datetime
+import hashlib
+import sqlite3
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+def _as_list(obj):
+    if obj is None:
+        return []
+    return obj if isinstance(obj, list) else [obj]
+
+
+def write_atomic(filepath, data):
+    """
+    Write bytes to a temporary file and rename it, so that a crash never
+    leaves a truncated file behind.
+    """
+    tmp_filepath = f"{filepath}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_filepath, "wb") as f:
+        f.write(data)
+    os.replace(tmp_filepath, filepath)
+
+
+class Manifest:
+    """
+    Persistent job manifest of a harvest (SQLite).
+
+    tables: one row per statsDataId with its status, pages done, the
+            startPosition of the next page, bytes and checksum
+    pages:  one row per downloaded page with its file path, bytes and sha256
+
+    Args:
+    =====
+    path: str
+        path to the manifest file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS tables ("
+            " table_id TEXT PRIMARY KEY,"
+            " status TEXT,"
+            " pages INTEGER DEFAULT 0,"
+            " next_key INTEGER,"
+            " bytes INTEGER DEFAULT 0,"
+            " checksum TEXT,"
+            " updated_date TEXT,"
+            " error TEXT,"
+            " updated_at REAL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            " table_id TEXT,"
+            " page INTEGER,"
+            " start_position INTEGER,"
+            " path TEXT,"
+            " bytes INTEGER,"
+            " sha256 TEXT,"
+            " PRIMARY KEY (table_id, page))"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT)")
+
+    def get_state(self, key, default=None):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM state WHERE key = ?", (key,)).fetchone()
+        return default if row is None else row[0]
+
+    def set_state(self, key, value):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO state VALUES (?, ?)", (key, value))
+
+    def add(self, table_id, updated_date=None):
+        """
+        Register a table (kept as it is if already registered).
+        """
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO tables (table_id, status, updated_date, updated_at)"
+                " VALUES (?, ?, ?, ?)", (table_id, PENDING, updated_date, time.time())
+            )
+
+    def reset(self, table_id, updated_date=None):
+        """
+        Mark a table to be downloaded again from the first page.
+        """
+        with self._lock:
+            self._conn.execute("DELETE FROM pages WHERE table_id = ?", (table_id,))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO tables (table_id, status, updated_date, updated_at)"
+                " VALUES (?, ?, ?, ?)", (table_id, PENDING, updated_date, time.time())
+            )
+
+    def get(self, table_id):
+        with self._lock:
+            cursor = self._conn.execute("SELECT * FROM tables WHERE table_id = ?", (table_id,))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            return dict(zip([column[0] for column in cursor.description], row))
+
+    def unfinished(self):
+        """
+        Return the ids of the tables which are not done yet.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT table_id FROM tables WHERE status != ? ORDER BY table_id", (DONE,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def pages(self, table_id):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT page, start_position, path, bytes, sha256 FROM pages"
+                " WHERE table_id = ? ORDER BY page", (table_id,)
+            ).fetchall()
+
+    def set_status(self, table_id, status, error=None):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE tables SET status = ?, error = ?, updated_at = ? WHERE table_id = ?",
+                (status, error, time.time(), table_id)
+            )
+
+    def add_page(self, table_id, page, start_position, path, size, sha256, next_key):
+        """
+        Record a downloaded page. The last page (next_key None) marks the
+        table as done in the same transaction, so that a crash can never
+        leave every page written but the table unfinished.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?)",
+                (table_id, page, start_position, path, size, sha256)
+            )
+            self._conn.execute(
+                "UPDATE tables SET pages = ?, next_key = ?, bytes = bytes + ?, updated_at = ?"
+                " WHERE table_id = ?", (page + 1, next_key, size, time.time(), table_id)
+            )
+            if next_key is None:
+                self._finish(table_id)
+            self._conn.execute("COMMIT")
+
+    def finish(self, table_id):
+        """
+        Mark a table as done with the checksum of all its pages.
+        """
+        with self._lock:
+            self._finish(table_id)
+
+    def _finish(self, table_id):
+        checksum = hashlib.sha256()
+        for sha256, in self._conn.execute(
+                "SELECT sha256 FROM pages WHERE table_id = ? ORDER BY page", (table_id,)):
+            checksum.update(sha256.encode("ascii"))
+        self._conn.execute(
+            "UPDATE tables SET status = ?, checksum = ?, error = NULL, updated_at = ?"
+            " WHERE table_id = ?", (DONE, checksum.hexdigest(), time.time(), table_id)
+        )
+
+    def summary(self):
+        with self._lock:
+            return dict(self._conn.execute("SELECT status, COUNT(*) FROM tables GROUP BY status").fetchall())
+
+    def close(self):
+        self._conn.close()
+
+
+class TableHarvester:
+    """
+    Download every table matching a getStatsList query in parallel.
+
+    Each page of getStatsData is written to
+    `{directory}/{statsDataId}/{page:05d}.{format}` and recorded in a
+    persistent Manifest, so that a restarted harvest only downloads the
+    tables (and pages) which are not finished yet.
+
+    Args:
+    =====
+    client: estat_api.EstatRestApiClient
+        client used for every request
+    directory: str
+        destination directory
+    manifest_path: str
+        path to the manifest file (default: {directory}/manifest.sqlite3)
+    format: str
+        "csv" or "json"
+    max_workers: int
+        max number of tables downloaded at once
+    limit: int
+        rows per page of getStatsData
+    store: store.ParquetStore
+        local store updated with the tables downloaded by sync()
+    """
+
+    def __init__(
+            self,
+            client,
+            directory="./downloads",
+            manifest_path=None,
+            format="csv",
+            max_workers=5,
+            limit=100000,
+            store=None):
+        self.client = client
+        self.directory = directory
+        self.manifest = Manifest(os.path.join(directory, "manifest.sqlite3") if manifest_path is None else manifest_path)
+        self.format = format
+        self.max_workers = max_workers
+        self.limit = limit
+        self.store = store
+
+    def list_tables(self, **query):
+        """
+        Return the TABLE_INF of every table matching a getStatsList query
+        (following NEXT_KEY).
+        """
+        tables = []
+        for page, _ in self.client.iterStatsList(format="json", **query):
+            datalist_inf = page["GET_STATS_LIST"].get("DATALIST_INF", {})
+            tables.extend(_as_list(datalist_inf.get("TABLE_INF")))
+        return tables
+
+    def add_tables(self, tables):
+        for table in tables:
+            self.manifest.add(table["@id"], table.get("UPDATED_DATE"))
+
+    def harvest(self, **query):
+        """
+        Register the tables matching a getStatsList query (statsCode,
+        surveyYears, searchWord, ...) and download the unfinished ones.
+        Return the manifest summary {status: count}.
+        """
+        if query:
+            self.add_tables(self.list_tables(**query))
+        return self.resume()
+
+    def resume(self):
+        """
+        Download the tables of the manifest which are not done yet.
+        """
+        from tqdm import tqdm
+
+        table_ids = self.manifest.unfinished()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results = list(
+                tqdm(executor.map(self.harvest_table, table_ids), total=len(table_ids))
+            )
+            del results
+        return self.manifest.summary()
+
+    def sync(self, **query):
+        """
+        Incremental harvest: download only the tables updated since the
+        last successful sync of the same query (its watermark saved in the
+        manifest), found with getStatsList(updatedDate="{watermark}-{today}").
+        The pages of an updated table replace its previous files, and the
+        table is written again into `store` if the harvester has one. The
+        first sync of a query harvests every matching table.
+
+        The watermark only moves once every table of the query is done, so
+        the failed ones are listed again by the next sync.
+
+        Return the manifest summary {status: count}.
+        """
+        # paging parameters do not change the tables of a query
+        key = "watermark:" + json.dumps(sorted(
+            (name, str(value)) for name, value in query.items()
+            if name not in ("appId", "logging", "startPosition", "limit")
+        ), ensure_ascii=False)
+        watermark = self.manifest.get_state(key)
+        today = datetime.date.today().strftime("%Y%m%d")
+        if watermark is None:
+            tables = self.list_tables(**query)
+        else:
+            tables = self.list_tables(updatedDate=f"{watermark}-{today}", **query)
+        for table in tables:
+            entry = self.manifest.get(table["@id"])
+            if entry is None:
+                self.manifest.add(table["@id"], table.get("UPDATED_DATE"))
+            elif entry["updated_date"] != table.get("UPDATED_DATE"):
+                # harvested by another query or an earlier version of the table
+                self.refresh_table(table["@id"], table.get("UPDATED_DATE"))
+        summary = self.resume()
+        table_ids = [table["@id"] for table in tables]
+        if self.store is not None:
+            for table_id in table_ids:
+                entry = self.manifest.get(table_id)
+                # the checksum of the stored pages: written once per version
+                if entry["status"] == DONE and self.manifest.get_state(f"stored:{table_id}") != entry["checksum"]:
+                    self.store_table(table_id)
+                    self.manifest.set_state(f"stored:{table_id}", entry["checksum"])
+        if not set(self.manifest.unfinished()).intersection(table_ids):
+            # the range is inclusive, so tables updated later today are seen next time
+            self.manifest.set_state(key, today)
+        return summary
+
+    def store_table(self, table_id):
+        """
+        Write (replace) a downloaded table into `store`. The json pages are
+        decoded from their files; a csv harvest fetches the table again with
+        getStatsDataFrame, since the csv pages are not columnar.
+        """
+        if self.format != "json":
+            self.store.ingest(self.client, table_id, logging=False)
+            return
+        from frames import concat_frames, decode_stats_data
+
+        frames = []
+        for _, _, path, _, _ in self.manifest.pages(table_id):
+            with open(path, "rb") as f:
+                frames.append(decode_stats_data(f.read()).to_pandas())
+        self.store.write(table_id, concat_frames(frames))
+
+    def refresh_table(self, table_id, updated_date=None):
+        """
+        Discard the downloaded pages of a table so that it is downloaded again.
+        """
+        shutil.rmtree(os.path.join(self.directory, table_id), ignore_errors=True)
+        self.manifest.reset(table_id, updated_date)
+
+    def harvest_table(self, table_id):
+        """
+        Download the remaining pages of a table. Return True when done.
+        """
+        entry = self.manifest.get(table_id)
+        if entry is None:
+            self.manifest.add(table_id)
+            entry = self.manifest.get(table_id)
+        if entry["status"] == DONE:
+            return True
+        if entry["pages"] > 0 and entry["next_key"] is None:
+            # every page was written (manifests recorded before the last page
+            # marked the table as done)
+            self.manifest.finish(table_id)
+            return True
+        self.manifest.set_status(table_id, RUNNING)
+        table_dir = os.path.join(self.directory, table_id)
+        os.makedirs(table_dir, exist_ok=True)
+        page_no = entry["pages"]
+        params = {"statsDataId": table_id, "limit": self.limit, "logging": False}
+        if entry["next_key"] is not None:
+            params["startPosition"] = entry["next_key"]
+        start_position = params.get("startPosition", 1)
+        try:
+            for page, next_key in self.client.iterStatsData(format=self.format, **params):
+                if self.format == "json":
+                    page = json.dumps(page, ensure_ascii=False)
+                data = page.encode("utf-8")
+                filepath = os.path.join(table_dir, f"{page_no:05d}.{self.format}")
+                write_atomic(filepath, data)
+                self.manifest.add_page(
+                    table_id, page_no, start_position, filepath, len(data),
+                    hashlib.sha256(data).hexdigest(), next_key,
+                )
+                page_no += 1
+                start_position = next_key
+        except Exception as error:
+            print(table_id, error)
+            self.manifest.set_status(table_id, FAILED, repr(error))
+            return False
+        self.manifest.finish(table_id)
+        return True
+
+
+def main():
+    from estat_api import EstatRestApiClient
+    from appid_pool import AppIdPool
+
+    parser = argparse.ArgumentParser(description="Download every e-Stat table matching a query.")
+    parser.add_argument("--app-id", action="append", default=None, help="repeat to use several appIds in turn")
+    parser.add_argument("--app-id-state", default=None, help="state file of the appId pool shared between processes")
+    parser.add_argument("--directory", default="./downloads")
+    parser.add_argument("--format", default="csv", choices=["csv", "json"])
+    parser.add_argument("--max-workers", type=int, default=5)
+    parser.add_argument("--statsCode")
+    parser.add_argument("--surveyYears")
+    parser.add_argument("--searchWord")
+    parser.add_argument("--lang")
+    parser.add_argument("--sync", action="store_true", help="only download the tables updated since the last sync")
+    args = parser.parse_args()
+
+    query = {
+        key: value for key, value in vars(args).items()
+        if key in ("statsCode", "surveyYears", "searchWord", "lang") and value is not None
+    }
+    app_id = None
+    if args.app_id:
+        app_id = AppIdPool(args.app_id, state_path=args.app_id_state) if len(args.app_id) > 1 else args.app_id[0]
+    client = EstatRestApiClient(app_id=app_id)
+    harvester = TableHarvester(client, args.directory, format=args.format, max_workers=args.max_workers)
+    print(harvester.sync(**query) if args.sync else harvester.harvest(**query))
+
+
+if __name__ == "__main__":
+    main()
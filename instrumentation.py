@@ -0,0 +1,293 @@
+import re
+import time
+import bisect
+import threading
+import contextlib
+
+
+# seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# ".../rest/3.0/app/json/getStatsData" -> "getStatsData"
+ENDPOINT_PATTERN = re.compile(r"/app/(?:json/|jsonp/)?(get\w+|post\w+|ref\w+)")
+
+
+def endpoint_label(url):
+    """
+    Metric label of a url: the API name for e-Stat API urls
+    ("getSimpleStatsData" -> "getStatsData"), "download" for other urls
+    (keeps the number of label values small).
+    """
+    match = ENDPOINT_PATTERN.search(str(url))
+    if match is None:
+        return "download"
+    return match.group(1).replace("getSimple", "get", 1)
+
+
+def _label_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(key, extra=()):
+    items = list(key) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in items) + "}"
+
+
+class Counter:
+    def __init__(self, name, help=""):
+        self.name = name
+        self.help = help
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, value=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def value(self, **labels):
+        return self._values.get(_label_key(labels), 0)
+
+    def collect(self):
+        with self._lock:
+            return {key: value for key, value in self._values.items()}
+
+    def exposition(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self.collect().items()):
+            lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help="", buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        # label key -> [bucket counts..., count, sum]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            values = self._values.get(key)
+            if values is None:
+                values = self._values[key] = [0] * (len(self.buckets) + 2)
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                values[index] += 1
+            values[-2] += 1
+            values[-1] += value
+
+    def count(self, **labels):
+        values = self._values.get(_label_key(labels))
+        return 0 if values is None else values[-2]
+
+    def sum(self, **labels):
+        values = self._values.get(_label_key(labels))
+        return 0.0 if values is None else values[-1]
+
+    def collect(self):
+        with self._lock:
+            return {key: list(values) for key, values in self._values.items()}
+
+    def exposition(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, values in sorted(self.collect().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(key, [('le', bound)])} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(key, [('le', '+Inf')])} {values[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {values[-2]}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {values[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Prometheus-style counters and histograms with labels.
+
+        registry.counter("estat_requests_total").value(api="getStatsData", status=200)
+        print(registry.exposition())  # Prometheus text format
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name, help=""):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = Counter(name, help)
+            return self._metrics[name]
+
+    def histogram(self, name, help="", buckets=DEFAULT_BUCKETS):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = Histogram(name, help, buckets)
+            return self._metrics[name]
+
+    def __getitem__(self, name):
+        return self._metrics[name]
+
+    def __contains__(self, name):
+        return name in self._metrics
+
+    def exposition(self):
+        lines = []
+        for name in sorted(self._metrics):
+            lines.extend(self._metrics[name].exposition())
+        return "\n".join(lines) + "\n"
+
+
+class Instrumentation:
+    """
+    Observability hooks of EstatRestApiClient, scheduler.RequestScheduler
+    and io_utils. Every HTTP call and pipeline stage emits an event which
+    is recorded in a MetricsRegistry and passed to the callbacks as
+    `callback(event, fields)`:
+
+    - "request": api, url, status, seconds (including retries and
+      backoff), ttfb (request sent -> headers received, including the
+      connection set-up on a new connection), transfer (body read), bytes,
+      retries
+    - "retry": api, url, reason (HTTP status or exception name)
+    - "throttle": api, url
+    - "error": api, url, error
+    - "cache": api, url, result ("hit", "revalidated", "not_modified", "miss")
+    - "stage": stage ("parse", "frame", "write", ...), api, seconds
+    - "download": url, bytes, seconds (body streamed to a file), blob
+      (with a blobs.BlobStore: "new", "duplicate" or "skipped" when the
+      body was not transferred)
+
+    Args:
+    =====
+    callbacks: list of callables
+        called with (event, fields) for every event
+    metrics: MetricsRegistry
+        registry to record the metrics in (default: a new one,
+        False: no metrics)
+    tracer: callable
+        tracer(name, attributes) returning a context manager that spans a
+        request or a stage, e.g. for OpenTelemetry:
+        lambda name, attributes: tracer.start_as_current_span(name, attributes=attributes)
+    """
+
+    def __init__(self, callbacks=None, metrics=None, tracer=None):
+        self.callbacks = list(callbacks or [])
+        self.metrics = MetricsRegistry() if metrics is None else (metrics or None)
+        self.tracer = tracer
+        if self.metrics is not None:
+            self._register(self.metrics)
+
+    @staticmethod
+    def _register(metrics):
+        metrics.counter("estat_requests_total", "HTTP requests by API and status")
+        metrics.histogram("estat_request_seconds", "request latency including retries")
+        metrics.histogram("estat_ttfb_seconds", "time to the response headers")
+        metrics.histogram("estat_transfer_seconds", "time to read the response body")
+        metrics.counter("estat_response_bytes_total", "bytes of the response bodies")
+        metrics.counter("estat_retries_total", "retried requests by reason")
+        metrics.counter("estat_throttles_total", "429/503 responses")
+        metrics.counter("estat_errors_total", "failed requests")
+        metrics.counter("estat_cache_total", "cache lookups by result")
+        metrics.histogram("estat_stage_seconds", "time spent in pipeline stages")
+        metrics.counter("estat_download_bytes_total", "bytes written by io_utils downloads")
+        metrics.histogram("estat_download_seconds", "time to stream a download to a file")
+        metrics.counter("estat_blob_total", "downloads stored in a blob store by result")
+
+    def add_callback(self, callback):
+        self.callbacks.append(callback)
+
+    def emit(self, event, **fields):
+        if self.metrics is not None:
+            self._record(event, fields)
+        for callback in self.callbacks:
+            try:
+                callback(event, fields)
+            except Exception as error:
+                # a broken hook must not break the requests
+                print("instrumentation callback failed:", repr(error))
+
+    def _record(self, event, fields):
+        metrics = self.metrics
+        api = fields.get("api", "download")
+        if event == "request":
+            metrics["estat_requests_total"].inc(api=api, status=fields.get("status"))
+            metrics["estat_request_seconds"].observe(fields["seconds"], api=api)
+            if fields.get("ttfb") is not None:
+                metrics["estat_ttfb_seconds"].observe(fields["ttfb"], api=api)
+            if fields.get("transfer") is not None:
+                metrics["estat_transfer_seconds"].observe(fields["transfer"], api=api)
+            if fields.get("bytes"):
+                metrics["estat_response_bytes_total"].inc(fields["bytes"], api=api)
+        elif event == "retry":
+            metrics["estat_retries_total"].inc(api=api, reason=fields.get("reason"))
+        elif event == "throttle":
+            metrics["estat_throttles_total"].inc(api=api)
+        elif event == "error":
+            metrics["estat_errors_total"].inc(api=api, error=type(fields.get("error")).__name__)
+        elif event == "cache":
+            metrics["estat_cache_total"].inc(api=api, result=fields.get("result"))
+        elif event == "stage":
+            metrics["estat_stage_seconds"].observe(fields["seconds"], api=api, stage=fields.get("stage"))
+        elif event == "download":
+            metrics["estat_download_bytes_total"].inc(fields.get("bytes") or 0)
+            metrics["estat_download_seconds"].observe(fields["seconds"])
+            if fields.get("blob"):
+                metrics["estat_blob_total"].inc(result=fields["blob"])
+
+    def span(self, name, **attributes):
+        """
+        Tracing span of the tracer (a no-op without tracer).
+        """
+        if self.tracer is None:
+            return contextlib.nullcontext()
+        return self.tracer(name, attributes)
+
+    @contextlib.contextmanager
+    def stage(self, stage, **fields):
+        """
+        Time a block as a "stage" event (and a span).
+
+            with instrumentation.stage("parse", api="getStatsData"):
+                json_dict = res.json()
+        """
+        start = time.perf_counter()
+        with self.span(f"estat.{stage}", **fields):
+            yield
+        self.emit("stage", stage=stage, seconds=time.perf_counter() - start, **fields)
+
+
+def stage(instrumentation, name, **fields):
+    """
+    instrumentation.stage(name, **fields), or a no-op without instrumentation.
+    """
+    if instrumentation is None:
+        return contextlib.nullcontext()
+    return instrumentation.stage(name, **fields)
+
+
+_default_instrumentation = None
+
+
+def get_default_instrumentation():
+    """
+    Return the process-wide Instrumentation used by the schedulers and
+    io_utils functions which were not given one (None by default).
+    """
+    return _default_instrumentation
+
+
+def set_default_instrumentation(instrumentation):
+    """
+    Instrument every client, scheduler and io_utils download of the
+    process, e.g. set_default_instrumentation(Instrumentation()).
+    """
+    global _default_instrumentation
+    _default_instrumentation = instrumentation
+    return instrumentation
@@ -1,15 +1,182 @@
+import os
 import csv
+import gzip
 import json
-import xlrd
+import time
+import codecs
+import contextlib
+import fnmatch
+import hashlib
+import itertools
+import tempfile
 import zipfile
 import requests
 import functools
-import pandas as pd
-from concurrent.futures import ThreadPoolExecutor
-from tqdm import tqdm
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from session import EstatSession, get_default_session
+from scheduler import EstatApiError, RequestScheduler, api_status, get_default_scheduler
+from instrumentation import get_default_instrumentation, stage
+from blobs import SKIPPED, blob_key, variant
 
 
-def get_json(url):
+def _progress(iterable, total=None):
+    # tqdm is imported on first use (it is not needed to import io_utils)
+    from tqdm import tqdm
+
+    return tqdm(iterable, total=total)
+
+
+def _session_for(session):
+    return get_default_session() if session is None else session
+
+
+@contextlib.contextmanager
+def _pool_session(session, max_workers):
+    # A session sized so that every worker thread keeps its own connection alive,
+    # closed with its connections once the workers are done
+    if session is not None:
+        yield session
+        return
+    session = EstatSession(pool_maxsize=max_workers)
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+def _stream(url, session, scheduler, consume, blob_store=None, blob_variant=""):
+    # the body is read by consume(r) under scheduler.stream, so that a connection
+    # broken in the middle of a download requests the file again
+    headers = {}
+    if blob_store is not None:
+        # a url whose blob is stored is requested with its validators (304: no transfer)
+        headers = blob_store.validators(requests.Request("GET", url).prepare().url, blob_variant)
+    return scheduler.stream(
+        _session_for(session).get, consume, url, stream=True, check_status=False, headers=headers)
+
+
+def _requested_url(r):
+    # the url before redirects, which the blob store knows the payload by
+    return r.history[0].url if r.history else r.url
+
+
+def _scheduler_for(scheduler):
+    return get_default_scheduler() if scheduler is None else scheduler
+
+
+def _pool_scheduler(scheduler, max_workers):
+    return RequestScheduler(max_concurrency=max_workers) if scheduler is None else scheduler
+
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+
+def write_stream(
+        r,
+        filepath,
+        enc=None,
+        dec=None,
+        chunk_size=DEFAULT_CHUNK_SIZE,
+        compress=False,
+        check_status=False,
+        instrumentation=None,
+        blob_store=None):
+    """
+    Write the body of a streamed response to a file chunk by chunk, so that
+    memory use does not depend on the size of the download.
+    The file is written to a temporary file which is renamed at the end,
+    so that an interrupted download never leaves a truncated file.
+    Return the number of bytes written (before compression, 0 when the
+    body is not read).
+
+    Args:
+    =====
+    r: requests.Response
+        response requested with stream=True
+    filepath: string
+        valid path to the destination file
+    enc: string
+        encoding of the destination file (None: bytes are written as they are)
+    dec: string
+        encoding of the content in the response
+        (transcoded incrementally into `enc`, e.g. 'utf-8' -> 'cp932')
+    chunk_size: int
+        size of the chunks read from the socket
+    compress: bool
+        gzip the destination file
+    check_status: bool
+        raise scheduler.EstatApiError (and write nothing) if the first chunk
+        holds an error RESULT.STATUS of e-Stat API
+    instrumentation: instrumentation.Instrumentation
+        receives a "download" event (bytes, seconds, blob) once the file is
+        written (default: instrumentation.get_default_instrumentation())
+    blob_store: blobs.BlobStore
+        store the file in this content-addressed store and make `filepath`
+        a link to its blob; the body is not read when the headers show
+        that the store already has it
+    """
+    instrumentation = instrumentation or get_default_instrumentation()
+    start = time.perf_counter()
+    result = None
+    if blob_store is not None:
+        url = _requested_url(r)
+        blob_variant = variant(enc, dec, compress)
+        key = blob_store.match(url, r, blob_variant)
+        if key is None and r.status_code == 304:
+            r.close()
+            raise requests.exceptions.HTTPError(f"304 Not Modified but the blob is gone: {url}", response=r)
+        if key is not None:
+            r.close()
+            blob_store.link(key, filepath)
+            if r.status_code == 200:
+                blob_store.record(url, r, key, blob_variant)
+            if instrumentation is not None:
+                instrumentation.emit(
+                    "download", url=r.url, bytes=0, seconds=time.perf_counter() - start, blob=SKIPPED)
+            return 0
+        sha256 = hashlib.sha256()
+    tmp_filepath = f"{filepath}.part"
+    transcode = enc is not None and dec is not None and codecs.lookup(enc) != codecs.lookup(dec)
+    if transcode:
+        decoder = codecs.getincrementaldecoder(dec)()
+        encoder = codecs.getincrementalencoder(enc)()
+    size = 0
+    try:
+        with (gzip.open(tmp_filepath, "wb") if compress else open(tmp_filepath, "wb")) as f:
+            for chunk in r.iter_content(chunk_size=chunk_size):
+                if check_status and size == 0:
+                    status, message = api_status(chunk)
+                    if status is not None and status >= 100:
+                        raise EstatApiError(status, message, r.url)
+                if transcode:
+                    chunk = encoder.encode(decoder.decode(chunk))
+                if chunk:
+                    f.write(chunk)
+                    size += len(chunk)
+                    if blob_store is not None:
+                        sha256.update(chunk)
+            if transcode:
+                chunk = encoder.encode(decoder.decode(b"", final=True), final=True)
+                f.write(chunk)
+                size += len(chunk)
+                if blob_store is not None:
+                    sha256.update(chunk)
+        if blob_store is None:
+            os.replace(tmp_filepath, filepath)
+        else:
+            key = blob_key(sha256.hexdigest(), compress)
+            result = blob_store.add(tmp_filepath, key, filepath)
+            blob_store.record(url, r, key, blob_variant)
+    except BaseException:
+        if os.path.exists(tmp_filepath):
+            os.remove(tmp_filepath)
+        raise
+    if instrumentation is not None:
+        instrumentation.emit("download", url=r.url, bytes=size, seconds=time.perf_counter() - start, blob=result)
+    return size
+
+
+def get_json(url, session=None, scheduler=None):
     """
     Request a HTTP GET method to the given url (for REST API)
     and return its response as the dict object.
@@ -18,17 +185,21 @@ def get_json(url):
     ====
     url: string
         valid url for REST API
+    session: requests.Session
+        HTTP session to reuse connections from (default: shared session)
+    scheduler: scheduler.RequestScheduler
+        rate limiter and retry scheduler (default: shared scheduler)
     """
     try:
         print("HTTP GET", url)
-        r = requests.get(url)
+        r = _scheduler_for(scheduler).call(_session_for(session).get, url)
         json_dict = r.json()
         return json_dict
-    except requests.exceptions.RequestException as error:
+    except (requests.exceptions.RequestException, EstatApiError) as error:
         print(error)
 
 
-def download_json(url, filepath):
+def download_json(url, filepath, session=None, scheduler=None):
     """
     Request a HTTP GET method to the given url (for REST API)
     and save its response as the json file.
@@ -38,19 +209,33 @@ def download_json(url, filepath):
         valid url for REST API
     filepath: string
         valid path to the destination file
+    session: requests.Session
+        HTTP session to reuse connections from (default: shared session)
+    scheduler: scheduler.RequestScheduler
+        rate limiter and retry scheduler (default: shared scheduler)
     """
     try:
         print("HTTP GET", url)
-        r = requests.get(url)
+        r = _scheduler_for(scheduler).call(_session_for(session).get, url)
         json_dict = r.json()
         json_str = json.dumps(json_dict, indent=2, ensure_ascii=False)
         with open(filepath, "w") as f:
             f.write(json_str)
-    except requests.exceptions.RequestException as error:
+    except (requests.exceptions.RequestException, EstatApiError) as error:
         print(error)
 
 
-def download_str(url, filepath, enc="utf-8", dec="utf-8", logging=False):
+def download_str(
+        url,
+        filepath,
+        enc="utf-8",
+        dec="utf-8",
+        logging=False,
+        session=None,
+        scheduler=None,
+        chunk_size=DEFAULT_CHUNK_SIZE,
+        compress=False,
+        blob_store=None):
     """
     Request a HTTP GET method to the given url (for REST API)
     and save its response as the local text file.
@@ -70,14 +255,31 @@ def download_str(url, filepath, enc="utf-8", dec="utf-8", logging=False):
             dec = 'cp932' for Excel with extended JP str on Win
     logging: bool
         flag to display HTTP request status
+    session: requests.Session
+        HTTP session to reuse connections from (default: shared session)
+    scheduler: scheduler.RequestScheduler
+        rate limiter and retry scheduler (default: shared scheduler)
+    chunk_size: int
+        size of the chunks read from the socket and written to the file
+    compress: bool
+        gzip the destination file
+    blob_store: blobs.BlobStore
+        content-addressed store deduplicating the downloaded files
+        (see write_stream)
     """
     try:
-        r = requests.get(url, stream=True)
-        if logging:
-            print("HTTP GET",  f"[{r.status_code}]", url)
-        with open(filepath, 'w', encoding=enc) as f:
-            f.write(r.content.decode(dec))
-    except requests.exceptions.RequestException as error:
+        scheduler = _scheduler_for(scheduler)
+
+        def write(r):
+            if logging:
+                print("HTTP GET",  f"[{r.status_code}]", url)
+            return write_stream(
+                r, filepath, enc=enc, dec=dec, chunk_size=chunk_size, compress=compress, check_status=True,
+                instrumentation=scheduler.instrumentation,
+                blob_store=blob_store)
+
+        _stream(url, session, scheduler, write, blob_store, variant(enc, dec, compress))
+    except (requests.exceptions.RequestException, EstatApiError) as error:
         print(error)
 
 
@@ -86,7 +288,12 @@ def download_all_str(
         filepathes,
         max_workers=10,
         enc="utf-8",
-        dec="utf-8"):
+        dec="utf-8",
+        session=None,
+        scheduler=None,
+        chunk_size=DEFAULT_CHUNK_SIZE,
+        compress=False,
+        blob_store=None):
     """
     Request some HTTP GET methods to the given urls (for REST API)
     and save each response as the local text file.
@@ -109,17 +316,46 @@ def download_all_str(
             dec = 'sjis'  for Excel on Win
             dec = 'cp932' for Excel with extended JP str on Win
     logging: True/False
+    session: requests.Session
+        HTTP session shared by all the worker threads
+        (default: a new session with a connection per worker, closed at the end)
+    scheduler: scheduler.RequestScheduler
+        rate limiter and retry scheduler shared by all the worker threads
+        (default: a new scheduler allowing max_workers requests in flight)
+    chunk_size: int
+        size of the chunks read from the socket and written to the files
+    compress: bool
+        gzip the destination files
+    blob_store: blobs.BlobStore
+        content-addressed store deduplicating the downloaded files
+        (see write_stream)
     """
-    func = functools.partial(download_str, enc=enc, dec=dec)
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        results = list(
-            tqdm(executor.map(func, urls, filepathes), total=len(urls))
+    with _pool_session(session, max_workers) as session:
+        func = functools.partial(
+            download_str, enc=enc, dec=dec,
+            session=session,
+            scheduler=_pool_scheduler(scheduler, max_workers),
+            chunk_size=chunk_size,
+            compress=compress,
+            blob_store=blob_store,
         )
-        del results
-        return
-
-
-def download_bin(url, filepath, logging=False):
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(
+                _progress(executor.map(func, urls, filepathes), total=len(urls))
+            )
+            del results
+            return
+
+
+def download_bin(
+        url,
+        filepath,
+        logging=False,
+        session=None,
+        scheduler=None,
+        chunk_size=DEFAULT_CHUNK_SIZE,
+        compress=False,
+        blob_store=None):
     """
     Request some HTTP GET methods to the given urls (for REST API)
     and save each response as the xls file.
@@ -132,18 +368,42 @@ def download_bin(url, filepath, logging=False):
         valid pathes to the destination file
     logging: bool
         flag to display HTTP request status
+    session: requests.Session
+        HTTP session to reuse connections from (default: shared session)
+    scheduler: scheduler.RequestScheduler
+        rate limiter and retry scheduler (default: shared scheduler)
+    chunk_size: int
+        size of the chunks read from the socket and written to the file
+    compress: bool
+        gzip the destination file
+    blob_store: blobs.BlobStore
+        content-addressed store deduplicating the downloaded files
+        (see write_stream)
     """
     try:
-        r = requests.get(url, stream=True)
-        if logging:
-            print("HTTP GET",  f"[{r.status_code}]", url)
-        with open(filepath, 'wb') as f:
-            f.write(r.content)
-    except requests.exceptions.RequestException as error:
+        scheduler = _scheduler_for(scheduler)
+
+        def write(r):
+            if logging:
+                print("HTTP GET",  f"[{r.status_code}]", url)
+            return write_stream(
+                r, filepath, chunk_size=chunk_size, compress=compress, instrumentation=scheduler.instrumentation,
+                blob_store=blob_store)
+
+        _stream(url, session, scheduler, write, blob_store, variant(compress=compress))
+    except (requests.exceptions.RequestException, EstatApiError) as error:
         print(error)
 
 
-def download_all_bin(urls, filepathes, max_workers=5):
+def download_all_bin(
+        urls,
+        filepathes,
+        max_workers=5,
+        session=None,
+        scheduler=None,
+        chunk_size=DEFAULT_CHUNK_SIZE,
+        compress=False,
+        blob_store=None):
     """
     Request some HTTP GET methods to the given urls (for REST API)
     and save each response as the local file.
@@ -158,21 +418,208 @@ def download_all_bin(urls, filepathes, max_workers=5):
         valid pathes to the destination file
     max_workers: int
         max number of working threads of CPUs within executing this method.
+    session: requests.Session
+        HTTP session shared by all the worker threads
+        (default: a new session with a connection per worker, closed at the end)
+    scheduler: scheduler.RequestScheduler
+        rate limiter and retry scheduler shared by all the worker threads
+        (default: a new scheduler allowing max_workers requests in flight)
+    chunk_size: int
+        size of the chunks read from the socket and written to the files
+    compress: bool
+        gzip the destination files
+    blob_store: blobs.BlobStore
+        content-addressed store deduplicating the downloaded files
+        (see write_stream)
     """
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        results = list(
-            tqdm(executor.map(download_bin, urls, filepathes), total=len(urls))
+    with _pool_session(session, max_workers) as session:
+        func = functools.partial(
+            download_bin,
+            session=session,
+            scheduler=_pool_scheduler(scheduler, max_workers),
+            chunk_size=chunk_size,
+            compress=compress,
+            blob_store=blob_store,
         )
-        del results
-        return
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(
+                _progress(executor.map(func, urls, filepathes), total=len(urls))
+            )
+            del results
+            return
 
 
 def csv_from_xls(xls_filepath, csv_filepath, sheet="Sheet1", enc="utf-8"):
+    import pandas as pd
+
     data_xls = pd.read_excel(xls_filepath, sheet, index_col=None)
     data_xls.to_csv(csv_filepath, encoding=enc)
 
 
-def download_csv(url, filepath, enc="utf-8", dec="utf-8", logging=False):
+def csvs_from_xls(xls_filepath, csv_dir, enc="utf-8"):
+    """
+    Convert every sheet of an Excel file into `{csv_dir}/{file name}_{sheet}.csv`
+    and return the pathes of the csv files.
+
+    Args:
+    =====
+    xls_filepath: string
+        valid path to the .xls/.xlsx file
+    csv_dir: path string
+        valid dir path where the csv files are saved
+    enc: string
+        encoding of the csv files
+    """
+    import pandas as pd
+
+    os.makedirs(csv_dir, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(xls_filepath))[0]
+    csv_filepathes = []
+    # one sheet in memory at a time (sheet_name=None would parse them all at once)
+    with pd.ExcelFile(xls_filepath) as xls:
+        for sheet in xls.sheet_names:
+            data_xls = xls.parse(sheet, index_col=None)
+            csv_filepath = os.path.join(csv_dir, f"{stem}_{sheet}.csv")
+            data_xls.to_csv(csv_filepath, encoding=enc)
+            csv_filepathes.append(csv_filepath)
+            del data_xls
+    return csv_filepathes
+
+
+def read_csv_columnar(filepath, categorical=True, **kwargs):
+    """
+    Read a csv file into a pandas.DataFrame whose string columns are
+    turned into categoricals, which are much smaller to keep and to send
+    back from a worker process.
+
+    Args:
+    =====
+    filepath: string
+        valid path to the csv file
+    categorical: bool
+        convert the string columns into categoricals
+    **kwargs:
+        arguments of pandas.read_csv (encoding, usecols, dtype, ...)
+    """
+    import pandas as pd
+
+    data = pd.read_csv(filepath, **kwargs)
+    if categorical:
+        for column in data.select_dtypes(include=["object", "string"]).columns:
+            data[column] = data[column].astype("category")
+    return data
+
+
+def _process_map(func, iterables, max_workers, max_tasks_per_child, chunksize=1):
+    # executor.map in worker processes replaced after max_tasks_per_child tasks,
+    # to bound the memory each of them can pile up: a new pool per batch of
+    # tasks (ProcessPoolExecutor(max_tasks_per_child=...) needs Python 3.11
+    # and can deadlock when it replaces a worker on 3.11)
+    if max_tasks_per_child is None:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            yield from executor.map(func, *iterables, chunksize=chunksize)
+        return
+    batch_size = (max_workers or os.cpu_count() or 1) * max_tasks_per_child
+    tasks = zip(*iterables)
+    while True:
+        batch = list(itertools.islice(tasks, batch_size))
+        if not batch:
+            return
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            yield from executor.map(func, *zip(*batch), chunksize=chunksize)
+
+
+def convert_all_xls(
+        xls_filepathes,
+        csv_dirs,
+        max_workers=None,
+        enc="utf-8",
+        max_tasks_per_child=16):
+    """
+    Convert every sheet of many Excel files into csv files
+    (see csvs_from_xls).
+    (!! This method uses multi processing since parsing Excel files is
+    CPU-bound and cannot run in parallel in threads.)
+
+    Args:
+    =====
+    xls_filepathes: list of strings
+        valid pathes to the .xls/.xlsx files
+    csv_dirs: list of path strings
+        valid dir pathes where the csv files are saved
+    max_workers: int
+        max number of worker processes (default: number of CPUs)
+    enc: string
+        encoding of the csv files
+    max_tasks_per_child: int
+        number of files a worker process converts before being replaced:
+        a new pool of workers is started for every max_workers *
+        max_tasks_per_child files (None = never replaced)
+
+    Returns:
+    ========
+    list of the lists of csv file pathes, in the order of xls_filepathes
+    """
+    func = functools.partial(csvs_from_xls, enc=enc)
+    with stage(get_default_instrumentation(), "convert_xls"):
+        return list(_progress(
+            _process_map(func, (xls_filepathes, csv_dirs), max_workers, max_tasks_per_child),
+            total=len(xls_filepathes),
+        ))
+
+
+def read_all_csv(
+        filepathes,
+        max_workers=None,
+        categorical=True,
+        max_tasks_per_child=16,
+        chunksize=1,
+        **kwargs):
+    """
+    Parse many csv files in worker processes (see read_csv_columnar).
+    (!! This method uses multi processing since parsing csv files is
+    CPU-bound and cannot run in parallel in threads.)
+
+    Args:
+    =====
+    filepathes: list of strings
+        valid pathes to the csv files
+    max_workers: int
+        max number of worker processes (default: number of CPUs)
+    categorical: bool
+        convert the string columns into categoricals
+    max_tasks_per_child: int
+        number of files a worker process parses before being replaced:
+        a new pool of workers is started for every max_workers *
+        max_tasks_per_child files (None = never replaced)
+    chunksize: int
+        number of files sent to a worker at once (raise it for many small files)
+    **kwargs:
+        arguments of pandas.read_csv (encoding, usecols, dtype, ...)
+
+    Returns:
+    ========
+    list of pandas.DataFrame, in the order of filepathes
+    """
+    func = functools.partial(read_csv_columnar, categorical=categorical, **kwargs)
+    with stage(get_default_instrumentation(), "read_csv"):
+        return list(_progress(
+            _process_map(func, (filepathes,), max_workers, max_tasks_per_child, chunksize),
+            total=len(filepathes),
+        ))
+
+
+def download_csv(
+        url,
+        filepath,
+        enc="utf-8",
+        dec="utf-8",
+        logging=False,
+        session=None,
+        scheduler=None,
+        chunk_size=DEFAULT_CHUNK_SIZE,
+        compress=False,
+        blob_store=None):
     """
     Request a HTTP GET method to the given url (for REST API)
     and save its response as the csv file.
@@ -192,14 +639,27 @@ def download_csv(url, filepath, enc="utf-8", dec="utf-8", logging=False):
             dec = 'cp932' for Excel with extended JP str on Win
     logging: True/False
         flag whether putting process log
+    session: requests.Session
+        HTTP session to reuse connections from (default: shared session)
+    scheduler: scheduler.RequestScheduler
+        rate limiter and retry scheduler (default: shared scheduler)
+    chunk_size: int
+        size of the chunks read from the socket and written to the file
+    compress: bool
+        gzip the destination file
+    blob_store: blobs.BlobStore
+        content-addressed store deduplicating the downloaded files
+        (see write_stream)
     """
     try:
         if logging:
             print("HTTP GET", url)
-        r = requests.get(url, stream=True)
-        with open(filepath, 'w', encoding=enc) as f:
-            f.write(r.content.decode(dec))
-    except requests.exceptions.RequestException as error:
+        scheduler = _scheduler_for(scheduler)
+        write = functools.partial(
+            write_stream, filepath=filepath, enc=enc, dec=dec, chunk_size=chunk_size, compress=compress,
+            check_status=True, instrumentation=scheduler.instrumentation, blob_store=blob_store)
+        _stream(url, session, scheduler, write, blob_store, variant(enc, dec, compress))
+    except (requests.exceptions.RequestException, EstatApiError) as error:
         print(error)
 
 
@@ -208,7 +668,12 @@ def download_all_csv(
         filepathes,
         max_workers=10,
         enc="utf-8",
-        dec="utf-8"):
+        dec="utf-8",
+        session=None,
+        scheduler=None,
+        chunk_size=DEFAULT_CHUNK_SIZE,
+        compress=False,
+        blob_store=None):
     """
     Request some HTTP GET methods to the given urls (for REST API)
     and save each response as the csv file.
@@ -231,29 +696,56 @@ def download_all_csv(
             dec = 'sjis'  for Excel on Win
             dec = 'cp932' for Excel with extended JP str on Win
     logging: True/False
+    session: requests.Session
+        HTTP session shared by all the worker threads
+        (default: a new session with a connection per worker, closed at the end)
+    scheduler: scheduler.RequestScheduler
+        rate limiter and retry scheduler shared by all the worker threads
+        (default: a new scheduler allowing max_workers requests in flight)
+    chunk_size: int
+        size of the chunks read from the socket and written to the files
+    compress: bool
+        gzip the destination files
+    blob_store: blobs.BlobStore
+        content-addressed store deduplicating the downloaded files
+        (see write_stream)
     """
-    func = functools.partial(download_csv, enc=enc, dec=dec)
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        results = list(
-            tqdm(executor.map(func, urls, filepathes), total=len(urls))
+    with _pool_session(session, max_workers) as session:
+        func = functools.partial(
+            download_csv, enc=enc, dec=dec,
+            session=session,
+            scheduler=_pool_scheduler(scheduler, max_workers),
+            chunk_size=chunk_size,
+            compress=compress,
+            blob_store=blob_store,
         )
-        del results
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(
+                _progress(executor.map(func, urls, filepathes), total=len(urls))
+            )
+            del results
 
 
-def download_zip(url, filepath):
+def download_zip(url, filepath, session=None, scheduler=None, chunk_size=DEFAULT_CHUNK_SIZE, blob_store=None):
     try:
-        r = requests.get(url, stream=True)
-        with open(filepath, 'wb') as f:
-            for chunk in r.iter_content(chunk_size=1024):
-                if chunk:
-                    f.write(chunk)
-                    f.flush()
-    except requests.exceptions.RequestException as error:
+        scheduler = _scheduler_for(scheduler)
+        write = functools.partial(
+            write_stream, filepath=filepath, chunk_size=chunk_size, instrumentation=scheduler.instrumentation,
+            blob_store=blob_store)
+        _stream(url, session, scheduler, write, blob_store)
+    except (requests.exceptions.RequestException, EstatApiError) as error:
         print(error)
         return False
 
 
-def download_all_zip(urls, filepathes, max_workers=5):
+def download_all_zip(
+        urls,
+        filepathes,
+        max_workers=5,
+        session=None,
+        scheduler=None,
+        chunk_size=DEFAULT_CHUNK_SIZE,
+        blob_store=None):
     """
     Request some HTTP GET methods to the given urls (for REST API)
     and save each response as the local file.
@@ -268,13 +760,32 @@ def download_all_zip(urls, filepathes, max_workers=5):
         valid pathes to the destination files
     max_workers: int
         max number of working threads of CPUs within executing this method.
+    session: requests.Session
+        HTTP session shared by all the worker threads
+        (default: a new session with a connection per worker, closed at the end)
+    scheduler: scheduler.RequestScheduler
+        rate limiter and retry scheduler shared by all the worker threads
+        (default: a new scheduler allowing max_workers requests in flight)
+    chunk_size: int
+        size of the chunks read from the socket and written to the files
+    blob_store: blobs.BlobStore
+        content-addressed store deduplicating the downloaded files
+        (see write_stream)
     """
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        results = list(
-            tqdm(executor.map(download_zip, urls, filepathes), total=len(urls))
+    with _pool_session(session, max_workers) as session:
+        func = functools.partial(
+            download_zip,
+            session=session,
+            scheduler=_pool_scheduler(scheduler, max_workers),
+            chunk_size=chunk_size,
+            blob_store=blob_store,
         )
-        del results
-        return
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(
+                _progress(executor.map(func, urls, filepathes), total=len(urls))
+            )
+            del results
+            return
 
 
 def extract_zip(filepath, target_dir):
@@ -309,8 +820,159 @@ def extract_all_zip(filepathes, target_dirs, max_workers=5):
     """
     with ThreadPoolExecutor(max_workers=max_workers) as executor:
         results = list(
-            tqdm(executor.map(extract_zip, filepathes,
+            _progress(executor.map(extract_zip, filepathes,
                               target_dirs), total=len(filepathes))
         )
         del results
         return
+
+
+DEFAULT_SPOOL_SIZE = 64 * 1024 * 1024
+
+
+def _extract_members(f_zip, target_dir=None, pattern=None, parser=None):
+    results = []
+    for info in f_zip.infolist():
+        if info.is_dir() or (pattern is not None and not fnmatch.fnmatch(info.filename, pattern)):
+            continue
+        if parser is not None:
+            # CRC-32 is verified by ZipExtFile when the member is read to the end
+            with f_zip.open(info) as member:
+                results.append((info.filename, parser(info.filename, member)))
+        else:
+            results.append(f_zip.extract(info, target_dir))
+    return results
+
+
+def download_extract_zip(
+        url,
+        target_dir=None,
+        pattern=None,
+        parser=None,
+        session=None,
+        scheduler=None,
+        chunk_size=DEFAULT_CHUNK_SIZE,
+        spool_size=DEFAULT_SPOOL_SIZE):
+    """
+    Request a HTTP GET method to the given url and extract the members of
+    the zip-file in the response without saving the archive itself.
+    The archive is kept in memory (spilled to a temporary file only when
+    it is larger than `spool_size`), and each member is either extracted
+    in `target_dir` or streamed into `parser`.
+
+    Args:
+    =====
+    url: string
+        valid url of a .zip file
+    target_dir: path string
+        valid dir path where the members are extracted (not used with parser)
+    pattern: string
+        extract only the members whose name matches this glob pattern (e.g. "*.txt")
+    parser: callable
+        parser(member_name, fileobj) called for each member instead of
+        extracting it, e.g. lambda name, f: pd.read_csv(f, encoding="cp932")
+    session: requests.Session
+        HTTP session to reuse connections from (default: shared session)
+    scheduler: scheduler.RequestScheduler
+        rate limiter and retry scheduler (default: shared scheduler)
+    chunk_size: int
+        size of the chunks read from the socket
+    spool_size: int
+        max size in bytes of an archive kept in memory
+
+    Returns:
+    ========
+    list of extracted file pathes, or of (member name, parser result)
+    with parser (None when the download fails)
+    """
+    try:
+        scheduler = _scheduler_for(scheduler)
+        instrumentation = scheduler.instrumentation or get_default_instrumentation()
+        with tempfile.SpooledTemporaryFile(max_size=spool_size) as spool:
+
+            def read(r):
+                # starts over when the download is requested again
+                start = time.perf_counter()
+                spool.seek(0)
+                spool.truncate()
+                size = 0
+                for chunk in r.iter_content(chunk_size=chunk_size):
+                    spool.write(chunk)
+                    size += len(chunk)
+                expected = r.headers.get("Content-Length")
+                if expected is not None and "Content-Encoding" not in r.headers and int(expected) != size:
+                    raise zipfile.BadZipFile(f"incomplete download ({size}/{expected} bytes): {url}")
+                if instrumentation is not None:
+                    instrumentation.emit("download", url=r.url, bytes=size, seconds=time.perf_counter() - start)
+
+            _stream(url, session, scheduler, read)
+            spool.seek(0)
+            with zipfile.ZipFile(spool) as f_zip, stage(instrumentation, "extract"):
+                return _extract_members(f_zip, target_dir, pattern, parser)
+    except (requests.exceptions.RequestException, EstatApiError, zipfile.BadZipFile) as error:
+        print(error)
+        return None
+
+
+def download_extract_all_zip(
+        urls,
+        target_dirs=None,
+        pattern=None,
+        parser=None,
+        max_workers=5,
+        session=None,
+        scheduler=None,
+        chunk_size=DEFAULT_CHUNK_SIZE,
+        spool_size=DEFAULT_SPOOL_SIZE):
+    """
+    Download zip-files and extract their members in a single pass
+    (see download_extract_zip). Each worker extracts its archive as soon
+    as it is downloaded, so downloads and extractions overlap across the
+    workers instead of running as two separate phases, and no archive is
+    written to disk.
+    (!! This method uses multi threading when calling HTTP GET requests
+    and extracting files in order to improve the processing speed.)
+
+    Args:
+    =====
+    urls: list of strings
+        valid urls of .zip files
+    target_dirs: list of path strings
+        valid dir pathes where the members are extracted (not used with parser)
+    pattern: string
+        extract only the members whose name matches this glob pattern
+    parser: callable
+        parser(member_name, fileobj) called for each member instead of extracting it
+    max_workers: int
+        max number of working threads of CPUs within executing this method.
+    session: requests.Session
+        HTTP session shared by all the worker threads
+        (default: a new session with a connection per worker, closed at the end)
+    scheduler: scheduler.RequestScheduler
+        rate limiter and retry scheduler shared by all the worker threads
+        (default: a new scheduler allowing max_workers requests in flight)
+    chunk_size: int
+        size of the chunks read from the socket
+    spool_size: int
+        max size in bytes of an archive kept in memory (per worker)
+
+    Returns:
+    ========
+    list of the results of download_extract_zip, in the order of urls
+    """
+    if target_dirs is None:
+        target_dirs = [None] * len(urls)
+    with _pool_session(session, max_workers) as session:
+        func = functools.partial(
+            download_extract_zip,
+            pattern=pattern,
+            parser=parser,
+            session=session,
+            scheduler=_pool_scheduler(scheduler, max_workers),
+            chunk_size=chunk_size,
+            spool_size=spool_size,
+        )
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(
+                _progress(executor.map(func, urls, target_dirs), total=len(urls))
+            )
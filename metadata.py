@@ -0,0 +1,156 @@
+import sys
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Thread-safe dict bounded to `maxsize` entries, dropping the least
+    recently used one first.
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+
+def _as_list(obj):
+    # e-Stat JSON collapses one-element lists into a single object
+    if obj is None:
+        return []
+    return obj if isinstance(obj, list) else [obj]
+
+
+class MetaIndex:
+    """
+    Code lookups of a table built once from its CLASS_INF.
+
+    Every lookup is keyed on the class id of CLASS_OBJ
+    ("tab", "cat01", ..., "area", "time"), which is also the VALUE key
+    without "@" (e.g. VALUE["@area"]).
+
+    Attributes:
+    ===========
+    statsDataId: str
+        統計表ID
+    names: dict
+        class id -> class name (e.g. "area" -> "地域")
+    labels: dict
+        class id -> {code: label}
+    levels: dict
+        class id -> {code: level}
+    parents: dict
+        class id -> {code: parent code}
+    units: dict
+        class id -> {code: unit}
+    """
+
+    __slots__ = ("statsDataId", "names", "labels", "levels", "parents", "units")
+
+    def __init__(self, statsDataId=None):
+        self.statsDataId = statsDataId
+        self.names = {}
+        self.labels = {}
+        self.levels = {}
+        self.parents = {}
+        self.units = {}
+
+    @classmethod
+    def from_class_inf(cls, class_inf, statsDataId=None):
+        """
+        Build a MetaIndex from CLASS_INF of a getMetaInfo/getStatsData json.
+        """
+        intern = sys.intern
+        index = cls(statsDataId)
+        for class_obj in _as_list(class_inf.get("CLASS_OBJ")):
+            class_id = intern(class_obj["@id"])
+            index.names[class_id] = class_obj.get("@name")
+            labels, levels, parents, units = {}, {}, {}, {}
+            for item in _as_list(class_obj.get("CLASS")):
+                code = intern(item["@code"])
+                labels[code] = item.get("@name")
+                if item.get("@level"):
+                    levels[code] = int(item["@level"])
+                if "@parentCode" in item:
+                    parents[code] = intern(item["@parentCode"])
+                if "@unit" in item:
+                    units[code] = item["@unit"]
+            index.labels[class_id] = labels
+            index.levels[class_id] = levels
+            index.parents[class_id] = parents
+            index.units[class_id] = units
+        return index
+
+    @classmethod
+    def from_json(cls, json_dict):
+        """
+        Build a MetaIndex from a getMetaInfo or getStatsData (metaGetFlg=Y)
+        json response.
+        """
+        if "GET_META_INFO" in json_dict:
+            inf = json_dict["GET_META_INFO"]["METADATA_INF"]
+        else:
+            inf = json_dict["GET_STATS_DATA"]["STATISTICAL_DATA"]
+        if "CLASS_INF" not in inf:
+            raise ValueError("response has no CLASS_INF (request it with metaGetFlg=Y)")
+        statsDataId = inf.get("TABLE_INF", {}).get("@id")
+        return cls.from_class_inf(inf["CLASS_INF"], statsDataId)
+
+    def label(self, class_id, code):
+        return self.labels[class_id].get(code)
+
+    def level(self, class_id, code):
+        return self.levels[class_id].get(code)
+
+    def parent(self, class_id, code):
+        return self.parents[class_id].get(code)
+
+    def children(self, class_id, code):
+        """
+        Codes whose parent is `code`.
+        """
+        return [child for child, parent in self.parents[class_id].items() if parent == code]
+
+    def codes(self, class_id, level=None):
+        """
+        Codes of a class in CLASS_INF order, optionally only those of `level`.
+        """
+        if level is None:
+            return list(self.labels[class_id])
+        levels = self.levels[class_id]
+        return [code for code in self.labels[class_id] if levels.get(code) == level]
+
+    def decode(self, value):
+        """
+        Return {class id: label} of a VALUE record of getStatsData json.
+        """
+        return {
+            class_id: labels.get(value.get("@" + class_id))
+            for class_id, labels in self.labels.items()
+        }
@@ -0,0 +1,92 @@
+import re
+
+
+# classes a getStatsData query can be sharded on
+SHARD_CLASSES = ("area", "time", "cat01", "cat02", "cat03", "tab")
+
+
+def filter_name(class_id):
+    """
+    "area" -> "Area", "cat01" -> "Cat01" (as in cdArea, cdCat01From, lvCat01)
+    """
+    return class_id[0].upper() + class_id[1:]
+
+
+def _codes(value):
+    return [code.strip() for code in str(value).split(",") if code.strip()]
+
+
+def _chunks(items, n):
+    # n contiguous chunks of (almost) equal size
+    size, extra = divmod(len(items), n)
+    start = 0
+    for i in range(n):
+        end = start + size + (1 if i < extra else 0)
+        if end > start:
+            yield items[start:end]
+        start = end
+
+
+def _candidate_codes(meta_index, class_id, params):
+    name = filter_name(class_id)
+    if f"cd{name}" in params:
+        return _codes(params[f"cd{name}"])
+    # code ranges (From/To) compare codes, so the shards follow code order
+    codes = sorted(meta_index.codes(class_id))
+    low, high = params.get(f"cd{name}From"), params.get(f"cd{name}To")
+    return [
+        code for code in codes
+        if (low is None or code >= str(low)) and (high is None or code <= str(high))
+    ]
+
+
+def plan_shards(meta_index, shard_by="auto", n_shards=8, **params):
+    """
+    Split one getStatsData query into independent queries over disjoint
+    code ranges of one class (cdAreaFrom/cdAreaTo, cdTimeFrom/cdTimeTo,
+    cdCat01From/cdCat01To, ...), in code order, so that the shards
+    can be fetched in parallel and concatenated in order.
+
+    A code list filter on the sharded class (e.g. cdArea="01000,13000")
+    is split into shorter lists instead. Other filters (lvArea, cdTime,
+    ...) are kept in every shard.
+
+    Args:
+    =====
+    meta_index: metadata.MetaIndex
+        class information of the table
+    shard_by: str
+        class id to shard on ("area", "time", "cat01", ...) or "auto"
+        for the class with the most codes
+    n_shards: int
+        max number of shards
+    **params:
+        parameters of getStatsData
+
+    Returns:
+    ========
+    list of getStatsData parameter dicts
+    """
+    if shard_by == "auto":
+        candidates = [class_id for class_id in SHARD_CLASSES if class_id in meta_index.labels]
+        if not candidates:
+            return [dict(params)]
+        shard_by = max(candidates, key=lambda class_id: len(_candidate_codes(meta_index, class_id, params)))
+    if shard_by not in meta_index.labels:
+        raise ValueError(f"the table has no class {shard_by!r}")
+
+    name = filter_name(shard_by)
+    codes = _candidate_codes(meta_index, shard_by, params)
+    shards = []
+    for chunk in _chunks(codes, max(1, min(n_shards, len(codes)))):
+        shard = {
+            key: value for key, value in params.items()
+            if not re.match(rf"^cd{name}(From|To)?$", key)
+        }
+        if f"cd{name}" in params:
+            shard[f"cd{name}"] = ",".join(chunk)
+        else:
+            shard[f"cd{name}From"] = chunk[0]
+            shard[f"cd{name}To"] = chunk[-1]
+        shards.append(shard)
+    return shards or [dict(params)]
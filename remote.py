@@ -0,0 +1,228 @@
+import re
+from concurrent.futures import ThreadPoolExecutor
+from metadata import LRUCache
+from planner import filter_name
+
+
+# "2015..2020", "2015..", "..2020" (also with "...")
+RANGE_PATTERN = re.compile(r"^([^.]*)\.{2,3}([^.]*)$")
+
+
+def _in_range(code, low, high):
+    # prefix-aware: "2015" includes every code of 2015 ("2015000000", "2015100000", ...)
+    return (not low or code >= low) and (not high or code[:len(high)] <= high)
+
+
+def _filter_params(meta_index, class_id, codes):
+    """
+    Shortest getStatsData filter selecting `codes` of a class: nothing for
+    every code, lvXxx for every code of one level, cdXxxFrom/cdXxxTo for a
+    contiguous range of the sorted codes, cdXxx="X1,X2,..." otherwise.
+    """
+    name = filter_name(class_id)
+    all_codes = meta_index.labels[class_id]
+    selected = set(codes)
+    if selected == set(all_codes):
+        return {}
+    levels = meta_index.levels[class_id]
+    level = levels.get(codes[0])
+    if level is not None and selected == {code for code in all_codes if levels.get(code) == level}:
+        return {f"lv{name}": str(level)}
+    ordered = sorted(all_codes)
+    positions = {code: i for i, code in enumerate(ordered)}
+    indexes = sorted(positions[code] for code in selected)
+    if len(indexes) > 2 and indexes[-1] - indexes[0] == len(indexes) - 1:
+        return {f"cd{name}From": ordered[indexes[0]], f"cd{name}To": ordered[indexes[-1]]}
+    return {f"cd{name}": ",".join(codes)}
+
+
+class RemoteTable:
+    """
+    Lazy view of an e-Stat table: nothing but its class information
+    (getMetaIndex) is downloaded until a slice is accessed, and then only
+    the selected codes are requested with lvXxx / cdXxx / cdXxxFrom /
+    cdXxxTo filters of getStatsData.
+
+    The data is fetched and cached in blocks of one code of `block_by`
+    (e.g. one area) for a given selection of the other classes, so
+    selecting a few more areas later only requests the new ones.
+
+        table = client.getRemoteTable("0003148500")
+        table.loc(area="東京都", time="2015..")
+        table.loc(area=table.children("area", "00000"), cat01="000")
+
+    Args:
+    =====
+    client: estat_api.EstatRestApiClient
+    statsDataId: str
+        統計表ID
+    block_by: str
+        class id of the blocks ("area" by default when the table has areas,
+        the class with the most codes otherwise)
+    block_cache_size: int
+        max number of blocks kept in memory
+    codes_per_request: int
+        max number of block codes per getStatsData request (keeps the
+        URLs short)
+    max_workers: int
+        max number of requests sent at once
+    labels: bool
+        add "<class>_name" label columns
+    **params:
+        other getStatsData parameters of every request (e.g. lang)
+    """
+
+    def __init__(
+            self,
+            client,
+            statsDataId,
+            block_by=None,
+            block_cache_size=256,
+            codes_per_request=100,
+            max_workers=4,
+            labels=False,
+            **params):
+        self.client = client
+        self.statsDataId = statsDataId
+        self.params = params
+        self.meta_index = client.getMetaIndex(statsDataId, **params)
+        if block_by is None:
+            block_by = "area" if "area" in self.meta_index.labels else max(
+                self.meta_index.labels, key=lambda class_id: len(self.meta_index.labels[class_id])
+            )
+        if block_by not in self.meta_index.labels:
+            raise ValueError(f"the table has no class {block_by!r}")
+        self.block_by = block_by
+        self.blocks = LRUCache(block_cache_size)
+        self.codes_per_request = codes_per_request
+        self.max_workers = max_workers
+        self.labels = labels
+        self.requests = 0
+
+    def __repr__(self):
+        classes = ", ".join(f"{class_id}[{len(codes)}]" for class_id, codes in self.meta_index.labels.items())
+        return f"<RemoteTable {self.statsDataId}: {classes}>"
+
+    @property
+    def classes(self):
+        """
+        class id -> class name (e.g. "area" -> "地域")
+        """
+        return dict(self.meta_index.names)
+
+    def codes(self, class_id, level=None):
+        return self.meta_index.codes(class_id, level)
+
+    def children(self, class_id, code):
+        return self.meta_index.children(class_id, code)
+
+    def descendants(self, class_id, code, include_self=True):
+        """
+        Codes below `code` in the @parentCode hierarchy.
+        """
+        result = [code] if include_self else []
+        stack = [code]
+        while stack:
+            children = self.meta_index.children(class_id, stack.pop())
+            result.extend(children)
+            stack.extend(children)
+        return result
+
+    def resolve(self, class_id, selector):
+        """
+        Codes of a class selected by:
+            - a code or a label ("13000" or "東京都")
+            - a code prefix ("13": "13000", "13101", ...)
+            - a range of codes "2015..2020", "2015..", "..2020"
+              (prefix-aware: "..2020" includes every code of 2020),
+              or slice("2015", "2020")
+            - an int level of the hierarchy (e.g. 2 for the prefectures)
+            - a list of any of these
+        """
+        if class_id not in self.meta_index.labels:
+            raise KeyError(f"the table has no class {class_id!r}")
+        labels = self.meta_index.labels[class_id]
+        if selector is None:
+            return list(labels)
+        if isinstance(selector, (list, tuple, set)):
+            codes = []
+            for item in selector:
+                codes.extend(self.resolve(class_id, item))
+            return list(dict.fromkeys(codes))
+        if isinstance(selector, int):
+            return self.meta_index.codes(class_id, level=selector)
+        if isinstance(selector, slice):
+            low, high = selector.start, selector.stop
+        else:
+            selector = str(selector)
+            if selector in labels:
+                return [selector]
+            by_label = [code for code, label in labels.items() if label == selector]
+            if by_label:
+                return by_label
+            match = RANGE_PATTERN.match(selector)
+            if match is None:
+                codes = [code for code in labels if code.startswith(selector)]
+                if not codes:
+                    raise KeyError(f"no {class_id} code or label matches {selector!r}")
+                return codes
+            low, high = match.groups()
+        low = None if low is None else str(low)
+        high = None if high is None else str(high)
+        return [code for code in labels if _in_range(code, low, high)]
+
+    def _fetch(self, block_codes, others):
+        # one request for several blocks, split back into one frame per block
+        params = dict(self.params)
+        params.update(_filter_params(self.meta_index, self.block_by, block_codes))
+        for class_id, codes in others:
+            params.update(_filter_params(self.meta_index, class_id, list(codes)))
+        params.setdefault("logging", False)
+        self.requests += 1
+        frame = self.client.getStatsDataFrame(labels=self.labels, statsDataId=self.statsDataId, **params)
+        if self.block_by not in frame.columns:
+            return {code: frame.iloc[0:0] for code in block_codes}
+        column = frame[self.block_by].astype(str)
+        return {code: frame[column == code].reset_index(drop=True) for code in block_codes}
+
+    def loc(self, **selectors):
+        """
+        Return the selected cells as a DataFrame (same columns as
+        EstatRestApiClient.getStatsDataFrame), fetching only the blocks
+        which are not cached yet. Classes without selector are not filtered.
+
+            table.loc(area="13000", time="2015..")
+
+        Args:
+        =====
+        **selectors:
+            class id -> selector (see resolve)
+        """
+        from frames import concat_frames
+
+        block_codes = self.resolve(self.block_by, selectors.pop(self.block_by, None))
+        others = tuple(
+            (class_id, tuple(self.resolve(class_id, selector)))
+            for class_id, selector in sorted(selectors.items())
+        )
+        if not block_codes or any(not codes for _, codes in others):
+            return concat_frames([])
+        frames = {}
+        missing = []
+        for code in block_codes:
+            frame = self.blocks.get((code, others))
+            if frame is None:
+                missing.append(code)
+            else:
+                frames[code] = frame
+        if missing:
+            chunks = [
+                missing[i:i + self.codes_per_request]
+                for i in range(0, len(missing), self.codes_per_request)
+            ]
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                for fetched in executor.map(lambda chunk: self._fetch(chunk, others), chunks):
+                    for code, frame in fetched.items():
+                        self.blocks.put((code, others), frame)
+                        frames[code] = frame
+        return concat_frames([frames[code] for code in block_codes])
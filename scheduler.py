@@ -0,0 +1,373 @@
+import re
+import time
+import random
+import threading
+from collections import deque
+import requests
+from instrumentation import endpoint_label, get_default_instrumentation
+
+
+# "STATUS":100 (json), <STATUS>100</STATUS> (xml), "STATUS","100" (csv)
+STATUS_PATTERN = re.compile(rb'"STATUS":\s*"?(\d+)|<STATUS>(\d+)</STATUS>|"STATUS","(\d+)"')
+ERROR_MSG_PATTERN = re.compile(rb'"ERROR_MSG":\s*"([^"]*)"|<ERROR_MSG>([^<]*)</ERROR_MSG>|"ERROR_MSG","([^"]*)"')
+STATUS_SCAN_SIZE = 4096
+
+# HTTP statuses which are worth retrying, and those meaning "slow down"
+RETRY_HTTP_STATUSES = (429, 500, 502, 503, 504)
+THROTTLE_HTTP_STATUSES = (429, 503)
+
+RETRY_EXCEPTIONS = (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+)
+
+
+class EstatApiError(Exception):
+    """
+    e-Stat API returned an error RESULT.STATUS (>= 100).
+
+    Attributes:
+    ===========
+    status: int
+        RESULT.STATUS
+    message: str
+        RESULT.ERROR_MSG
+    url: str
+        requested url
+    """
+
+    def __init__(self, status, message=None, url=None):
+        super().__init__(f"STATUS {status}: {message} ({url})")
+        self.status = status
+        self.message = message
+        self.url = url
+
+
+def api_status(content):
+    """
+    Return (RESULT.STATUS, RESULT.ERROR_MSG) found in the head of a
+    response body, or (None, None).
+    """
+    head = content[:STATUS_SCAN_SIZE]
+    match = STATUS_PATTERN.search(head)
+    if match is None:
+        return None, None
+    status = int(next(group for group in match.groups() if group))
+    match = ERROR_MSG_PATTERN.search(head)
+    message = None
+    if match is not None:
+        message = next(group for group in match.groups() if group is not None).decode("utf-8", errors="replace")
+    return status, message
+
+
+class RequestScheduler:
+    """
+    Rate limiter and retry scheduler shared by every request of a client
+    and the io_utils download_all_* workers.
+
+    - a token bucket keeps the request rate under `rate` per second
+    - at most `max_concurrency` requests are in flight at once
+    - failed requests (connection errors, timeouts, RETRY_HTTP_STATUSES,
+      `retry_api_statuses`) are retried with exponential backoff and jitter
+    - when the server throttles (429/503), the rate and the concurrency are
+      halved, and they grow back slowly while requests succeed (AIMD)
+
+    Args:
+    =====
+    rate: float
+        max requests per second (None = unlimited until throttled)
+    burst: int
+        token bucket size
+    max_concurrency: int
+        max number of requests in flight
+    max_retries: int
+        max number of retries of a request
+    backoff: float
+        base backoff in seconds (doubled at each retry)
+    max_backoff: float
+        max backoff in seconds
+    min_rate: float
+        lower bound of the rate when throttled
+    retry_api_statuses: tuple of int
+        RESULT.STATUS values which are retried instead of raised
+    instrumentation: instrumentation.Instrumentation
+        receives "request", "retry", "throttle" and "error" events of every
+        call (default: instrumentation.get_default_instrumentation())
+    """
+
+    def __init__(
+            self,
+            rate=None,
+            burst=10,
+            max_concurrency=10,
+            max_retries=5,
+            backoff=0.5,
+            max_backoff=60.0,
+            min_rate=0.5,
+            retry_api_statuses=(),
+            instrumentation=None):
+        self.rate = rate
+        self.max_rate = rate
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.min_rate = min_rate
+        self.retry_api_statuses = tuple(retry_api_statuses)
+        self.instrumentation = instrumentation
+        self._tokens = float(burst)
+        self._last_refill = time.monotonic()
+        self._in_flight = 0
+        self._successes = 0
+        self._recent = deque(maxlen=100)
+        self._lock = threading.Lock()
+        self._slot_free = threading.Condition(self._lock)
+
+    def _acquire_token(self):
+        while True:
+            with self._lock:
+                if self.rate is None:
+                    return
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate)
+                self._last_refill = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def _acquire_slot(self):
+        with self._slot_free:
+            while self._in_flight >= self.concurrency:
+                self._slot_free.wait()
+            self._in_flight += 1
+            self._recent.append(time.monotonic())
+
+    def _release_slot(self):
+        with self._slot_free:
+            self._in_flight -= 1
+            self._slot_free.notify()
+
+    def _observed_rate(self):
+        if len(self._recent) < 2:
+            return float(self.max_concurrency)
+        elapsed = self._recent[-1] - self._recent[0]
+        return len(self._recent) / elapsed if elapsed > 0 else float(self.max_concurrency)
+
+    def on_throttle(self):
+        """
+        Multiplicative decrease of the rate and the concurrency.
+        """
+        with self._lock:
+            current = self._observed_rate() if self.rate is None else self.rate
+            self.rate = max(self.min_rate, current / 2)
+            self._tokens = min(self._tokens, 1.0)
+            self.concurrency = max(1, self.concurrency // 2)
+            self._successes = 0
+
+    def on_success(self):
+        """
+        Additive increase of the rate and the concurrency.
+        """
+        with self._slot_free:
+            self._successes += 1
+            if self._successes < self.concurrency:
+                return
+            self._successes = 0
+            if self.concurrency < self.max_concurrency:
+                self.concurrency += 1
+                self._slot_free.notify()
+            if self.rate is not None:
+                self.rate += 1.0
+                if self.max_rate is not None and self.rate >= self.max_rate:
+                    self.rate = self.max_rate
+                elif self.max_rate is None and self.concurrency == self.max_concurrency:
+                    # recovered: unlimited again
+                    self.rate = None
+
+    def _sleep(self, attempt, retry_after=None):
+        delay = min(self.max_backoff, self.backoff * (2 ** attempt))
+        # full jitter
+        delay = random.uniform(0, delay)
+        if retry_after is not None:
+            try:
+                delay = max(delay, float(retry_after))
+            except ValueError:
+                pass
+        time.sleep(delay)
+
+    def call(self, func, *args, check_status=True, hold_slot=False, **kwargs):
+        """
+        Call `func(*args, **kwargs)` (e.g. session.get) returning a
+        requests.Response under the rate limit, retrying transient
+        failures. Raise the last error once the retries are exhausted,
+        requests.HTTPError for HTTP errors and EstatApiError for API errors.
+
+        Args:
+        =====
+        func: callable
+            function sending the request
+        check_status: bool
+            check RESULT.STATUS in the head of the body
+            (reads the whole body of streamed responses)
+        hold_slot: bool
+            keep the concurrency slot of the request until the response is
+            closed, for streamed bodies read after the call (the caller
+            must close the response)
+        """
+        instrumentation = self.instrumentation or get_default_instrumentation()
+        if instrumentation is None:
+            return self._call(func, args, kwargs, check_status, hold_slot=hold_slot)
+        url = args[0] if args else kwargs.get("url")
+        api = endpoint_label(url)
+        stats = {"api": api, "url": url, "instrumentation": instrumentation}
+        start = time.perf_counter()
+        with instrumentation.span("estat.request", api=api, url=url):
+            try:
+                res = self._call(func, args, kwargs, check_status, stats, hold_slot)
+            except Exception as error:
+                instrumentation.emit("error", api=api, url=url, error=error, retries=stats.get("retries", 0))
+                raise
+        content_length = res.headers.get("Content-Length")
+        instrumentation.emit(
+            "request",
+            api=api,
+            url=res.url,
+            status=res.status_code,
+            seconds=time.perf_counter() - start,
+            ttfb=res.elapsed.total_seconds(),
+            transfer=stats.get("transfer"),
+            bytes=stats.get("bytes", int(content_length) if content_length and content_length.isdigit() else None),
+            retries=stats.get("retries", 0),
+        )
+        return res
+
+    def stream(self, func, consume, *args, **kwargs):
+        """
+        Call `func(*args, **kwargs)` like call() for a streamed response
+        and return `consume(response)`. The body is read by `consume`
+        outside the retried call, so a connection broken while it is read
+        (RETRY_EXCEPTIONS) requests the whole response again with backoff.
+        The concurrency slot of the request is held until `consume` returns.
+
+        Args:
+        =====
+        func: callable
+            function sending the request (e.g. session.get with stream=True)
+        consume: callable
+            consume(response) reading the body (it must be able to start over)
+        """
+        instrumentation = self.instrumentation or get_default_instrumentation()
+        url = args[0] if args else kwargs.get("url")
+        attempt = 0
+        while True:
+            res = self.call(func, *args, hold_slot=True, **kwargs)
+            try:
+                return consume(res)
+            except RETRY_EXCEPTIONS as error:
+                if attempt >= self.max_retries:
+                    raise
+                if instrumentation is not None:
+                    instrumentation.emit("retry", api=endpoint_label(url), url=url, reason=type(error).__name__)
+            finally:
+                res.close()
+            self._sleep(attempt)
+            attempt += 1
+
+    def _retry(self, stats, reason):
+        if stats is None:
+            return
+        stats["retries"] = stats.get("retries", 0) + 1
+        stats["instrumentation"].emit("retry", api=stats["api"], url=stats["url"], reason=reason)
+
+    def _hold_slot(self, res):
+        # the slot is released once, when the response is closed
+        close = res.close
+        released = []
+
+        def close_and_release():
+            try:
+                close()
+            finally:
+                if not released:
+                    released.append(True)
+                    self._release_slot()
+
+        res.close = close_and_release
+
+    def _call(self, func, args, kwargs, check_status, stats=None, hold_slot=False):
+        attempt = 0
+        while True:
+            self._acquire_token()
+            self._acquire_slot()
+            try:
+                res, retry_after = self._attempt(func, args, kwargs, check_status, stats, attempt)
+            except BaseException:
+                self._release_slot()
+                raise
+            if res is None or not hold_slot:
+                # the body has been read (or is not needed): the slot is free
+                self._release_slot()
+            if res is None:
+                self._sleep(attempt, retry_after)
+                attempt += 1
+                continue
+            if hold_slot:
+                self._hold_slot(res)
+            self.on_success()
+            return res
+
+    def _attempt(self, func, args, kwargs, check_status, stats, attempt):
+        # one request: (response, None), or (None, Retry-After) to retry it
+        try:
+            res = func(*args, **kwargs)
+        except RETRY_EXCEPTIONS as error:
+            if attempt >= self.max_retries:
+                raise
+            self._retry(stats, type(error).__name__)
+            return None, None
+
+        if res.status_code in RETRY_HTTP_STATUSES:
+            if res.status_code in THROTTLE_HTTP_STATUSES:
+                self.on_throttle()
+                if stats is not None:
+                    stats["instrumentation"].emit("throttle", api=stats["api"], url=stats["url"])
+            if attempt >= self.max_retries:
+                res.raise_for_status()
+            res.close()
+            self._retry(stats, res.status_code)
+            return None, res.headers.get("Retry-After")
+        res.raise_for_status()
+
+        if check_status and res.status_code == 200:
+            transfer_start = time.perf_counter()
+            content = res.content
+            if stats is not None:
+                stats["transfer"] = time.perf_counter() - transfer_start
+                stats["bytes"] = len(content)
+            status, message = api_status(content)
+            if status is not None and status >= 100:
+                if status in self.retry_api_statuses and attempt < self.max_retries:
+                    self._retry(stats, f"STATUS {status}")
+                    return None, None
+                raise EstatApiError(status, message, res.url)
+        return res, None
+
+
+_default_scheduler = None
+_default_scheduler_lock = threading.Lock()
+
+
+def get_default_scheduler():
+    """
+    Return the process-wide RequestScheduler used when no scheduler is given.
+    """
+    global _default_scheduler
+    with _default_scheduler_lock:
+        if _default_scheduler is None:
+            _default_scheduler = RequestScheduler()
+        return _default_scheduler
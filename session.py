@@ -0,0 +1,68 @@
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+
+# (connect, read) timeouts in seconds
+DEFAULT_TIMEOUT = (10, 60)
+
+
+class EstatSession(requests.Session):
+    """
+    requests.Session with a keep-alive connection pool and default timeouts.
+    One session should be shared by the client and every worker thread so
+    that TCP+TLS connections to api.e-stat.go.jp are reused between calls.
+
+    Args:
+    =====
+    pool_connections: int
+        number of per-host connection pools to keep
+    pool_maxsize: int
+        max number of connections kept alive per host
+        (set this to the number of worker threads)
+    pool_block: bool
+        block when all the connections to a host are in use
+        instead of opening a throwaway connection
+    timeout: float or (float, float)
+        default (connect, read) timeout in seconds for every request
+    keep_alive: bool
+        reuse connections between requests
+    """
+
+    def __init__(
+            self,
+            pool_connections=10,
+            pool_maxsize=10,
+            pool_block=False,
+            timeout=DEFAULT_TIMEOUT,
+            keep_alive=True):
+        super().__init__()
+        self.timeout = timeout
+        adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=pool_block,
+        )
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+        if not keep_alive:
+            self.headers["Connection"] = "close"
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return super().request(method, url, **kwargs)
+
+
+_default_session = None
+_default_session_lock = threading.Lock()
+
+
+def get_default_session():
+    """
+    Return the process-wide EstatSession used when no session is given.
+    """
+    global _default_session
+    with _default_session_lock:
+        if _default_session is None:
+            _default_session = EstatSession()
+        return _default_session
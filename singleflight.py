@@ -0,0 +1,74 @@
+import threading
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent identical calls across threads: while a call for
+    a key is in flight, other callers with the same key wait for it and
+    get the same result (or exception) instead of calling again.
+    Nothing is kept once the call returns (this is not a cache).
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.done.wait()
+        else:
+            try:
+                call.result = func(*args, **kwargs)
+            except BaseException as error:
+                call.error = error
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def __len__(self):
+        return len(self._calls)
+
+
+class AsyncSingleFlight:
+    """
+    asyncio version of SingleFlight: concurrent identical coroutine calls
+    on the same event loop share one task.
+    """
+
+    def __init__(self):
+        self._calls = {}
+
+    async def do(self, key, func, *args, **kwargs):
+        import asyncio
+
+        future = self._calls.get(key)
+        if future is None:
+            future = self._calls[key] = asyncio.ensure_future(func(*args, **kwargs))
+            future.add_done_callback(lambda done: self._forget(key, done))
+        # shield: a cancelled waiter must not cancel the call of the others
+        return await asyncio.shield(future)
+
+    def _forget(self, key, future):
+        if self._calls.get(key) is future:
+            del self._calls[key]
+
+    def __len__(self):
+        return len(self._calls)
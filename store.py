@@ -0,0 +1,215 @@
+import os
+import re
+import uuid
+import shutil
+
+
+# cdArea, cdTimeFrom, cdCat01To, ... -> (class id, None/"From"/"To")
+FILTER_PATTERN = re.compile(r"^cd(Tab|Time|Area|Cat\d\d)(From|To)?$")
+LEVEL_PATTERN = re.compile(r"^lv(Tab|Time|Area|Cat\d\d)$")
+
+# file of a table directory naming its current version directory
+CURRENT = "CURRENT"
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+        import pyarrow.dataset
+    except ImportError:
+        raise ImportError("store.ParquetStore requires pyarrow (pip install pyarrow)")
+    return pyarrow
+
+
+def _codes(value):
+    # "X1, X2, X3" -> ["X1", "X2", "X3"]
+    if isinstance(value, (list, tuple, set)):
+        return [str(code) for code in value]
+    return [code.strip() for code in str(value).split(",") if code.strip()]
+
+
+def _levels(value):
+    # "X" or "X-X" or "-X" or "X-" -> (min, max)
+    value = str(value)
+    if "-" not in value:
+        return int(value), int(value)
+    low, high = value.split("-", 1)
+    return (int(low) if low else None), (int(high) if high else None)
+
+
+def build_filter(filters, meta_index=None):
+    """
+    Translate getStatsData filter parameters (cdArea, cdTimeFrom, cdCat01To,
+    lvArea, ...) into a pyarrow.dataset expression, or None without filters.
+    Level filters (lvXxx) need the metadata.MetaIndex of the table.
+    """
+    pa = _import_pyarrow()
+    ds = pa.dataset
+    expression = None
+    for key, value in filters.items():
+        if value is None:
+            continue
+        match = FILTER_PATTERN.match(key)
+        if match is not None:
+            field = ds.field(match.group(1).lower())
+            if match.group(2) is None:
+                condition = field.isin(_codes(value))
+            elif match.group(2) == "From":
+                condition = field >= str(value)
+            else:
+                condition = field <= str(value)
+        else:
+            match = LEVEL_PATTERN.match(key)
+            if match is None:
+                raise ValueError(f"unsupported filter: {key}")
+            if meta_index is None:
+                raise ValueError(f"{key} needs the meta_index of the table")
+            class_id = match.group(1).lower()
+            low, high = _levels(value)
+            codes = [
+                code for code, level in meta_index.levels[class_id].items()
+                if (low is None or level >= low) and (high is None or level <= high)
+            ]
+            condition = ds.field(class_id).isin(codes)
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+class ParquetStore:
+    """
+    Local columnar store of getStatsData results.
+
+    Every table is saved as zstd-compressed Parquet files partitioned by
+    `@time` under `{root}/{statsDataId}/time={time code}/`, with dictionary
+    encoded code columns and a float "value" column (see
+    EstatRestApiClient.getStatsDataFrame). Queries take the same filter
+    parameters as getStatsData (cdArea, cdTime, cdTimeFrom, cdCat01, ...)
+    and push them down to the files: time filters prune partitions, and
+    the other filters skip row groups using the Parquet statistics.
+    Requires pyarrow.
+
+    Args:
+    =====
+    root: str
+        root directory of the store
+    compression: str
+        Parquet compression codec
+    """
+
+    def __init__(self, root="./downloads/store", compression="zstd"):
+        self.root = root
+        self.compression = compression
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, statsDataId):
+        return os.path.join(self.root, statsDataId)
+
+    def current(self, statsDataId):
+        """
+        Return the directory of the current version of a table, or None.
+        """
+        target = self.path(statsDataId)
+        try:
+            with open(os.path.join(target, CURRENT), encoding="utf-8") as f:
+                return os.path.join(target, f.read().strip())
+        except FileNotFoundError:
+            # tables written before versions: the files are in the table directory
+            return target if os.path.isdir(target) else None
+
+    def tables(self):
+        return sorted(
+            name for name in os.listdir(self.root)
+            if os.path.isdir(os.path.join(self.root, name)) and not name.startswith(".")
+        )
+
+    def __contains__(self, statsDataId):
+        return self.current(statsDataId) is not None
+
+    def write(self, statsDataId, frame):
+        """
+        Save (replace) a table given as a pandas.DataFrame or pyarrow.Table
+        with a "time" column.
+
+        Every write is a new version directory of the table, published by
+        atomically replacing its CURRENT file, so that readers always see a
+        complete version. The previous version is kept for the readers still
+        reading it and removed by the next write.
+        """
+        pa = _import_pyarrow()
+        table = frame if isinstance(frame, pa.Table) else pa.Table.from_pandas(frame, preserve_index=False)
+        if "time" in table.column_names:
+            # partition values are plain strings on disk
+            table = table.set_column(
+                table.column_names.index("time"), "time", table.column("time").cast(pa.string())
+            )
+        target = self.path(statsDataId)
+        version = f"v{uuid.uuid4().hex}"
+        tmp_target = os.path.join(self.root, f".{statsDataId}.{version}.tmp")
+        pa.parquet.write_to_dataset(
+            table,
+            root_path=tmp_target,
+            partition_cols=["time"] if "time" in table.column_names else None,
+            compression=self.compression,
+        )
+        previous = self.current(statsDataId)
+        os.makedirs(target, exist_ok=True)
+        os.rename(tmp_target, os.path.join(target, version))
+        tmp_pointer = os.path.join(target, f".{CURRENT}.{version}.tmp")
+        with open(tmp_pointer, "w", encoding="utf-8") as f:
+            f.write(version)
+        os.replace(tmp_pointer, os.path.join(target, CURRENT))
+        keep = {version, CURRENT, None if previous is None else os.path.basename(previous)}
+        for name in os.listdir(target):
+            if previous == target and not name.startswith("v"):
+                # the files of a table written before versions are its previous version
+                continue
+            if name not in keep and not name.startswith("."):
+                path = os.path.join(target, name)
+                if os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    os.remove(path)
+
+    def ingest(self, client, statsDataId, **kwargs):
+        """
+        Fetch a table with client.getStatsDataFrame and save it.
+        """
+        frame = client.getStatsDataFrame(as_arrow=True, statsDataId=statsDataId, **kwargs)
+        self.write(statsDataId, frame)
+
+    def delete(self, statsDataId):
+        shutil.rmtree(self.path(statsDataId), ignore_errors=True)
+
+    def query(self, statsDataId, columns=None, meta_index=None, as_arrow=False, **filters):
+        """
+        Read a table filtered like getStatsData.
+
+            store.query("0003148500", cdArea="13000,14000", cdTimeFrom="2010000000")
+
+        Args:
+        =====
+        statsDataId: str
+            統計表ID
+        columns: list of str
+            columns to read (default: all)
+        meta_index: metadata.MetaIndex
+            needed by level filters (lvArea, lvTime, ...)
+        as_arrow: bool
+            return a pyarrow.Table instead of a pandas.DataFrame
+        **filters:
+            cdTab, cdTime, cdArea, cdCat01, ... (codes, comma separated),
+            cdXxxFrom / cdXxxTo (code range), lvXxx (level range)
+        """
+        pa = _import_pyarrow()
+        if statsDataId not in self:
+            raise KeyError(statsDataId)
+        partitioning = pa.dataset.partitioning(pa.schema([("time", pa.string())]), flavor="hive")
+        table = pa.parquet.read_table(
+            self.current(statsDataId),
+            columns=columns,
+            filters=build_filter(filters, meta_index),
+            partitioning=partitioning,
+            memory_map=True,
+        )
+        return table if as_arrow else table.to_pandas()
@@ -0,0 +1,173 @@
+import re
+import csv
+import json
+import codecs
+
+
+# <NEXT_KEY>11</NEXT_KEY> (xml), "NEXT_KEY","11" (csv), "NEXT_KEY":11 (json/jsonp)
+NEXT_KEY_PATTERN = re.compile(r'<NEXT_KEY>(\d+)</NEXT_KEY>|"NEXT_KEY","(\d+)"|"NEXT_KEY":\s*"?(\d+)')
+NEXT_KEY_SCAN_SIZE = 65536
+
+VALUE_PATTERN = re.compile(r'"VALUE"\s*:\s*')
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+
+def find_next_key(text):
+    """
+    Return the <NEXT_KEY> value found in the head of a response body, or None.
+    """
+    # RESULT_INF always precedes the data section, so there is no need
+    # to scan the whole (possibly huge) body.
+    match = NEXT_KEY_PATTERN.search(text[:NEXT_KEY_SCAN_SIZE])
+    if match is None:
+        return None
+    return int(next(group for group in match.groups() if group))
+
+
+def iter_text(chunks, encoding="utf-8"):
+    """
+    Decode an iterable of byte chunks incrementally.
+    """
+    decoder = codecs.getincrementaldecoder(encoding)(errors="strict")
+    for chunk in chunks:
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    text = decoder.decode(b"", final=True)
+    if text:
+        yield text
+
+
+def iter_lines(chunks, encoding="utf-8"):
+    """
+    Decode an iterable of byte chunks into lines, line endings kept
+    (as expected by csv.reader for quoted fields spanning lines).
+    """
+    pending = ""
+    for text in iter_text(chunks, encoding):
+        lines = (pending + text).splitlines(keepends=True)
+        # the last line may continue in the next chunk
+        pending = lines.pop() if lines and not lines[-1].endswith(("\n", "\r")) else ""
+        for line in lines:
+            yield line
+    if pending:
+        yield pending
+
+
+def iter_csv_rows(chunks, encoding="utf-8", info=None):
+    """
+    Parse a getSimpleStatsData csv stream and yield each row as a list,
+    the first one being the column header. The section headers output
+    with sectionHeaderFlg=1 are skipped; their "KEY","value" pairs
+    (e.g. NEXT_KEY) are stored in `info` if a dict is given.
+
+    Args:
+    =====
+    chunks: iterable of bytes
+        response body, e.g. requests.Response.iter_content(chunk_size)
+    encoding: str
+        encoding of the response body
+    info: dict
+        receives the key-value pairs of the section headers
+    """
+    reader = csv.reader(iter_lines(chunks, encoding))
+    for row in reader:
+        if len(row) > 1:
+            # no section headers (sectionHeaderFlg=2): this is the column header
+            yield row
+            break
+        # section headers end with the "VALUE" line followed by the column header
+        while row != ["VALUE"]:
+            if info is not None and len(row) == 2:
+                info[row[0]] = row[1]
+            row = next(reader, None)
+            if row is None:
+                return
+        break
+    for row in reader:
+        yield row
+
+
+def iter_json_values(chunks, encoding="utf-8", info=None, decoder=None):
+    """
+    Parse a getStatsData json stream and yield the VALUE records one by one
+    without building the whole document. NEXT_KEY found before DATA_INF is
+    stored in `info` if a dict is given.
+
+    Args:
+    =====
+    chunks: iterable of bytes
+        response body, e.g. requests.Response.iter_content(chunk_size)
+    encoding: str
+        encoding of the response body
+    info: dict
+        receives NEXT_KEY
+    decoder: json.JSONDecoder
+        decoder of each VALUE record
+    """
+    decoder = json.JSONDecoder() if decoder is None else decoder
+    texts = iter_text(chunks, encoding)
+    buf = ""
+    head = ""
+
+    # skip everything up to "VALUE":, keeping the head where RESULT_INF is
+    for text in texts:
+        buf += text
+        match = VALUE_PATTERN.search(buf)
+        if match is not None:
+            if len(head) < NEXT_KEY_SCAN_SIZE:
+                head += buf[:match.start()]
+            buf = buf[match.end():]
+            break
+        # keep the tail in case the pattern spans two chunks
+        if len(head) < NEXT_KEY_SCAN_SIZE:
+            head += buf[:-16]
+        buf = buf[-16:]
+    else:
+        return
+    next_key = find_next_key(head)
+    if info is not None and next_key is not None:
+        info["NEXT_KEY"] = next_key
+    del head
+
+    def fill(buf):
+        for text in texts:
+            return buf + text, True
+        return buf, False
+
+    pos = 0
+    single = None
+    while True:
+        # skip separators
+        while pos < len(buf) and buf[pos] in " \t\r\n,":
+            pos += 1
+        if pos == len(buf):
+            buf, more = fill(buf[pos:])
+            pos = 0
+            if not more:
+                return
+            continue
+        if single is None:
+            # VALUE is an object instead of an array when there is one record
+            single = buf[pos] != "["
+            if not single:
+                pos += 1
+            continue
+        if buf[pos] == "]":
+            break
+        try:
+            value, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            buf, more = fill(buf[pos:])
+            pos = 0
+            if not more:
+                raise
+            continue
+        yield value
+        pos = end
+        if single:
+            break
+    # drain the rest so that the connection goes back to the pool
+    for _ in texts:
+        pass